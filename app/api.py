@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+import io
+import math
+import time
+import weakref
+
+import numpy as np
+from aiohttp import web
+
+from app.routes import ANALYSIS_STAGES, report_file, run_analysis, with_exact_gradcam
+from backend import config
+from backend.budgets import get_budget
+from backend.images import DecodedImage
+from backend.inference import get_registry
+from backend.jobs import FINAL_STATES, JobManager
+from backend.quality import ImageRejected, assess_quality
+from backend.report_generator import mime_type
+from backend.similar import similar_cases
+from backend.startup import get_startup
+from backend.telemetry import CONTENT_TYPE, get_metrics, get_trace_log, render_metrics
+from backend.uploads import get_upload_store
+
+# Headless HTTP API over the same pipeline the Streamlit UI runs:
+#   POST   /v1/analyze                  image bytes (raw body or multipart field 'image') -> job
+#   GET    /v1/jobs/{id}?wait=S         job status and partial results, long-polling up to S seconds
+#   DELETE /v1/jobs/{id}                cancel
+#   GET    /v1/jobs/{id}/results/{key}  an array result: encoded image bytes or .npy
+#   POST   /v1/jobs/{id}/gradcam        compute exact Grad-CAM for a finished analysis
+#   GET    /v1/jobs/{id}/report         the HTML report, streamed from disk
+#   GET    /v1/jobs/{id}/similar?k=N    the N most similar past cases of a finished analysis
+#   GET    /v1/traces[/{id}]            recent and slowest request traces (the job id is the trace id)
+#   GET    /metrics                     Prometheus text format
+#   GET    /healthz
+# Arrays are never inlined in JSON; they appear as {"artifact": url, "dtype", "shape"}.
+MAX_WAIT = 30.0
+MODEL_NAMES = ("segmentation", "classification", "llm")
+
+_REQUESTS = get_metrics().counter("safeheal_http_requests_total", "API requests by route and status", ("route", "status"))
+_REQUEST_SECONDS = get_metrics().histogram("safeheal_http_request_seconds", "API request handling time", ("route",))
+
+
+def to_json(value, url):
+    """JSON-safe copy of a job result, with arrays replaced by artifact links under url"""
+    if isinstance(value, np.ndarray):
+        return {"artifact": url, "dtype": value.dtype.str, "shape": list(value.shape)}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {key: to_json(item, f"{url}/{key}") for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item, url) for item in value]
+    return value
+
+
+def _run_and_release(job, image, *args, **kwargs):
+    # Finished jobs keep only the encoded upload; Grad-CAM requests decode it again
+    try:
+        return run_analysis(job, image, *args, **kwargs)
+    finally:
+        image.release()
+
+
+class AnalysisService:
+    """Owns the models and job pool the HTTP handlers share"""
+
+    def __init__(self, workers=None):
+        startup = get_startup().start()
+        if not startup.wait():
+            raise RuntimeError(f"Model warm-up failed: {startup.error}")
+        self.jobs = JobManager(workers=workers)
+        registry = get_registry()
+        self.models = {name: registry.acquire(name) for name in MODEL_NAMES}
+        # Uploaded bytes live as long as their job does, for on-demand Grad-CAM
+        self.images = weakref.WeakKeyDictionary()
+
+    def submit(self, data, include_gradcam=False, depth=None, check_quality=True):
+        """Gate, store and start analysing an upload; raises ImageRejected for unusable photos"""
+        image = DecodedImage(data)
+        report = None
+        if check_quality and config.QUALITY_GATE != "off":
+            # Rejected before anything is stored or queued for the models
+            report = assess_quality(image)
+            if report.rejected:
+                raise ImageRejected(report)
+        if config.UPLOAD_STORE:
+            # The bytes are already in memory; the store reuses their digest
+            get_upload_store().put(data, sha256=image.sha256)
+        job = self.jobs.submit(
+            _run_and_release, ANALYSIS_STAGES, image,
+            self.models["segmentation"], self.models["classification"], self.models["llm"],
+            include_gradcam=include_gradcam, depth=depth,
+        )
+        if report is not None:
+            job.publish("quality", report.to_dict())
+        # Lets a Grad-CAM request re-read the upload from the store if the in-memory copy is gone
+        job.publish("sha256", image.sha256)
+        self.images[job] = image
+        return job
+
+    def job(self, request):
+        job = self.jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound(reason="Unknown job")
+        return job
+
+    def snapshot(self, job):
+        state = job.snapshot()
+        state["results"] = to_json(state["results"], f"/v1/jobs/{job.id}/results")
+        state["results"].pop("report", None)
+        if "analysis" in state["results"]:
+            state["report_url"] = f"/v1/jobs/{job.id}/report"
+        for name in [k for k in state["results"].get("analysis", {}) if k.startswith("activation_")]:
+            del state["results"]["analysis"][name]
+        return state
+
+    def close(self):
+        self.jobs.shutdown(wait=False)
+        for handle in self.models.values():
+            handle.release()
+
+
+async def _read_image(request):
+    if request.content_type.startswith("multipart/"):
+        async for part in await request.multipart():
+            if part.name == "image":
+                return await part.read(decode=True)
+        raise web.HTTPBadRequest(reason="Multipart upload has no 'image' field")
+    data = await request.read()
+    if not data:
+        raise web.HTTPBadRequest(reason="Empty request body")
+    return data
+
+
+def _wait_seconds(request):
+    """The ?wait= long-poll time, clamped to [0, MAX_WAIT] seconds; 400 unless it is a number"""
+    try:
+        wait = float(request.query.get("wait", 0))
+    except ValueError:
+        wait = math.nan
+    if math.isnan(wait):
+        raise web.HTTPBadRequest(reason="wait must be a number of seconds")
+    return min(max(wait, 0.0), MAX_WAIT)
+
+
+async def analyze(request):
+    service = request.app["service"]
+    try:
+        depth = get_budget(request.query.get("depth")).name
+    except ValueError as exc:
+        raise web.HTTPBadRequest(reason=str(exc))
+    # Checked before the upload is read, so a bad parameter never starts a job
+    wait = _wait_seconds(request)
+    data = await _read_image(request)
+    # Off the event loop, since the quality gate decodes the upload and storing it writes to disk
+    try:
+        job = await asyncio.get_running_loop().run_in_executor(
+            None, service.submit, data, request.query.get("gradcam") == "1", depth, request.query.get("quality") != "0"
+        )
+    except ImageRejected as exc:
+        return web.json_response({"error": "Image rejected by the quality gate", "quality": exc.report.to_dict()}, status=422)
+    if wait > 0:
+        await asyncio.get_running_loop().run_in_executor(None, job.wait, wait)
+    state = service.snapshot(job)
+    status = 200 if state["status"] in FINAL_STATES else 202
+    headers = {"Location": f"/v1/jobs/{job.id}", "X-Correlation-ID": job.id}
+    return web.json_response(state, status=status, headers=headers)
+
+
+async def job_status(request):
+    service = request.app["service"]
+    job = service.job(request)
+    wait = _wait_seconds(request)
+    if wait > 0 and not job.finished:
+        await asyncio.get_running_loop().run_in_executor(None, job.wait, wait)
+    return web.json_response(service.snapshot(job))
+
+
+async def cancel_job(request):
+    service = request.app["service"]
+    job = service.job(request)
+    job.cancel()
+    return web.json_response(service.snapshot(job))
+
+
+async def job_artifact(request):
+    job = request.app["service"].job(request)
+    value = job.snapshot()["results"]
+    for key in request.match_info["path"].split("/"):
+        if not isinstance(value, dict) or key not in value:
+            raise web.HTTPNotFound(reason="Unknown result")
+        value = value[key]
+    if not isinstance(value, np.ndarray):
+        raise web.HTTPNotFound(reason="Result is not an array")
+    if request.match_info["path"].endswith(("_image", "_display")):
+        data = value.tobytes()
+        return web.Response(body=data, content_type=mime_type(data))
+    buffer = io.BytesIO()
+    np.save(buffer, value, allow_pickle=False)
+    return web.Response(body=buffer.getvalue(), content_type="application/x-npy")
+
+
+def _analysis(job):
+    analysis = job.snapshot()["results"].get("analysis")
+    if analysis is None:
+        raise web.HTTPConflict(reason="Analysis has not finished")
+    return analysis
+
+
+def _stored_upload(job):
+    """The job's upload read back from the upload store; 410 Gone when it was not kept"""
+    sha256 = job.snapshot()["results"].get("sha256")
+    stored = get_upload_store().find(sha256) if sha256 and config.UPLOAD_STORE else None
+    if stored is None:
+        raise web.HTTPGone(reason="The uploaded image of this job is no longer available")
+    return DecodedImage.from_upload(stored)
+
+
+async def exact_gradcam(request):
+    service = request.app["service"]
+    job = service.job(request)
+    analysis = _analysis(job)
+    loop = asyncio.get_running_loop()
+    image = service.images.get(job)
+    if image is None:
+        image = await loop.run_in_executor(None, _stored_upload, job)
+    analysis = await loop.run_in_executor(None, with_exact_gradcam, image, analysis)
+    image.release()
+    job.publish("analysis", analysis)
+    return web.json_response(service.snapshot(job))
+
+
+async def report(request):
+    job = request.app["service"].job(request)
+    analysis = _analysis(job)
+    path = await asyncio.get_running_loop().run_in_executor(None, report_file, analysis)
+    return web.FileResponse(path, headers={
+        "Content-Type": "text/html; charset=utf-8",
+        "Content-Disposition": 'attachment; filename="safeheal_report.html"',
+    })
+
+
+async def similar(request):
+    job = request.app["service"].job(request)
+    analysis = _analysis(job)
+    try:
+        k = int(request.query.get("k", config.SIMILAR_TOP_K))
+    except ValueError:
+        raise web.HTTPBadRequest(reason="k must be an integer")
+    if not 0 < k <= 100:
+        raise web.HTTPBadRequest(reason="k must be between 1 and 100")
+    cases = await asyncio.get_running_loop().run_in_executor(None, similar_cases, analysis, k)
+    return web.json_response({"cases": cases})
+
+
+async def metrics(request):
+    return web.Response(body=render_metrics().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def traces(request):
+    log = get_trace_log()
+    if "trace_id" in request.match_info:
+        trace = log.find(request.match_info["trace_id"])
+        if trace is None:
+            raise web.HTTPNotFound(reason="Unknown trace")
+        return web.json_response(trace.to_dict())
+    return web.json_response(log.snapshot())
+
+
+@web.middleware
+async def instrument(request, handler):
+    """Count and time every request by its route pattern, not its concrete URL"""
+    route = request.match_info.route.resource
+    name = route.canonical if route is not None else "unmatched"
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    finally:
+        _REQUESTS.inc(route=name, status=status)
+        _REQUEST_SECONDS.observe(time.perf_counter() - start, route=name)
+
+
+async def health(request):
+    registry = get_registry()
+    return web.json_response({
+        "status": "ok",
+        "models": {name: registry.is_loaded(name) for name in MODEL_NAMES},
+        "startup": get_startup().snapshot(),
+    })
+
+
+def create_app(workers=None):
+    """aiohttp application serving the analysis API; models load on startup"""
+    app = web.Application(client_max_size=int(config.API_MAX_UPLOAD_MB * 2**20), middlewares=[instrument])
+
+    async def startup(app):
+        loop = asyncio.get_running_loop()
+        app["service"] = await loop.run_in_executor(None, AnalysisService, workers)
+
+    async def cleanup(app):
+        app["service"].close()
+
+    app.on_startup.append(startup)
+    app.on_cleanup.append(cleanup)
+    app.add_routes([
+        web.post("/v1/analyze", analyze),
+        web.get("/v1/jobs/{job_id}", job_status),
+        web.delete("/v1/jobs/{job_id}", cancel_job),
+        web.get("/v1/jobs/{job_id}/results/{path:.+}", job_artifact),
+        web.post("/v1/jobs/{job_id}/gradcam", exact_gradcam),
+        web.get("/v1/jobs/{job_id}/report", report),
+        web.get("/v1/jobs/{job_id}/similar", similar),
+        web.get("/v1/traces", traces),
+        web.get("/v1/traces/{trace_id}", traces),
+        web.get("/metrics", metrics),
+        web.get("/healthz", health),
+    ])
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.api", description="SafeHeal headless analysis API")
+    parser.add_argument("--host", default=config.API_HOST)
+    parser.add_argument("--port", type=int, default=config.API_PORT)
+    parser.add_argument("--workers", type=int, default=config.JOB_WORKERS, help="concurrent analysis jobs")
+    args = parser.parse_args(argv)
+    web.run_app(create_app(args.workers), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
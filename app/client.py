@@ -0,0 +1,181 @@
+import collections
+import io
+import json
+import os
+import shutil
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+from backend import config
+
+
+class ApiError(RuntimeError):
+    """Raised when the analysis API answers with an error status"""
+
+
+class ApiClient:
+    """Minimal client for the headless analysis API (app/api.py)"""
+
+    def __init__(self, url=None, timeout=None):
+        self.url = (url or config.API_URL).rstrip("/")
+        self.timeout = timeout or config.API_TIMEOUT
+        # Jobs are looked up again on every Streamlit rerun; keep them so artifacts download once
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._jobs.move_to_end(job.id)
+            while len(self._jobs) > 64:
+                self._jobs.popitem(last=False)
+        return job
+
+    def request(self, method, path, data=None, headers=None, timeout=None):
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers=headers or {})
+        try:
+            return urllib.request.urlopen(request, timeout=timeout or self.timeout)
+        except urllib.error.HTTPError as exc:
+            raise ApiError(f"{method} {path} failed: {exc.code} {exc.reason}") from exc
+
+    def json(self, method, path, data=None, headers=None, timeout=None):
+        with self.request(method, path, data, headers, timeout) as response:
+            return json.load(response)
+
+    def submit(self, image, include_gradcam=False, depth=None, check_quality=True):
+        """Upload image bytes (or a file-like object) for analysis and return its RemoteJob
+
+        With check_quality=False the server skips its quality gate (e.g.
+        because the UI has already applied it).
+        """
+        data = image.getvalue() if hasattr(image, "getvalue") else image
+        params = {"gradcam": "1"} if include_gradcam else {}
+        if depth:
+            params["depth"] = depth
+        if not check_quality:
+            params["quality"] = "0"
+        query = f"?{urllib.parse.urlencode(params)}" if params else ""
+        state = self.json("POST", f"/v1/analyze{query}", data, {"Content-Type": "application/octet-stream"})
+        return self._remember(RemoteJob(self, state))
+
+    def get(self, job_id):
+        """The RemoteJob for job_id, or None if the server does not know it"""
+        if not job_id:
+            return None
+        with self._lock:
+            if job_id in self._jobs:
+                return self._jobs[job_id]
+        try:
+            return self._remember(RemoteJob(self, self.json("GET", f"/v1/jobs/{job_id}")))
+        except ApiError:
+            return None
+
+
+class RemoteJob:
+    """A job on the API server with the same polling interface as backend.jobs.Job
+
+    snapshot() resolves array results to NumPy arrays or encoded image
+    bytes, downloading each artifact once.
+    """
+
+    def __init__(self, client, state):
+        self.client = client
+        self.id = state["id"]
+        self._state = state
+        self._artifacts = {}
+        self._lock = threading.Lock()
+
+    def _artifact(self, link):
+        url = link["artifact"]
+        with self._lock:
+            if url in self._artifacts:
+                return self._artifacts[url]
+        with self.client.request("GET", url) as response:
+            data = response.read()
+        value = data if url.endswith(("_image", "_display")) else np.load(io.BytesIO(data), allow_pickle=False)
+        with self._lock:
+            self._artifacts[url] = value
+        return value
+
+    def _resolve(self, value):
+        if isinstance(value, dict):
+            if "artifact" in value:
+                return self._artifact(value)
+            return {key: self._resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._resolve(item) for item in value]
+        return value
+
+    def _refresh(self, state):
+        if state.get("results", {}).get("analysis") != self._state.get("results", {}).get("analysis"):
+            # A re-published analysis (e.g. exact Grad-CAM) replaces its artifacts
+            with self._lock:
+                self._artifacts = {k: v for k, v in self._artifacts.items() if "/analysis/" not in k}
+        self._state = state
+
+    @property
+    def finished(self):
+        return self._state["status"] in ("done", "failed", "cancelled", "timed_out")
+
+    def snapshot(self):
+        self._refresh(self.client.json("GET", f"/v1/jobs/{self.id}"))
+        state = dict(self._state)
+        state["results"] = self._resolve(state["results"])
+        return state
+
+    def wait(self, timeout=None):
+        """Long-poll the server until the job finishes or timeout passes; returns whether it finished"""
+        wait = "" if timeout is None else f"?wait={timeout}"
+        self._refresh(self.client.json("GET", f"/v1/jobs/{self.id}{wait}", timeout=(timeout or 0) + self.client.timeout))
+        return self.finished
+
+    def cancel(self):
+        self._refresh(self.client.json("DELETE", f"/v1/jobs/{self.id}"))
+        return self._state["status"] == "cancelled"
+
+    def with_exact_gradcam(self):
+        """Ask the server for exact Grad-CAM and return the updated analysis"""
+        self._refresh(self.client.json("POST", f"/v1/jobs/{self.id}/gradcam"))
+        analysis = self._resolve(self._state["results"]["analysis"])
+        # The server rewrote the report with the new heatmap; drop the stale local copy
+        stale = os.path.join(config.REPORTS_DIR, f"{analysis['result_id']}.html")
+        if os.path.exists(stale):
+            os.remove(stale)
+        return analysis
+
+    def similar_cases(self, k=None):
+        """The server's most similar past cases for the finished analysis"""
+        query = f"?k={k}" if k else ""
+        return self.client.json("GET", f"/v1/jobs/{self.id}/similar{query}")["cases"]
+
+    def report_file(self):
+        """Download the job's report into the local reports directory and return its path"""
+        analysis = self._state["results"]["analysis"]
+        path = os.path.join(config.REPORTS_DIR, f"{analysis['result_id']}.html")
+        if not os.path.exists(path):
+            os.makedirs(config.REPORTS_DIR, exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with self.client.request("GET", f"/v1/jobs/{self.id}/report") as response, open(temp_path, "wb") as f:
+                shutil.copyfileobj(response, f)
+            os.replace(temp_path, path)
+        return path
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_api_client():
+    """Return the process-wide API client, or None when SAFEHEAL_API_URL is not set"""
+    global _client
+    if not config.API_URL:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ApiClient()
+    return _client
@@ -1,7 +1,11 @@
 import streamlit as st
-from PIL import Image
 import base64
-import time
+from datetime import datetime
+
+from backend import config
+from backend.budgets import DEPTHS, STANDARD
+from backend.images import DecodedImage
+from backend.uploads import get_upload_store
 
 def set_page_config():
     """Set page configuration with title, icon and layout"""
@@ -250,10 +254,15 @@ def render_sidebar():
         st.markdown("<hr style='margin: 1.5rem 0; background-color: #4299e1; height: 2px; border: none;'>", unsafe_allow_html=True)
         st.subheader("Settings")
         
-        analysis_depth = st.select_slider(
+        # Sets the compute budget of the next analysis (see backend.budgets); read as session_state.analysis_depth
+        st.select_slider(
             "Analysis Detail Level",
-            options=["Basic", "Standard", "Detailed"],
-            value="Standard"
+            options=list(DEPTHS),
+            value=STANDARD,
+            key="analysis_depth",
+            help="Basic: quick classification of a downscaled photo with standard advice. "
+                 "Standard: segmentation, measurements and AI advice. "
+                 "Detailed: full-resolution segmentation, test-time augmentation and exact Grad-CAM.",
         )
         
         show_technical = st.checkbox("Show Technical Details", value=False)
@@ -270,10 +279,69 @@ def render_sidebar():
         </div>
         """, unsafe_allow_html=True)
 
-def render_upload_section():
-    """Render the image/video upload section"""
+def stored_upload(upload):
+    """The upload saved in the content-addressed store, once per file however often the script reruns
+
+    Returns the upload itself when the store is disabled.
+    """
+    if not config.UPLOAD_STORE:
+        return upload
+    key = getattr(upload, "file_id", None) or getattr(upload, "id", None) or id(upload)
+    cached = st.session_state.get("stored_upload")
+    if cached is None or cached[0] != key:
+        cached = (key, get_upload_store().put(upload, getattr(upload, "name", None)))
+        st.session_state.stored_upload = cached
+    return cached[1]
+
+
+def decoded_upload(upload):
+    """The DecodedImage of an upload, created once per file however often the script reruns"""
+    key = getattr(upload, "file_id", None) or getattr(upload, "id", None) or id(upload)
+    cached = st.session_state.get("decoded_upload")
+    if cached is None or cached[0] != key:
+        cached = (key, DecodedImage.from_upload(stored_upload(upload)))
+        st.session_state.decoded_upload = cached
+    return cached[1]
+
+
+def quality_check(image):
+    """The quality gate's report for an image, computed once per upload (None when the gate is off)"""
+    if config.QUALITY_GATE == "off":
+        return None
+    cached = st.session_state.get("quality_report")
+    if cached is None or cached[0] != image.sha256:
+        # Imported here so OpenCV stays out of the first render
+        from backend.quality import assess_quality
+
+        cached = (image.sha256, assess_quality(image))
+        st.session_state.quality_report = cached
+    return cached[1]
+
+
+def render_quality(image):
+    """Show the quality gate's advice under a preview; returns whether the image may be analysed"""
+    report = quality_check(image)
+    if report is None or not report.issues:
+        return True
+    advice = "\n".join(f"- {message}" for message in report.messages)
+    if report.rejected:
+        st.error(f"This photo is unlikely to give a reliable analysis:\n{advice}")
+        return st.checkbox("Analyze anyway", key=f"quality_override_{image.sha256[:16]}")
+    st.warning(f"The photo could be better:\n{advice}")
+    return True
+
+
+def render_upload_section(ready=True, status=None):
+    """Render the image/video upload section
+
+    The Analyze button stays disabled until ready, and while the quality
+    gate rejects the previewed image unless the user overrides it; status,
+    if given, is shown next to it (e.g. model loading progress).
+    """
     st.markdown('<div class="upload-container">', unsafe_allow_html=True)
     st.subheader("Upload Wound Image or Video")
+    # False while the quality gate rejects the previewed image
+    usable = True
     
     col1, col2 = st.columns(2)
     
@@ -324,20 +392,23 @@ def render_upload_section():
         if uploaded_file is not None:
             file_type = uploaded_file.type
             if "image" in file_type:
-                image = Image.open(uploaded_file)
-                st.image(image, caption="Uploaded Image", use_container_width=True)
-                st.session_state.analyzed_image = uploaded_file
+                # Previewed from a reduced-resolution decode; analysis shares the same object
+                image = decoded_upload(uploaded_file)
+                st.image(image.thumbnail(), caption="Uploaded Image", use_container_width=True)
+                st.session_state.analyzed_image = image
+                usable = render_quality(image)
             elif "video" in file_type:
-                tfile = tempfile.NamedTemporaryFile(delete=False)
-                tfile.write(uploaded_file.read())
-                st.video(tfile.name)
-                st.session_state.analyzed_video = tfile.name
+                # Stored uploads are analysed straight from the store; otherwise analysis
+                # spools the upload to a temp file and removes it afterwards
+                st.video(uploaded_file)
+                st.session_state.analyzed_video = stored_upload(uploaded_file)
         
         elif 'captured_media' in st.session_state:
             captured_file = st.session_state.captured_media
-            image = Image.open(captured_file)
-            st.image(image, caption="Captured Image", use_container_width=True)
-            st.session_state.analyzed_image = captured_file
+            image = decoded_upload(captured_file)
+            st.image(image.thumbnail(), caption="Captured Image", use_container_width=True)
+            st.session_state.analyzed_image = image
+            usable = render_quality(image)
         
         else:
             # Placeholder
@@ -361,48 +432,38 @@ def render_upload_section():
             """, unsafe_allow_html=True)
 
     if st.session_state.get("analyzed_image") or st.session_state.get("analyzed_video"):
-        if st.button("Analyze Media", key="analyze_btn"):
+        if st.button("Analyze Media", key="analyze_btn", disabled=not ready or not usable):
             st.session_state.run_analysis = True
+            st.session_state.analysis_complete = False
+            st.session_state.pop("analysis_job_id", None)
+            st.session_state.pop("show_gradcam", None)
+    if status:
+        st.caption(status)
 
     st.markdown('</div>', unsafe_allow_html=True)
 
 
-def render_results_section(segmented_image=None, wound_class=None, risk_level=None, recommendations=None, explanation=None):
-    """Render the results section with analysis and recommendations"""
+def render_results_section(segmented_image=None, wound_class=None, risk_level=None, recommendations=None, explanation=None,
+                           gradcam_image=None, gradcam_exact=False, report_path=None, metrics=None,
+                           save_record=None, load_progress=None, load_similar=None, confidence=None):
+    """Render the results section with analysis and recommendations
+
+    metrics are the wound measurements (empty when the detail level took
+    none) and confidence the classifier's top probability. load_similar,
+    if given, returns the most similar past cases for the "Similar Past
+    Cases" panel. Called without a wound_class it renders sample results.
+    """
     if not ('run_analysis' in st.session_state and st.session_state.run_analysis):
         return
     
     st.markdown('<div class="result-container">', unsafe_allow_html=True)
     st.subheader("Analysis Results")
     
-    # Progress indicator during analysis
-    if 'analysis_complete' not in st.session_state:
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        # Simulate analysis progress
-        for i in range(101):
-            if i < 30:
-                status_text.text("Segmenting wound area...")
-            elif i < 60:
-                status_text.text("Classifying wound type...")
-            elif i < 90:
-                status_text.text("Generating recommendations...")
-            else:
-                status_text.text("Finalizing analysis...")
-            
-            progress_bar.progress(i)
-            time.sleep(0.02)
-        
-        status_text.text("Analysis complete!")
-        st.session_state.analysis_complete = True
-        time.sleep(1)
-        st.experimental_rerun()
-    
-    if 'analysis_complete' in st.session_state:
+    if st.session_state.get('analysis_complete'):
         tab1, tab2, tab3 = st.tabs(["Overview", "Detailed Analysis", "First Aid Guide"])
         
-        # Sample data - in real app, this would come from your backend
+        # Sample data when no analysis was passed in (the layout preview)
+        sample = not wound_class
         if not wound_class:
             wound_class = "Laceration (Cut)"
         if not risk_level:
@@ -426,7 +487,7 @@ def render_results_section(segmented_image=None, wound_class=None, risk_level=No
                     st.image(segmented_image, caption="Wound Analysis", use_container_width=True)
                 else:
                     # Use the uploaded image with a simulated overlay
-                    uploaded_img = Image.open(st.session_state.analyzed_image)
+                    uploaded_img = DecodedImage.from_upload(st.session_state.analyzed_image).thumbnail()
                     
                     # Display the image with caption
                     st.image(uploaded_img, caption="Wound Analysis", use_container_width=True)
@@ -466,31 +527,75 @@ def render_results_section(segmented_image=None, wound_class=None, risk_level=No
             st.markdown("### Technical Analysis")
             
             metrics_col1, metrics_col2, metrics_col3 = st.columns(3)
-            with metrics_col1:
-                st.metric("Wound Area", "3.2 cm²")
-            with metrics_col2:
-                st.metric("Depth Est.", "Medium")
-            with metrics_col3:
-                st.metric("Infection Risk", "18%")
+            if metrics and "irregularity" in metrics:
+                # Lengths are in mm when a calibration marker or ruler was found, pixels otherwise
+                unit = "mm" if "area_cm2" in metrics else "px"
+                area = f"{metrics['area_cm2']:.1f} cm²" if unit == "mm" else f"{metrics['area_px']:,.0f} px²"
+                with metrics_col1:
+                    st.metric("Wound Area", area)
+                with metrics_col2:
+                    st.metric("Length × Width", f"{metrics[f'length_{unit}']:.0f} × {metrics[f'width_{unit}']:.0f} {unit}")
+                with metrics_col3:
+                    st.metric("Edge Irregularity", f"{metrics['irregularity']:.2f}")
+                if unit == "px":
+                    st.caption("Place a 20 mm calibration square or a ruler next to the wound for measurements in mm")
+                if "granulation_fraction" in metrics:
+                    st.markdown("### Tissue Composition")
+                    st.markdown("| Tissue | Share |\n| --- | --- |\n" + "\n".join(
+                        f"| {name.capitalize()} | {metrics[f'{name}_fraction']:.0%} |"
+                        for name in ("granulation", "slough", "necrotic", "other")
+                    ))
+            elif sample:
+                with metrics_col1:
+                    st.metric("Wound Area", "3.2 cm²")
+                with metrics_col2:
+                    st.metric("Depth Est.", "Medium")
+                with metrics_col3:
+                    st.metric("Infection Risk", "18%")
+            else:
+                # The Basic level classifies without segmenting, so there is nothing to measure
+                with metrics_col1:
+                    st.metric("Wound Area", "—")
+                with metrics_col2:
+                    st.metric("Length × Width", "—")
+                with metrics_col3:
+                    st.metric("Edge Irregularity", "—")
+                st.caption("Not measured at Basic detail level")
             
-            st.markdown("### Wound Characteristics")
-            st.markdown("""
-            | Feature | Assessment |
-            | --- | --- |
-            | Edges | Clean, slightly irregular |
-            | Tissue Loss | Minimal |
-            | Bleeding | Controlled |
-            | Contamination | Low-Medium |
-            | Inflammation | Minimal |
-            """)
+            if sample:
+                st.markdown("### Wound Characteristics")
+                st.markdown("""
+                | Feature | Assessment |
+                | --- | --- |
+                | Edges | Clean, slightly irregular |
+                | Tissue Loss | Minimal |
+                | Bleeding | Controlled |
+                | Contamination | Low-Medium |
+                | Inflammation | Minimal |
+                """)
             
-            st.markdown("### Classification Confidence")
-            st.progress(0.87)
-            st.caption("87% confidence in classification")
+            if confidence is None and sample:
+                confidence = 0.87
+            if confidence is not None:
+                st.markdown("### Classification Confidence")
+                st.progress(min(max(float(confidence), 0.0), 1.0))
+                st.caption(f"{confidence:.0%} confidence in classification")
             
-            # Add a GradCAM visualization with SVG
             st.markdown("### Visual Analysis (Grad-CAM)")
             
+            if gradcam_image is not None:
+                st.image(gradcam_image, use_container_width=True)
+                if gradcam_exact:
+                    st.caption("Grad-CAM heatmap showing the regions that drove the classification")
+                else:
+                    st.caption("Approximate attention map (Score-CAM)")
+            
+            if not gradcam_exact:
+                # Exact Grad-CAM is computed on demand only
+                if st.button("Compute Detailed Grad-CAM", key="compute_gradcam"):
+                    st.session_state.show_gradcam = True
+                    st.experimental_rerun()
+            
             gradcam_svg = """
             <svg width="100%" height="200" viewBox="0 0 400 200" fill="none" xmlns="http://www.w3.org/2000/svg">
                 <rect width="400" height="200" rx="10" fill="#E2E8F0"/>
@@ -502,8 +607,13 @@ def render_results_section(segmented_image=None, wound_class=None, risk_level=No
                 <path d="M150 45L120 80" stroke="#2D3748" stroke-width="1" stroke-dasharray="2 2"/>
             </svg>
             """
-            st.markdown(gradcam_svg, unsafe_allow_html=True)
-            st.caption("Heatmap showing areas of concern in the wound analysis")
+            if gradcam_image is None:
+                st.markdown(gradcam_svg, unsafe_allow_html=True)
+                st.caption("Heatmap showing areas of concern in the wound analysis")
+
+            if load_similar:
+                st.markdown("### Similar Past Cases")
+                render_similar_cases(load_similar())
         
         with tab3:
             st.markdown("### First Aid Instructions")
@@ -544,24 +654,145 @@ def render_results_section(segmented_image=None, wound_class=None, risk_level=No
         
         col1, col2, col3 = st.columns([2, 2, 1])
         with col1:
-            if st.button("Download PDF Report"):
+            if report_path:
+                # The report is already on disk; Streamlit reads it from the file handle
+                with open(report_path, "rb") as report:
+                    st.download_button("Download Report", report, file_name="safeheal_report.html", mime="text/html")
+            elif st.button("Download PDF Report"):
                 st.info("Preparing PDF report for download...")
                 # This would trigger report generation in your backend
         
         with col2:
-            if st.button("Save to Health Record"):
-                st.success("Analysis saved to health record")
-                # This would trigger saving to a database
+            patient_id = st.text_input("Patient ID", key="patient_id") if save_record else None
+            if st.button("Save to Health Record", disabled=save_record is not None and not patient_id):
+                if save_record is None:
+                    st.success("Analysis saved to health record")
+                elif save_record(patient_id):
+                    st.success("Analysis saved to health record")
+                else:
+                    st.info("This analysis is already in the patient's record")
         
         with col3:
             if st.button("New Analysis"):
                 # Reset the relevant session state variables
                 st.session_state.run_analysis = False
                 st.session_state.analysis_complete = False
+                st.session_state.pop("analysis_job_id", None)
+                st.session_state.pop("show_gradcam", None)
                 st.experimental_rerun()
+
+        if load_progress and patient_id:
+            render_progress_section(*load_progress(patient_id))
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+
+def case_thumbnail(sha256, size=160):
+    """Thumbnail of a past case's photo from the upload store, or None when it is no longer there"""
+    thumbnails = st.session_state.setdefault("case_thumbnails", {})
+    if sha256 not in thumbnails:
+        stored = get_upload_store().find(sha256) if sha256 and config.UPLOAD_STORE else None
+        thumbnails[sha256] = DecodedImage(stored.open(), path=stored.path, sha256=sha256).thumbnail(size) if stored else None
+    return thumbnails[sha256]
+
+
+def render_similar_cases(cases):
+    """Render past cases that look like the current wound, most similar first"""
+    if not cases:
+        st.caption("No similar past cases yet")
+        return
+    import datetime
+
+    for column, case in zip(st.columns(len(cases)), cases):
+        with column:
+            thumbnail = case_thumbnail(case.get("sha256"))
+            if thumbnail is not None:
+                st.image(thumbnail, use_container_width=True)
+            st.markdown(f"**{case['wound_class']}**")
+            day = datetime.date.fromtimestamp(case["timestamp"]).isoformat()
+            st.caption(f"{case['score']:.0%} similar · {case['risk_level'] or '–'} risk · {day}")
+
+
+def render_progress_section(trend, history):
+    """Render a patient's healing trend and wound area over time"""
+    if not trend:
+        return
+    st.markdown("### Healing Progress")
+    unit = "mm²" if trend["unit"] == "mm" else "px²"
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Visits", trend["visits"])
+    with col2:
+        change = trend["area_change"]
+        st.metric("Area Change", f"{change:+.0%}" if change is not None else "–")
+    with col3:
+        rate = trend["healing_rate_per_week"]
+        st.metric("Healing Rate", f"{rate:.1%} / week" if rate is not None else "–")
+    if len(history["timestamp"]) > 1:
+        # Plain columns rather than a DataFrame, so the page doesn't need pandas
+        column = f"Wound Area ({unit})"
+        st.line_chart(
+            {"Date": [datetime.fromtimestamp(t) for t in history["timestamp"]], column: history["area"].tolist()},
+            x="Date",
+            y=column,
+        )
+
+
+STAGE_LABELS = {
+    "segmentation": "Segmenting wound area",
+    "classification": "Classifying wound type",
+    "measurement": "Measuring wound",
+    "gradcam": "Computing attention map",
+    "llm": "Generating recommendations",
+    "report": "Finalizing report",
+}
+
+STAGE_ICONS = {"pending": "⏳", "running": "🔄", "done": "✅", "skipped": "➖"}
+
+
+def render_analysis_progress(job_state, preview_image=None):
+    """Render live progress and partial results of a running analysis job
+
+    Returns True if the user asked to cancel the analysis.
+    """
+    st.markdown('<div class="result-container">', unsafe_allow_html=True)
+    st.subheader("Analysis Results")
+
+    st.progress(job_state["progress"])
+    running = [name for name, state in job_state["stages"].items() if state == "running"]
+    if running:
+        st.text(f"{STAGE_LABELS.get(running[0], running[0])}...")
+    st.markdown("  \n".join(
+        f"{STAGE_ICONS.get(state, '')} {STAGE_LABELS.get(name, name)}"
+        for name, state in job_state["stages"].items()
+    ))
+
+    results = job_state["results"]
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        if preview_image is not None:
+            st.image(preview_image, caption="Wound Segmentation", use_container_width=True)
+    with col2:
+        if "classification" in results:
+            classification = results["classification"]
+            st.markdown(f"**Wound Type:** {classification['wound_class']}")
+            st.caption(f"{classification['confidence']:.0%} confidence in classification")
+        if "metrics" in results:
+            st.markdown(f"**Risk Level:** {results['metrics']['risk_level']}")
+        if "recommendations" in results:
+            st.markdown("### Key Recommendations")
+            for rec in results["recommendations"]["recommendations"][:3]:
+                st.markdown(f"- {rec}")
+        elif "llm_text" in results:
+            # Reply still streaming in; show it as it arrives
+            st.markdown("### Key Recommendations")
+            st.markdown(results["llm_text"].replace("Explanation:", "\n**Explanation:**"))
+
+    cancelled = st.button("Cancel Analysis", key="cancel_analysis")
+    st.markdown('</div>', unsafe_allow_html=True)
+    return cancelled
+
+
 def render_footer():
     """Render the footer with copyright and disclaimer"""
     st.markdown("""
@@ -14,11 +14,136 @@ from app.layout import (
     render_sidebar, 
     render_upload_section, 
     render_results_section, 
+    render_analysis_progress,
     render_footer
 )
-from app.routes import process_image, generate_report
-from backend.inference import load_models, run_inference
-from backend.llm_service import initialize_llm
+# Only light modules are imported here so the shell paints at once; the pipeline
+# (app.routes, backend.inference: torch, timm, OpenCV) is imported by the warm-up thread
+from app.client import get_api_client
+from backend import config
+from backend.jobs import get_job_manager
+from backend.progress import get_progress_store
+from backend.startup import FAILED, get_startup
+from backend.telemetry import serve_metrics
+
+# Seconds to wait for a running analysis before refreshing its progress
+JOB_POLL_INTERVAL = 0.25
+# Seconds to wait for the model warm-up before refreshing the page
+STARTUP_POLL_INTERVAL = 1.0
+
+
+def start_warm_up(load_models=True):
+    """Import the pipeline and warm up the shared models in the background, once per process
+
+    With load_models false (images analysed by the API server) the startup
+    state is returned without starting it, so no local model is loaded.
+    """
+    # Prometheus-style /metrics and /traces when SAFEHEAL_METRICS_PORT is set
+    serve_metrics()
+    startup = get_startup()
+    return startup.start() if load_models else startup
+
+def attach_models():
+    """Give this session handles to the shared models once they are ready"""
+    from backend.inference import get_registry
+
+    registry = get_registry()
+    st.session_state.segmentation_model = registry.acquire("segmentation")
+    st.session_state.classification_model = registry.acquire("classification")
+    st.session_state.llm = registry.acquire("llm")
+    st.session_state.models_loaded = True
+
+def load_progress(patient_id):
+    """Healing trend and area history of a patient for the progress section"""
+    store = get_progress_store()
+    trend = store.trend(patient_id)
+    # Only the visits measured in the trend's unit, so the chart never mixes px² and mm²
+    return trend, store.series(patient_id, ("area",), unit=trend["unit"] if trend else None)
+
+def render_image_analysis():
+    """Run the image analysis as a background job and poll it on every rerun
+
+    With SAFEHEAL_API_URL set the job runs on the headless API server and
+    this script is just one of its clients; otherwise it runs in-process.
+    """
+    # app.routes (torch, timm, OpenCV) is only imported when the job runs in-process
+    from backend.overlays import composite, display_image
+    from backend.similar import similar_cases
+
+    client = get_api_client()
+    manager = client or get_job_manager()
+    job = manager.get(st.session_state.get("analysis_job_id"))
+    if job is None:
+        depth = st.session_state.get("analysis_depth")
+        if client is not None:
+            # The upload section has already run the quality gate (and the user may have overridden it)
+            job = client.submit(st.session_state.analyzed_image, depth=depth, check_quality=False)
+        else:
+            from app.routes import submit_analysis
+
+            job = submit_analysis(
+                st.session_state.analyzed_image,
+                st.session_state.segmentation_model,
+                st.session_state.classification_model,
+                st.session_state.llm,
+                depth=depth
+            )
+        st.session_state.analysis_job_id = job.id
+
+    job_state = job.snapshot()
+    if job_state["status"] in ("pending", "running"):
+        preview = None
+        if "mask" in job_state["results"]:
+            # Drawn on the preview thumbnail; the full-resolution overlay comes with the results
+            thumbnail = st.session_state.analyzed_image.thumbnail()
+            preview = composite(thumbnail, job_state["results"]["mask"])
+        if render_analysis_progress(job_state, preview):
+            job.cancel()
+            st.session_state.run_analysis = False
+            st.session_state.pop("analysis_job_id", None)
+        else:
+            job.wait(JOB_POLL_INTERVAL)
+        st.experimental_rerun()
+    elif job_state["status"] == "done":
+        analysis = job_state["results"]["analysis"]
+        st.session_state.analysis_complete = True
+        gradcam_exact = analysis.get("gradcam_mode") == "gradcam"
+        if st.session_state.get("show_gradcam") and not gradcam_exact:
+            with st.spinner("Computing Grad-CAM..."):
+                if client is not None:
+                    analysis = job.with_exact_gradcam()
+                else:
+                    from app.routes import with_exact_gradcam
+
+                    analysis = with_exact_gradcam(st.session_state.analyzed_image, analysis)
+                    # Later reruns read the updated analysis from the job instead of recomputing
+                    job.publish("analysis", analysis)
+            gradcam_exact = True
+        if client is not None:
+            report_path = job.report_file()
+        else:
+            from app.routes import report_file
+
+            report_path = report_file(analysis)
+        # Display-size variants; the full-resolution images are only embedded in the report
+        render_results_section(
+            display_image(analysis, "overlay"),
+            analysis["wound_class"],
+            analysis["risk_level"],
+            analysis["recommendations"],
+            analysis["explanation"],
+            gradcam_image=display_image(analysis, "gradcam"),
+            gradcam_exact=gradcam_exact,
+            report_path=report_path,
+            metrics=analysis.get("metrics"),
+            confidence=analysis.get("confidence"),
+            save_record=lambda patient_id: get_progress_store().add_visit(patient_id, analysis),
+            load_progress=load_progress,
+            load_similar=(job.similar_cases if client is not None else lambda: similar_cases(analysis))
+            if config.SIMILAR_CASES else None
+        )
+    else:
+        st.error(f"Analysis {job_state['status'].replace('_', ' ')}: {job_state['error'] or ''}")
 
 def main():
     """Main entry point for the SafeHeal Streamlit application"""
@@ -32,47 +157,55 @@ def main():
         st.session_state.run_analysis = False
         st.session_state.analysis_complete = False
     
+    # Images analysed by the API server don't need the local models; videos still run in-process
+    remote = get_api_client() is not None and st.session_state.get("capture_type") != "Video"
+    # Models load in the background while the shell renders; the Analyze button waits for them
+    startup = start_warm_up(load_models=not remote)
+    if not remote and startup.status == FAILED:
+        st.error(f"Error loading models: {startup.error}")
+        st.stop()
+    ready = startup.ready or remote
+    
     # Display components
     render_header()
     render_sidebar()
     
-    # Load models in background
-    if not st.session_state.models_loaded:
-        with st.spinner("Loading AI models..."):
-            try:
-                # These would be your actual model loading functions
-                # segmentation_model, classification_model = load_models()
-                # llm = initialize_llm()
-                
-                # For demo purposes:
-                st.session_state.models_loaded = True
-                
-                # Store models in session state
-                # st.session_state.segmentation_model = segmentation_model
-                # st.session_state.classification_model = classification_model
-                # st.session_state.llm = llm
-            except Exception as e:
-                st.error(f"Error loading models: {str(e)}")
-                st.stop()
+    # Attach this session to the shared models; only lightweight handles live in session state
+    if not remote and startup.ready and not st.session_state.models_loaded:
+        attach_models()
     
     # Upload section
-    render_upload_section()
+    render_upload_section(
+        ready=ready,
+        status=None if ready else f"Loading AI models... ({startup.elapsed():.0f}s)"
+    )
+    startup.record("shell", startup.elapsed())
     
     # Results section - will only show when analysis is triggered
-    if 'run_analysis' in st.session_state and st.session_state.run_analysis:
-        # In a real application, you would process the image here
-        # segmented_image, wound_class, risk_level, recommendations, explanation = process_image(
-        #    st.session_state.analyzed_image,
-        #    st.session_state.segmentation_model,
-        #    st.session_state.classification_model,
-        #    st.session_state.llm
-        # )
-        
-        # For demo purposes, pass None for these (the layout function has defaults)
-        render_results_section()
+    if ready and st.session_state.get('run_analysis'):
+        if st.session_state.get("analyzed_video") is not None and st.session_state.get("capture_type") == "Video":
+            from app.routes import process_video
+
+            with st.spinner("Analyzing video keyframes..."):
+                results = process_video(
+                    st.session_state.analyzed_video,
+                    st.session_state.segmentation_model,
+                    st.session_state.classification_model,
+                    st.session_state.llm
+                )
+            st.session_state.analysis_complete = True
+            *results, metrics, confidence = results
+            render_results_section(*results, metrics=metrics, confidence=confidence)
+        else:
+            render_image_analysis()
     
     # Footer
     render_footer()
+    
+    if not ready:
+        # Refresh until the warm-up finishes so the Analyze button enables itself
+        startup.wait(STARTUP_POLL_INTERVAL)
+        st.experimental_rerun()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
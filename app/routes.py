@@ -0,0 +1,389 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from backend import config
+from backend.budgets import get_budget
+from backend.cache import get_result_cache
+from backend.gradcam import combine_layers, compute_gradcam, gradcam_from_activations, score_cam
+from backend.images import DecodedImage
+from backend.inference import (
+    classify_image,
+    classify_image_tta,
+    embed_image,
+    get_reference_model,
+    get_registry,
+    preprocess_image,
+    resolve_model,
+    run_fused_inference,
+    run_inference,
+    run_tiled_inference,
+    segment_image,
+    segment_tiled,
+    submit_inference,
+)
+from backend.jobs import Job, get_job_manager
+from backend.llm_service import template_recommendations
+from backend.overlays import composite, display_image, render_overlays
+from backend.report_generator import write_report
+from backend.report_generator import generate_report as render_report
+from backend.similar import index_analysis
+from backend.startup import get_startup
+from backend.telemetry import span, trace
+from backend.utils import wound_metrics
+
+HIGH_RISK_CLASSES = {"Burn", "Diabetic Ulcer", "Pressure Ulcer", "Venous Ulcer"}
+LOW_RISK_CLASSES = {"Abrasion", "Bruise", "Normal Skin"}
+
+ANALYSIS_STAGES = ("segmentation", "classification", "measurement", "gradcam", "llm", "report")
+# Cached analyses keep the classifier's Grad-CAM layer activations under these keys
+ACTIVATION_PREFIX = "activation_"
+
+
+def estimate_risk(wound_class, mask):
+    """Combine the wound type with the wound's share of the image into a risk level"""
+    coverage = float(mask.mean()) if mask is not None and mask.size else 0.0
+    if wound_class in HIGH_RISK_CLASSES or coverage > 0.25:
+        return "High"
+    if wound_class in LOW_RISK_CLASSES and coverage < 0.05:
+        return "Low"
+    return "Medium"
+
+
+def overlay_mask(image, mask):
+    """Blend the segmentation mask's fill and contour over the image"""
+    return Image.fromarray(composite(np.asarray(image), mask))
+
+
+def segment_and_classify(image, segmentation_model, classification_model):
+    """Pick the inference path for a decoded image and run it"""
+    if image.width * image.height >= config.TILED_MIN_MEGAPIXELS * 1e6:
+        # Large clinical photos are segmented at full resolution in tiles
+        return run_tiled_inference(image, segmentation_model, classification_model)
+    if config.BATCHING_ENABLED:
+        # Share forward passes with concurrent sessions through the micro-batcher
+        return submit_inference(image).result()
+    if config.FUSED_INFERENCE:
+        # One backbone pass feeds both the U-Net decoder and the classifier head
+        return run_fused_inference(image, get_registry().get("fused"))
+    return run_inference(image, segmentation_model, classification_model)
+
+
+def run_analysis(job, image, segmentation_model, classification_model, llm, use_cache=True, include_gradcam=False,
+                 depth=None):
+    """Staged analysis pipeline reporting progress and partial results through job
+
+    Stages are ANALYSIS_STAGES; each partial result is published as soon as
+    its stage finishes, and stages a detail level leaves out are skipped.
+    depth is the analysis detail level (Basic, Standard or Detailed, see
+    backend.budgets). The cache key is the hash of the uploaded bytes plus
+    the model and config version and the detail level, so Streamlit reruns
+    over the same upload are free. Returns a dict with the mask, class
+    probabilities, metrics and LLM text. The run is traced with the job id
+    as its correlation id.
+    """
+    budget = get_budget(depth)
+    with trace("analysis", job.id):
+        analysis = _run_analysis(
+            job, image, segmentation_model, classification_model, llm, use_cache, include_gradcam, budget
+        )
+    get_startup().analysis_finished()
+    return analysis
+
+
+def _run_analysis(job, image, segmentation_model, classification_model, llm, use_cache, include_gradcam, budget):
+    image = DecodedImage.from_upload(image)
+    cache = get_result_cache()
+    with span("cache_lookup"):
+        key = cache.key(image, variant=budget.cache_variant)
+        cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        for stage in ANALYSIS_STAGES:
+            job.skip(stage)
+        job.publish("analysis", cached)
+        return cached
+
+    with span("decode"):
+        # Basic analyses decode a reduced-resolution copy (JPEG draft mode) instead of the full photo
+        decoded = image.thumbnail(budget.max_side) if budget.max_side else image.image()
+    large = decoded.width * decoded.height >= config.TILED_MIN_MEGAPIXELS * 1e6
+    if not budget.segmentation:
+        mask = None
+        job.skip("segmentation")
+        with job.stage("classification"):
+            classification = classify_image(decoded, classification_model)
+    elif budget.tiled:
+        with job.stage("segmentation"):
+            mask = segment_tiled(decoded, segmentation_model)
+        job.publish("mask", mask)
+        with job.stage("classification"):
+            classify = classify_image_tta if budget.tta else classify_image
+            classification = classify(decoded, classification_model)
+    elif not large and (config.BATCHING_ENABLED or config.FUSED_INFERENCE):
+        # Both models share one (batched or fused) forward pass
+        with job.stage("segmentation"):
+            result = segment_and_classify(decoded, segmentation_model, classification_model)
+            mask = result["mask"]
+        job.publish("mask", mask)
+        with job.stage("classification"):
+            classification = {k: result[k] for k in ("probabilities", "class_index", "wound_class", "confidence")}
+            classification["activations"] = result.get("activations", {})
+    else:
+        with job.stage("segmentation"):
+            mask = segment_image(decoded, segmentation_model)
+        job.publish("mask", mask)
+        with job.stage("classification"):
+            classification = classify_image(decoded, classification_model)
+    activations = classification.pop("activations", {})
+    # Recorded in the same pass as the Grad-CAM layers; the fused model records nothing, so it takes one more
+    embedding = activations.pop(config.EMBEDDING_LAYER, None)
+    if embedding is None and config.SIMILAR_CASES:
+        with span("embedding"):
+            embedding = embed_image(decoded, _eager(classification_model) or get_reference_model("classification"))
+    job.publish("classification", classification)
+
+    wound_class = classification["wound_class"]
+    risk_level = estimate_risk(wound_class, mask)
+    if mask is None:
+        metrics = {}
+        job.skip("measurement")
+    else:
+        with job.stage("measurement"):
+            metrics = wound_metrics(mask, image.pixels())
+    job.publish("metrics", {"risk_level": risk_level, **metrics})
+
+    # Exact Grad-CAM when asked for or at the Detailed level; otherwise the cheap no-grad approximation if enabled
+    gradcam, gradcam_mode, gradcam_note = None, None, None
+    layer = config.GRADCAM_LAYERS[-1]
+    if include_gradcam or budget.gradcam == "exact":
+        with job.stage("gradcam"):
+            gradcam = exact_gradcam(decoded, activations, classification["class_index"], _eager(classification_model))
+            gradcam_mode = "gradcam"
+    elif budget.gradcam == "approximate" and config.GRADCAM_APPROXIMATE and layer in activations:
+        with job.stage("gradcam"):
+            gradcam = score_cam(
+                classification_model, preprocess_image(decoded), activations[layer], classification["class_index"]
+            )
+            gradcam_mode = "scorecam"
+    else:
+        job.skip("gradcam")
+        if budget.gradcam == "approximate" and config.GRADCAM_APPROXIMATE:
+            # Score-CAM starts from the recorded activation; running the backbone again would cost
+            # as much as the exact map, which stays available on request
+            gradcam_note = (
+                f"No approximate heatmap: the classification pass recorded no '{layer}' activation "
+                "(fused, TorchScript and ONNX models record none). Request the exact Grad-CAM instead."
+            )
+    if gradcam is not None:
+        job.publish("gradcam", gradcam)
+
+    if budget.llm:
+        with job.stage("llm"):
+            # Publish the reply text as it streams so the UI can render it before the stage ends
+            recommendations, explanation = resolve_model(llm).generate_recommendations(
+                wound_class, risk_level, metrics, depth=budget.name,
+                on_chunk=lambda text: job.publish("llm_text", text),
+            )
+    else:
+        job.skip("llm")
+        recommendations, explanation = template_recommendations(wound_class, risk_level)
+    job.publish("recommendations", {"recommendations": recommendations, "explanation": explanation})
+
+    analysis = {
+        "mask": mask,
+        **classification,
+        "risk_level": risk_level,
+        "recommendations": recommendations,
+        "explanation": explanation,
+        "metrics": metrics,
+        "gradcam": gradcam,
+        "gradcam_mode": gradcam_mode,
+        "gradcam_note": gradcam_note,
+        "depth": budget.name,
+        "embedding": embedding,
+        **{ACTIVATION_PREFIX + layer: value for layer, value in activations.items()},
+    }
+    with job.stage("report"):
+        # Encode the display images once; the UI shows these bytes and the report embeds them
+        analysis["result_id"] = key.replace("/", "-")
+        encode_display_images(analysis, decoded if budget.max_side else image)
+        job.publish("report", report_file(analysis, refresh=True))
+    cache.put(key, analysis)
+    if config.SIMILAR_CASES:
+        with span("similar_index"):
+            index_analysis(analysis, image.sha256)
+    job.publish("analysis", analysis)
+    return analysis
+
+
+def encode_display_images(analysis, image):
+    """Store the encoded mask and heatmap overlays in the analysis as uint8 arrays
+
+    Each layer has a full-resolution JPEG (<layer>_image, embedded in
+    reports) and a display-size variant (<layer>_display, shown in the UI).
+    """
+    images = render_overlays(
+        image, analysis["mask"], analysis.get("gradcam"), analysis.get("result_id"), analysis.get("gradcam_mode")
+    )
+    analysis.update({name: np.frombuffer(data, np.uint8) for name, data in images.items()})
+    return analysis
+
+
+def report_file(analysis, refresh=False):
+    """Path of the analysis' HTML report, streamed to disk on first use"""
+    path = os.path.join(config.REPORTS_DIR, f"{analysis['result_id']}.html")
+    if refresh or not os.path.exists(path):
+        write_report(analysis, path)
+    return path
+
+
+def _eager(model):
+    # The session's own model doubles as the Grad-CAM reference when it runs eagerly
+    return resolve_model(model) if config.EXECUTION_BACKEND == "eager" else None
+
+
+def exact_gradcam(image, activations, class_index, model=None):
+    """Grad-CAM for the predicted class, reusing recorded activations when there are any"""
+    model = model or get_reference_model("classification")
+    if activations:
+        return combine_layers(gradcam_from_activations(model, activations, [class_index])[class_index])
+    return compute_gradcam(image, model, class_index)
+
+
+def with_exact_gradcam(image, analysis=None, depth=None):
+    """The analysis of an image with exact Grad-CAM, computed on first request and cached with the result"""
+    image = DecodedImage.from_upload(image)
+    cache = get_result_cache()
+    budget = get_budget(analysis.get("depth") if analysis is not None else depth)
+    key = cache.key(image, variant=budget.cache_variant)
+    analysis = analysis if analysis is not None else cache.get(key)
+    if analysis is None:
+        raise KeyError("Image has not been analysed yet")
+    if analysis.get("gradcam") is not None and analysis.get("gradcam_mode") == "gradcam":
+        return analysis
+    activations = {k[len(ACTIVATION_PREFIX):]: v for k, v in analysis.items() if k.startswith(ACTIVATION_PREFIX)}
+    with span("gradcam_exact"):
+        heatmap = exact_gradcam(image, activations, analysis["class_index"])
+    analysis = encode_display_images({**analysis, "gradcam": heatmap, "gradcam_mode": "gradcam", "gradcam_note": None}, image)
+    if "result_id" in analysis:
+        report_file(analysis, refresh=True)
+    cache.put(key, analysis)
+    return analysis
+
+
+def get_gradcam(image, analysis=None):
+    """Exact Grad-CAM heatmap for an analysed image"""
+    return with_exact_gradcam(image, analysis)["gradcam"]
+
+
+def overlay_heatmap(image, heatmap):
+    """Blend a [0, 1] heatmap over the image with a red-to-yellow ramp"""
+    return Image.fromarray(composite(np.asarray(image), heatmap=heatmap))
+
+
+def analyze_image(image, segmentation_model, classification_model, llm, use_cache=True, depth=None):
+    """Run the staged analysis inline and return the analysis dict"""
+    job = Job(ANALYSIS_STAGES, timeout=0)
+    image = DecodedImage.from_upload(image)
+    return run_analysis(job, image, segmentation_model, classification_model, llm, use_cache, depth=depth)
+
+
+def submit_analysis(image, segmentation_model, classification_model, llm, include_gradcam=False, timeout=None,
+                    depth=None):
+    """Start the analysis as a background job and return the Job to poll"""
+    # Detached from the Streamlit upload buffer, which the script thread keeps using
+    image = DecodedImage.from_upload(image)
+    return get_job_manager().submit(
+        run_analysis, ANALYSIS_STAGES, image, segmentation_model, classification_model, llm,
+        include_gradcam=include_gradcam, depth=depth, timeout=timeout,
+    )
+
+
+def process_image(image, segmentation_model, classification_model, llm):
+    """Run the full analysis pipeline on an uploaded image
+
+    Returns (segmented_image, wound_class, risk_level, recommendations,
+    explanation, metrics, confidence); metrics is empty when nothing was
+    measured and confidence is the classifier's top probability.
+    """
+    image = DecodedImage.from_upload(image)
+    analysis = analyze_image(image, segmentation_model, classification_model, llm)
+    return (
+        display_image(analysis, "overlay"),
+        analysis["wound_class"],
+        analysis["risk_level"],
+        analysis["recommendations"],
+        analysis["explanation"],
+        analysis.get("metrics") or {},
+        analysis["confidence"],
+    )
+
+
+def process_video(video, segmentation_model, classification_model, llm):
+    """Run the analysis pipeline on the best keyframes of an uploaded video
+
+    Returns the same tuple as process_image.
+    """
+    with trace("video_analysis"):
+        analysis = _analyze_video(video, segmentation_model, classification_model, llm)
+    # Rendered once per result; Streamlit reruns reuse the encoded bytes
+    images = render_overlays(Image.fromarray(analysis["frame"]), analysis["mask"], result_id=analysis.get("result_id"))
+    return (
+        images["overlay_display"],
+        analysis["wound_class"],
+        analysis["risk_level"],
+        analysis["recommendations"],
+        analysis["explanation"],
+        analysis.get("metrics") or {},
+        analysis["confidence"],
+    )
+
+
+def _analyze_video(video, segmentation_model, classification_model, llm):
+    from backend.video import analyze_video
+
+    cache = get_result_cache()
+    with span("cache_lookup"):
+        key = cache.key(video)
+        analysis = cache.get(key)
+    if analysis is None:
+        with span("keyframes"):
+            result = analyze_video(video, segmentation_model, classification_model)
+        wound_class = result["wound_class"]
+        risk_level = estimate_risk(wound_class, result["mask"])
+        # Measured before the LLM call so its advice can refer to the wound's size
+        with span("measurement"):
+            metrics = wound_metrics(result["mask"], result["frame"])
+        with span("llm"):
+            recommendations, explanation = resolve_model(llm).generate_recommendations(
+                wound_class, risk_level, metrics
+            )
+        analysis = {
+            "mask": result["mask"],
+            "frame": result["frame"],
+            "probabilities": result["probabilities"],
+            "class_index": result["class_index"],
+            "wound_class": wound_class,
+            "confidence": result["confidence"],
+            "risk_level": risk_level,
+            "recommendations": recommendations,
+            "explanation": explanation,
+            "metrics": metrics,
+            "keyframes": result["keyframes"],
+            "gradcam": None,
+            "result_id": key.replace("/", "-"),
+        }
+        cache.put(key, analysis)
+    return analysis
+
+
+def generate_report(wound_class, risk_level, recommendations, explanation, confidence=0.0):
+    """Build the downloadable report for an analysis"""
+    return render_report({
+        "wound_class": wound_class,
+        "risk_level": risk_level,
+        "recommendations": recommendations,
+        "explanation": explanation,
+        "confidence": confidence,
+    })
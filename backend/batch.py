@@ -0,0 +1,299 @@
+import argparse
+import collections
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from backend import config
+from backend.images import DecodedImage
+from backend.inference import get_registry, preprocess_array, resolve_model, summarize_probabilities
+from backend.runtimes import IMAGE_EXTENSIONS
+from backend.utils import METRIC_NAMES, wound_metrics_batch
+
+# Batch analysis of image archives:
+#   python -m backend.batch data/uploads --output data/results/batch.jsonl
+# Worker processes read, decode and preprocess; the main process runs batched
+# segmentation and classification and measures the whole batch at once (looking for a
+# scale marker outside the wound mask when SAFEHEAL_SCALE_DETECTION is on). Results
+# are appended as they are produced, so an interrupted run picks up where it stopped
+# when started again with the same output; images that failed are retried.
+MANIFEST_EXTENSIONS = (".txt", ".csv", ".jsonl")
+
+
+def list_inputs(source, recursive=True):
+    """Image paths from a directory (sorted, recursive) or a manifest file"""
+    if os.path.isdir(source):
+        paths = []
+        for root, directories, names in os.walk(source):
+            directories.sort()
+            paths.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(IMAGE_EXTENSIONS))
+            if not recursive:
+                break
+        return [os.path.abspath(p) for p in paths]
+    if not source.lower().endswith(MANIFEST_EXTENSIONS):
+        raise ValueError(f"Expected a directory or a {'/'.join(MANIFEST_EXTENSIONS)} manifest, got '{source}'")
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        if source.lower().endswith(".jsonl"):
+            paths = [json.loads(line)["path"] for line in f if line.strip()]
+        elif source.lower().endswith(".csv"):
+            paths = [row["path"] for row in csv.DictReader(f)]
+        else:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [os.path.abspath(os.path.join(base, p)) for p in paths]
+
+
+def decode_image(path, measure_size=None):
+    """Worker-side half of the pipeline: everything that does not need the models"""
+    measure_size = measure_size or config.BATCH_MEASURE_SIZE
+    try:
+        image = DecodedImage.from_upload(path)
+        # Masks are measured at a bounded resolution; pixel results are scaled back later. Large
+        # JPEGs are decoded straight to that resolution and never at full size.
+        preview = image.thumbnail(measure_size) if max(image.size) > measure_size else image.image()
+        pixels = np.asarray(preview)
+        return {
+            "path": path,
+            "sha256": image.sha256,
+            "width": image.width,
+            "height": image.height,
+            "input": preprocess_array(preview),
+            "pixels": pixels,
+            "pixel_scale": image.width / preview.width,
+        }
+    except Exception as exc:
+        return {"path": path, "error": f"{type(exc).__name__}: {exc}"}
+
+
+def _decode_worker(args):
+    return decode_image(*args)
+
+
+def _bounded_map(executor, fn, items, ahead):
+    """executor.map that keeps at most `ahead` results in flight, in order"""
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@torch.no_grad()
+def analyze_decoded(items, segmentation_model, classification_model, threshold=None):
+    """Batched segmentation, classification and measurement of decode_image() results
+
+    The scale is detected from each photo after segmentation, so the wound
+    itself is never taken for a calibration marker.
+    """
+    threshold = config.MASK_THRESHOLD if threshold is None else threshold
+    batch = torch.from_numpy(np.stack([item["input"] for item in items])).to(config.DEVICE)
+    logits = resolve_model(segmentation_model)(batch)
+    probabilities = F.softmax(resolve_model(classification_model)(batch), dim=1).cpu().numpy()
+    masks = []
+    for i, item in enumerate(items):
+        size = item["pixels"].shape[:2]
+        upsampled = F.interpolate(logits[i:i + 1], size=size, mode="bilinear", align_corners=False)
+        masks.append((torch.sigmoid(upsampled)[0, 0] > threshold).cpu().numpy().astype(np.uint8))
+    metrics = wound_metrics_batch(
+        masks, [item["pixels"] for item in items], pixel_scales=[item["pixel_scale"] for item in items],
+    )
+    records = []
+    for item, probs, measurement in zip(items, probabilities, metrics):
+        summary = summarize_probabilities(probs)
+        records.append({
+            "path": item["path"],
+            "sha256": item["sha256"],
+            "width": item["width"],
+            "height": item["height"],
+            "wound_class": summary["wound_class"],
+            "class_index": summary["class_index"],
+            "confidence": summary["confidence"],
+            "probabilities": [float(p) for p in probs],
+            "metrics": measurement,
+        })
+    return records
+
+
+class JsonlWriter:
+    """Appends one JSON object per line; a line cut off by a crash is dropped on reopen
+
+    Only images analysed successfully count as done; failed ones are
+    retried on the next run and their new record appended.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                f.truncate(end)
+            for line in data[:end].splitlines():
+                record = json.loads(line)
+                if "error" not in record:
+                    self.done.add(record["path"])
+        self._file = open(path, "a")
+
+    def write(self, records):
+        for record in records:
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _flatten(record):
+    flat = {k: v for k, v in record.items() if k != "metrics"}
+    flat.update({f"metric_{k}": v for k, v in (record.get("metrics") or {}).items()})
+    return flat
+
+
+def parquet_schema():
+    """One schema for every part file, whatever units or failures its batch happens to contain"""
+    import pyarrow as pa
+
+    return pa.schema([
+        ("path", pa.string()),
+        ("sha256", pa.string()),
+        ("width", pa.int64()),
+        ("height", pa.int64()),
+        ("wound_class", pa.string()),
+        ("class_index", pa.int64()),
+        ("confidence", pa.float64()),
+        ("probabilities", pa.list_(pa.float64())),
+        *((f"metric_{name}", pa.int64() if name == "components" else pa.float64()) for name in METRIC_NAMES),
+        ("error", pa.string()),
+    ])
+
+
+class ParquetWriter:
+    """Writes each batch as a new part file in a directory, so a crash never corrupts earlier parts
+
+    Every part has parquet_schema(); failed images have only path and
+    error set and are retried on the next run.
+    """
+
+    def __init__(self, path):
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self._pq = pq
+        self.schema = parquet_schema()
+        os.makedirs(path, exist_ok=True)
+        self.parts = sorted(n for n in os.listdir(path) if n.startswith("part-") and n.endswith(".parquet"))
+        self.done = set()
+        for name in self.parts:
+            part = os.path.join(path, name)
+            columns = [c for c in ("path", "error") if c in pq.read_schema(part).names]
+            table = pq.read_table(part, columns=columns).to_pydict()
+            errors = table.get("error") or [None] * len(table["path"])
+            self.done.update(p for p, error in zip(table["path"], errors) if error is None)
+
+    def write(self, records):
+        import pyarrow as pa
+
+        name = f"part-{len(self.parts):06d}.parquet"
+        temp_path = os.path.join(self.path, f".{name}.tmp")
+        table = pa.Table.from_pylist([_flatten(r) for r in records], schema=self.schema)
+        self._pq.write_table(table, temp_path)
+        os.replace(temp_path, os.path.join(self.path, name))
+        self.parts.append(name)
+
+    def close(self):
+        pass
+
+
+def open_writer(path, format=None):
+    format = format or ("parquet" if path.endswith(".parquet") else "jsonl")
+    return ParquetWriter(path) if format == "parquet" else JsonlWriter(path)
+
+
+def run_batch(source, output=None, format=None, batch_size=None, workers=None, measure_size=None,
+              limit=None, progress=None):
+    """Analyse every image of a directory or manifest not already in output
+
+    Returns counts and throughput; progress, if given, is called with
+    (processed, total, images_per_second) after every batch.
+    """
+    output = output or os.path.join(config.RESULTS_DIR, "batch.jsonl")
+    batch_size = batch_size or config.BATCH_MAX_SIZE
+    workers = workers or os.cpu_count() or 1
+    writer = open_writer(output, format)
+    paths = list_inputs(source)
+    pending = [p for p in paths if p not in writer.done]
+    if limit is not None:
+        pending = pending[:limit]
+
+    registry = get_registry()
+    stats = {"images": len(paths), "skipped": len(paths) - len(pending), "processed": 0, "failed": 0}
+    start = time.perf_counter()
+    try:
+        with registry.acquire("segmentation") as segmentation, registry.acquire("classification") as classification, \
+                ProcessPoolExecutor(max_workers=workers) as executor:
+            decoded = _bounded_map(executor, _decode_worker, ((p, measure_size) for p in pending), workers * 4)
+            for batch in _batches(decoded, batch_size):
+                failed = [{"path": item["path"], "error": item["error"]} for item in batch if "error" in item]
+                ok = [item for item in batch if "error" not in item]
+                records = analyze_decoded(ok, segmentation, classification) if ok else []
+                writer.write(records + failed)
+                stats["processed"] += len(records)
+                stats["failed"] += len(failed)
+                if progress is not None:
+                    done = stats["processed"] + stats["failed"]
+                    progress(done, len(pending), done / (time.perf_counter() - start))
+    finally:
+        writer.close()
+    stats["seconds"] = time.perf_counter() - start
+    stats["images_per_s"] = (stats["processed"] + stats["failed"]) / stats["seconds"] if stats["seconds"] else 0.0
+    stats["output"] = output
+    return stats
+
+
+def _print_progress(done, total, rate):
+    print(f"\r{done}/{total} images, {rate:.1f} images/s", end="", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.batch", description="SafeHeal batch analysis")
+    parser.add_argument("source", nargs="?", default=config.UPLOAD_DIR, help="image directory or manifest")
+    parser.add_argument("--output", default=os.path.join(config.RESULTS_DIR, "batch.jsonl"),
+                        help="JSONL file, or a directory of Parquet parts when ending in .parquet")
+    parser.add_argument("--format", choices=("jsonl", "parquet"))
+    parser.add_argument("--batch-size", type=int, default=config.BATCH_MAX_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="decode processes")
+    parser.add_argument("--measure-size", type=int, default=config.BATCH_MEASURE_SIZE)
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args(argv)
+    stats = run_batch(args.source, args.output, args.format, args.batch_size, args.workers,
+                      args.measure_size, args.limit, progress=_print_progress)
+    print(file=sys.stderr)
+    print(json.dumps(stats, indent=2))
+    return 0 if stats["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,203 @@
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from backend.telemetry import get_metrics
+
+_QUEUE_DEPTH = get_metrics().gauge("safeheal_batch_queue_depth", "Requests waiting for a batched forward pass", ("queue",))
+_QUEUE_WAIT = get_metrics().histogram(
+    "safeheal_batch_queue_wait_seconds", "Time requests spend queued before their batch runs", ("queue",)
+)
+_BATCH_SIZE = get_metrics().histogram(
+    "safeheal_batch_size", "Requests per batched forward pass", ("queue",), buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+_FORWARD_SECONDS = get_metrics().histogram("safeheal_batch_forward_seconds", "Duration of batched forward passes", ("queue",))
+_REJECTED = get_metrics().counter("safeheal_batch_rejected_total", "Requests refused because the queue was full", ("queue",))
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the batching queue is at capacity and the caller can't wait any longer"""
+
+
+class _Request:
+    __slots__ = ("tensor", "future", "enqueued_at")
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchMetrics:
+    """Thread-safe batch size and queue wait statistics"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._waits = collections.deque(maxlen=window)
+        self.batch_sizes = collections.Counter()
+        self.requests = 0
+        self.batches = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def record_batch(self, waits):
+        with self._lock:
+            self.batches += 1
+            self.requests += len(waits)
+            self.batch_sizes[len(waits)] += 1
+            self._waits.extend(waits)
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        """Return the current counters and queue wait percentiles in milliseconds"""
+        with self._lock:
+            waits = np.array(self._waits, dtype=np.float64) * 1000.0
+            sizes = dict(self.batch_sizes)
+            snapshot = {
+                "requests": self.requests,
+                "batches": self.batches,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "batch_sizes": sizes,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            }
+        if waits.size:
+            p50, p95, p99 = np.percentile(waits, [50, 95, 99])
+            snapshot["queue_wait_ms"] = {
+                "mean": float(waits.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(waits.max()),
+            }
+        else:
+            snapshot["queue_wait_ms"] = {}
+        return snapshot
+
+
+def bucket_shape(shape, granularity):
+    """Round a (h, w) shape up to the next multiple of granularity"""
+    return tuple(-(-dim // granularity) * granularity for dim in shape)
+
+
+def pad_to(tensor, shape):
+    """Zero-pad a CxHxW tensor on the bottom and right to shape (h, w)"""
+    pad_h = shape[0] - tensor.shape[-2]
+    pad_w = shape[1] - tensor.shape[-1]
+    if pad_h == 0 and pad_w == 0:
+        return tensor
+    return F.pad(tensor, (0, pad_w, 0, pad_h))
+
+
+class MicroBatcher:
+    """Groups single-item requests from many threads into batched forward passes
+
+    Callers submit one CxHxW tensor and get a Future back. A worker thread
+    takes the first waiting request, then keeps collecting until either
+    max_batch_size requests are in hand or max_latency_ms has passed since
+    that first request. Requests are bucketed by resolution (rounded up to
+    bucket_granularity and zero-padded), and each bucket is one call to
+    forward(batch, shapes), which must return one result per item.
+    """
+
+    def __init__(self, forward, max_batch_size=8, max_latency_ms=10.0, max_queue_depth=64,
+                 bucket_granularity=32, name="safeheal-batcher"):
+        self.forward = forward
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.bucket_granularity = bucket_granularity
+        self.name = name
+        self.metrics = BatchMetrics()
+        self._queue = queue.Queue(maxsize=max_queue_depth)
+        self._closed = threading.Event()
+        _QUEUE_DEPTH.set_function(lambda: None if self._closed.is_set() else self.queue_depth, queue=name)
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, tensor, timeout=None):
+        """Queue a CxHxW tensor for batched inference and return its Future
+
+        When the queue is full the call blocks for up to timeout seconds
+        (forever if None, not at all if 0) and then raises QueueFullError.
+        """
+        if self._closed.is_set():
+            raise RuntimeError("Batcher is closed")
+        request = _Request(tensor)
+        try:
+            self._queue.put(request, block=timeout != 0, timeout=timeout or None)
+        except queue.Full:
+            self.metrics.record_rejected()
+            _REJECTED.inc(queue=self.name)
+            raise QueueFullError(f"Inference queue is full ({self._queue.maxsize} pending requests)") from None
+        return request.future
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch or latency window fills"""
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first.enqueued_at + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(block=remaining > 0, timeout=max(remaining, 0) or None))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._closed.is_set() or not self._queue.empty():
+            batch = self._collect()
+            if not batch:
+                continue
+            buckets = collections.defaultdict(list)
+            for request in batch:
+                if request.future.set_running_or_notify_cancel():
+                    shape = bucket_shape(request.tensor.shape[-2:], self.bucket_granularity)
+                    buckets[shape].append(request)
+            for shape, requests in buckets.items():
+                self._run_bucket(shape, requests)
+
+    def _run_bucket(self, shape, requests):
+        started = time.perf_counter()
+        waits = [started - r.enqueued_at for r in requests]
+        self.metrics.record_batch(waits)
+        _BATCH_SIZE.observe(len(requests), queue=self.name)
+        for wait in waits:
+            _QUEUE_WAIT.observe(wait, queue=self.name)
+        try:
+            batch = torch.stack([pad_to(r.tensor, shape) for r in requests])
+            outputs = self.forward(batch, [tuple(r.tensor.shape[-2:]) for r in requests])
+            _FORWARD_SECONDS.observe(time.perf_counter() - started, queue=self.name)
+        except Exception as exc:
+            self.metrics.record_error()
+            for request in requests:
+                request.future.set_exception(exc)
+            return
+        for request, output in zip(requests, outputs):
+            request.future.set_result(output)
+
+    def close(self, wait=True):
+        """Stop accepting requests; pending ones are still processed"""
+        self._closed.set()
+        if wait:
+            self._worker.join()
@@ -0,0 +1,326 @@
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+
+from backend import config
+from backend.budgets import BUDGETS, DEPTHS
+from backend.gradcam import gradcam_from_activations, score_cam
+from backend.images import DecodedImage
+from backend.inference import (
+    ActivationRecorder,
+    build_classification_model,
+    build_segmentation_model,
+    compare_fused,
+    load_image,
+    preprocess_image,
+    tie_backbone,
+)
+from backend.llm_service import WoundLLM
+from backend.llm_stub import start_stub_server
+from backend.overlays import get_overlay_cache, render_overlays
+from backend.report_generator import encode_image, iter_report
+from backend.quality import assess_quality
+from backend.runtimes import prepare_model
+from backend.startup import HEAVY_MODULES
+from backend.utils import wound_metrics
+
+# Offline benchmark of every stage of the analysis pipeline:
+#   python -m backend.benchmark --sizes 512 1024 2048 --batch-sizes 1 4 8
+#   python -m backend.benchmark --compare data/results/benchmarks/baseline.json
+# Images are synthetic and the EdgeNext models randomly initialized, so no checkpoints
+# or network access are needed; model outputs are meaningless, only timings matter.
+# Results are one row per (stage, image size, batch size) with latency percentiles,
+# throughput and the process's peak RSS after the stage. The import stage is the cold
+# import of the pipeline modules in a fresh interpreter, as on app startup. The
+# analysis_<level> stages run a whole uncached analysis at each detail level, and
+# --check-targets fails if one misses its p95 latency target.
+#   python -m backend.benchmark --fused-parity 8   fused vs two-model parity and latency
+STAGES = (
+    "import", "decode", "preview", "quality", "preprocess", "segmentation", "classification", "measurement", "overlay", "gradcam",
+    "scorecam", "llm", "report", *(f"analysis_{depth.lower()}" for depth in DEPTHS),
+)
+# Largest class probability difference the fused path may show against the two-model path
+FUSED_TOLERANCE = 1e-4
+# Image height the detail levels' latency targets are defined for (see backend/budgets.py)
+TARGET_IMAGE_SIZE = 2048
+BENCHMARK_DIR = os.path.join(config.RESULTS_DIR, "benchmarks")
+
+
+def synthetic_wound(size, seed=0):
+    """A skin-toned photo with a reddish, irregular wound and a matching ground-truth mask"""
+    rng = np.random.default_rng(seed)
+    height, width = size, int(size * 4 / 3)
+    skin = np.array([224, 172, 150], dtype=np.float32)
+    pixels = skin + rng.normal(0, 8, (height, width, 3)).astype(np.float32)
+    mask_image = Image.new("L", (width, height), 0)
+    angles = np.linspace(0, 2 * np.pi, 24, endpoint=False)
+    radii = rng.uniform(0.6, 1.0, angles.size) * size / 4
+    points = [(width / 2 + r * np.cos(a) * 1.4, height / 2 + r * np.sin(a)) for r, a in zip(radii, angles)]
+    ImageDraw.Draw(mask_image).polygon(points, fill=1)
+    mask = np.asarray(mask_image, dtype=np.uint8)
+    wound = np.array([170, 40, 45], dtype=np.float32) + rng.normal(0, 15, (height, width, 3)).astype(np.float32)
+    pixels[mask.astype(bool)] = wound[mask.astype(bool)]
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)), mask
+
+
+def random_models(backend="eager", seed=0):
+    """Randomly initialized segmentation and classification models, prepared for a backend"""
+    torch.manual_seed(seed)
+    segmentation = build_segmentation_model().to(config.DEVICE).eval()
+    classification = build_classification_model().to(config.DEVICE).eval()
+    if backend != "eager":
+        segmentation = prepare_model(segmentation, "benchmark_segmentation", backend, calibration_images=[])
+        classification = prepare_model(classification, "benchmark_classification", backend, calibration_images=[])
+    return segmentation, classification
+
+
+def cold_import(modules=HEAVY_MODULES):
+    """Import modules in a fresh interpreter, like the app's warm-up thread on a cold start"""
+    subprocess.run([sys.executable, "-c", f"import {', '.join(modules)}"], check=True, cwd=config.BASE_DIR)
+
+
+def peak_rss_mb():
+    """High-water resident set size of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if platform.system() == "Darwin" else peak / 2**10
+
+
+def time_stage(fn, repeats, warmup=2):
+    """Per-call latencies in ms after a few warm-up calls"""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(stage, latencies, image_size=None, batch_size=1):
+    latencies = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "stage": stage,
+        "image_size": image_size,
+        "batch_size": batch_size,
+        "repeats": int(latencies.size),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(latencies.mean()),
+        "throughput_per_s": float(batch_size * 1000 / latencies.mean()),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+@torch.no_grad()
+def run_benchmark(sizes=(512, 1024, 2048), batch_sizes=(1, 4, 8), repeats=20, stages=STAGES, backend="eager"):
+    """Time each requested pipeline stage and return the report dict"""
+    segmentation, classification = random_models(backend)
+    results = []
+
+    def record(stage, fn, image_size=None, batch_size=1, count=repeats):
+        if stage in stages:
+            results.append(summarize(stage, time_stage(fn, count), image_size, batch_size))
+
+    analysis_stages = [f"analysis_{depth.lower()}" for depth in DEPTHS]
+    llm_server = llm = None
+    if {"llm", *analysis_stages} & set(stages):
+        llm_server, url = start_stub_server(token_delay=0)
+        # No response cache, so every call streams a full reply from the stub
+        llm = WoundLLM(url=url, cache_size=0)
+    try:
+        # Each run starts an interpreter, so fewer repeats than the in-process stages
+        record("import", cold_import, count=min(repeats, 5))
+        for size in sizes:
+            image, mask = synthetic_wound(size)
+            jpeg = encode_image(image)
+            record("decode", lambda: load_image(io.BytesIO(jpeg)), size)
+            record("preview", lambda: DecodedImage(jpeg).thumbnail(), size)
+            # Decode included, as the gate runs on a fresh upload; the wound-present classifier is left out
+            record("quality", lambda: assess_quality(DecodedImage(jpeg), mode="warn"), size)
+            record("preprocess", lambda: preprocess_image(image), size)
+            record("measurement", lambda: wound_metrics(mask, image), size)
+            heatmap = np.random.default_rng(size).random((8, 8)).astype(np.float32)
+            # Uncached: both layers composited and encoded at full and display size
+            record("overlay", lambda: render_overlays(image, mask, heatmap), size)
+            analysis = {
+                "wound_class": "Burn", "risk_level": "High", "confidence": 0.9,
+                "recommendations": ["Cool the burn"] * 5, "explanation": "Synthetic analysis.",
+                "metrics": wound_metrics(mask, image), "overlay_image": jpeg, "gradcam_image": jpeg,
+            }
+            record("report", lambda: sum(len(chunk) for chunk in iter_report(analysis)), size)
+
+        tensor = preprocess_image(synthetic_wound(config.INPUT_SIZE)[0]).to(config.DEVICE)
+        for batch_size in batch_sizes:
+            batch = tensor.repeat(batch_size, 1, 1, 1)
+            record("segmentation", lambda: segmentation(batch), config.INPUT_SIZE, batch_size)
+            record("classification", lambda: classification(batch), config.INPUT_SIZE, batch_size)
+
+        if {"gradcam", "scorecam"} & set(stages) and backend == "eager":
+            with ActivationRecorder(classification, config.GRADCAM_LAYERS) as recorder:
+                classification(tensor)
+            activations = recorder.item(0)
+            record("gradcam", lambda: gradcam_from_activations(classification, activations, [0]), config.INPUT_SIZE)
+            layer = config.GRADCAM_LAYERS[-1]
+            record("scorecam", lambda: score_cam(classification, tensor, activations[layer], 0), config.INPUT_SIZE)
+
+        if "llm" in stages:
+            coverage = iter(np.linspace(0.01, 0.5, 10 * repeats))
+            record("llm", lambda: llm.generate_recommendations("Burn", "High", {"coverage": next(coverage)}))
+
+        if set(analysis_stages) & set(stages) and backend == "eager":
+            from app.routes import analyze_image
+
+            # The micro-batcher and fused model serve the registry's checkpoints, so the
+            # analyses run on this benchmark's models through the direct path
+            saved = config.BATCHING_ENABLED, config.FUSED_INFERENCE
+            config.BATCHING_ENABLED = config.FUSED_INFERENCE = False
+            try:
+                for size in sizes:
+                    jpeg = encode_image(synthetic_wound(size)[0])
+                    for depth, stage in zip(DEPTHS, analysis_stages):
+                        def analyze():
+                            # A fresh DecodedImage and no memoized overlays, so every call pays for the whole analysis
+                            get_overlay_cache().clear()
+                            analyze_image(DecodedImage(jpeg), segmentation, classification, llm, use_cache=False, depth=depth)
+
+                        record(stage, analyze, size, count=max(3, repeats // 4))
+            finally:
+                config.BATCHING_ENABLED, config.FUSED_INFERENCE = saved
+    finally:
+        if llm_server is not None:
+            llm_server.shutdown()
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "device": config.DEVICE,
+            "backend": backend,
+            "backbone": config.BACKBONE_NAME,
+            "input_size": config.INPUT_SIZE,
+        },
+        "results": results,
+    }
+
+
+@torch.no_grad()
+def fused_parity(images=8, size=512, repeats=3):
+    """compare_fused over synthetic photos, with the classifier backbone tied to the encoder
+
+    Tied random weights make the fused model take its shared-backbone path,
+    so the report covers both mask and class parity and the latency of
+    one backbone pass against two.
+    """
+    segmentation, classification = random_models()
+    tie_backbone(segmentation, classification)
+    photos = [synthetic_wound(size, seed)[0] for seed in range(images)]
+    return compare_fused(photos, segmentation, classification, repeats=repeats)
+
+
+def check_targets(report):
+    """Detail levels whose p95 latency exceeds their target, at TARGET_IMAGE_SIZE or the largest size run"""
+    misses = []
+    for depth, budget in BUDGETS.items():
+        rows = [row for row in report["results"] if row["stage"] == f"analysis_{depth.lower()}"]
+        if not rows:
+            continue
+        sizes = [row["image_size"] for row in rows]
+        size = TARGET_IMAGE_SIZE if TARGET_IMAGE_SIZE in sizes else max(sizes)
+        row = next(row for row in rows if row["image_size"] == size)
+        if row["p95_ms"] > budget.latency_target_ms:
+            misses.append({
+                "depth": depth, "image_size": size, "p95_ms": row["p95_ms"], "target_ms": budget.latency_target_ms,
+            })
+    return misses
+
+
+def _key(row):
+    return row["stage"], row["image_size"], row["batch_size"]
+
+
+def compare(baseline, current, tolerance=0.1):
+    """Rows whose p50 latency changed by more than tolerance relative to a baseline report"""
+    reference = {_key(row): row for row in baseline["results"]}
+    changes = []
+    for row in current["results"]:
+        before = reference.get(_key(row))
+        if before is None or not before["p50_ms"]:
+            continue
+        ratio = row["p50_ms"] / before["p50_ms"]
+        if abs(ratio - 1) > tolerance:
+            changes.append({
+                "stage": row["stage"], "image_size": row["image_size"], "batch_size": row["batch_size"],
+                "baseline_p50_ms": before["p50_ms"], "p50_ms": row["p50_ms"], "ratio": ratio,
+            })
+    return changes
+
+
+def format_table(report):
+    lines = [f"{'stage':<15}{'size':>6}{'batch':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'items/s':>10}{'RSS MB':>9}"]
+    for row in report["results"]:
+        lines.append(
+            f"{row['stage']:<15}{row['image_size'] or '':>6}{row['batch_size']:>6}{row['p50_ms']:>10.2f}"
+            f"{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['throughput_per_s']:>10.1f}{row['peak_rss_mb']:>9.0f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.benchmark", description="SafeHeal pipeline benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048], help="image heights in pixels")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--backend", default="eager")
+    parser.add_argument("--output", help="JSON report path (default: data/results/benchmarks/<time>.json)")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative p50 change to report")
+    parser.add_argument("--check-targets", action="store_true", help="fail if a detail level misses its latency target")
+    parser.add_argument("--fused-parity", type=int, metavar="IMAGES",
+                        help="only compare the fused path against the two-model path on this many images")
+    args = parser.parse_args(argv)
+
+    if args.fused_parity:
+        report = fused_parity(args.fused_parity, args.sizes[0], args.repeats)
+        print(json.dumps(report, indent=2))
+        return 0 if report["top1_agreement"] == 1.0 and report["max_probability_diff"] <= FUSED_TOLERANCE else 1
+
+    report = run_benchmark(args.sizes, args.batch_sizes, args.repeats, tuple(args.stages), args.backend)
+    output = args.output or os.path.join(BENCHMARK_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(format_table(report))
+    print(f"\nWrote {output}")
+    status = 0
+    if args.check_targets:
+        misses = check_targets(report)
+        print(json.dumps(misses, indent=2) if misses else "All detail levels met their latency targets")
+        status = 1 if misses else 0
+    if args.compare:
+        with open(args.compare) as f:
+            changes = compare(json.load(f), report, args.tolerance)
+        print(json.dumps(changes, indent=2))
+        return 1 if any(change["ratio"] > 1 for change in changes) else status
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,61 @@
+from backend import config
+
+# Compute budget behind the sidebar's "Analysis Detail Level". Latency targets are p95
+# wall-clock times for one uncached analysis of a 2048-pixel-high photo on the CPU, with
+# the LLM answering instantly (the local stub; Basic never calls it). The
+# "analysis_<level>" stages of python -m backend.benchmark measure them, and
+# --check-targets fails when a level misses its target.
+#   Basic     ~4x downscaled decode, classifier only, no mask or Grad-CAM, templated advice
+#   Standard  the default pipeline (mask, classification, measurement, Score-CAM, LLM)
+#   Detailed  tiled full-resolution mask, flip TTA in one batched pass, exact Grad-CAM
+BASIC = "Basic"
+STANDARD = "Standard"
+DETAILED = "Detailed"
+
+
+class AnalysisBudget:
+    """What one detail level computes and how long it is allowed to take"""
+
+    def __init__(self, name, latency_target_ms, max_side=None, segmentation=True, tiled=False, tta=False,
+                 gradcam="approximate", llm=True):
+        self.name = name
+        self.latency_target_ms = latency_target_ms
+        # Longest side the photo is decoded at; None keeps full resolution
+        self.max_side = max_side
+        self.segmentation = segmentation
+        # Always segment at full resolution in tiles, whatever the image size
+        self.tiled = tiled
+        # Classify the image and its flips in one batched forward pass and average them
+        self.tta = tta
+        # None, "approximate" (Score-CAM when enabled) or "exact"
+        self.gradcam = gradcam
+        # False serves templated advice without calling the LLM
+        self.llm = llm
+
+    @property
+    def cache_variant(self):
+        """Suffix of this level's result cache keys; Standard keeps the plain key"""
+        return None if self.name == STANDARD else self.name.lower()
+
+    def __repr__(self):
+        return f"<AnalysisBudget {self.name} {self.latency_target_ms:.0f} ms>"
+
+
+BUDGETS = {
+    BASIC: AnalysisBudget(
+        BASIC, config.BASIC_TARGET_MS, max_side=config.BASIC_MAX_SIDE, segmentation=False, gradcam=None, llm=False,
+    ),
+    STANDARD: AnalysisBudget(STANDARD, config.STANDARD_TARGET_MS),
+    DETAILED: AnalysisBudget(DETAILED, config.DETAILED_TARGET_MS, tiled=True, tta=True, gradcam="exact"),
+}
+DEPTHS = tuple(BUDGETS)
+
+
+def get_budget(depth=None):
+    """The AnalysisBudget for a detail level name (default Standard)"""
+    if isinstance(depth, AnalysisBudget):
+        return depth
+    try:
+        return BUDGETS[depth or STANDARD]
+    except KeyError:
+        raise ValueError(f"Unknown analysis detail level '{depth}', expected one of {', '.join(DEPTHS)}") from None
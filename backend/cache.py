@@ -0,0 +1,299 @@
+import collections
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from backend import config
+from backend.images import DecodedImage
+from backend.telemetry import get_metrics
+from backend.uploads import StoredUpload
+
+# Settings that change what an analysis produces, and so belong in the cache key
+_CONFIG_KEYS = (
+    "BACKBONE_NAME", "INPUT_SIZE", "MASK_THRESHOLD", "FUSED_INFERENCE", "FUSED_ROI_CROP",
+    "TILE_SIZE", "TILE_OVERLAP", "TILED_MIN_MEGAPIXELS", "TILED_COARSE_TO_FINE", "EXECUTION_BACKEND",
+    "PIPELINE_VERSION",
+)
+_META_KEY = "__meta__"
+
+_LOOKUPS = get_metrics().counter("safeheal_result_cache_lookups_total", "Result cache lookups by outcome", ("result",))
+
+
+def content_hash(data):
+    """SHA-256 of raw bytes, a file-like object, a path, a PIL image, an array, a DecodedImage or a StoredUpload"""
+    if isinstance(data, (DecodedImage, StoredUpload)):
+        # Same digest as its bytes, computed once per upload
+        return data.sha256
+    digest = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest.update(data)
+    elif isinstance(data, np.ndarray):
+        digest.update(repr((data.shape, data.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(data).data)
+    elif hasattr(data, "tobytes") and hasattr(data, "mode"):
+        digest.update(repr((data.size, data.mode)).encode())
+        digest.update(data.tobytes())
+    elif hasattr(data, "getbuffer"):
+        digest.update(data.getbuffer())
+    elif hasattr(data, "read"):
+        position = data.tell() if hasattr(data, "tell") else None
+        if position is not None:
+            data.seek(0)
+        for chunk in iter(lambda: data.read(1 << 20), b""):
+            digest.update(chunk)
+        if position is not None:
+            data.seek(position)
+    else:
+        with open(data, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+def model_version():
+    """Short hash of the checkpoint files and every config value that affects results"""
+    parts = [
+        _fingerprint(config.SEGMENTATION_WEIGHTS),
+        _fingerprint(config.CLASSIFICATION_WEIGHTS),
+        tuple((key, getattr(config, key)) for key in _CONFIG_KEYS),
+    ]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:16]
+
+
+def _entry_size(entry):
+    size = 0
+    for value in entry.values():
+        if isinstance(value, np.ndarray):
+            size += value.nbytes
+        elif isinstance(value, (bytes, str)):
+            size += len(value)
+        else:
+            size += 64
+    return size
+
+
+def _serialize(entry):
+    """Pack an analysis dict into npz bytes: arrays as members, everything else as JSON"""
+    arrays = {k: v for k, v in entry.items() if isinstance(v, np.ndarray)}
+    meta = {k: v for k, v in entry.items() if not isinstance(v, np.ndarray)}
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays, **{_META_KEY: np.array(json.dumps(meta))})
+    return buffer.getvalue()
+
+
+def _deserialize(path):
+    with np.load(path, allow_pickle=False) as data:
+        entry = json.loads(str(data[_META_KEY]))
+        entry.update({k: data[k] for k in data.files if k != _META_KEY})
+    return entry
+
+
+class ResultCache:
+    """Two-tier (memory LRU + disk) cache of analysis results keyed by image content
+
+    Keys combine the image content hash with model_version(), so results
+    computed by an older checkpoint or config are never served. On disk,
+    entries live in one directory per model version, which makes
+    invalidation a directory removal. Values are dicts of NumPy arrays and
+    JSON-serializable fields.
+    """
+
+    def __init__(self, directory=None, memory_bytes=None, disk_bytes=None):
+        self.directory = directory or config.RESULT_CACHE_DIR
+        self.memory_bytes = int(config.RESULT_CACHE_MEMORY_MB * 2**20) if memory_bytes is None else memory_bytes
+        self.disk_bytes = int(config.RESULT_CACHE_DISK_MB * 2**20) if disk_bytes is None else disk_bytes
+        self._disk_used = None
+        # Model version at the last refresh()
+        self._version = None
+        self._memory = collections.OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.RLock()
+        self.hits = collections.Counter()
+        self.misses = 0
+
+    def key(self, image, version=None, variant=None):
+        """Cache key for an image under the current (or given) model version
+
+        A variant (e.g. a non-default analysis detail level) is appended
+        to the digest, so its entries live beside the image's default one.
+        """
+        key = f"{version or model_version()}/{content_hash(image)}"
+        return f"{key}-{variant}" if variant else key
+
+    def _path(self, key):
+        version, digest = key.split("/", 1)
+        return os.path.join(self.directory, version, digest[:2], digest + ".npz")
+
+    def get(self, key):
+        """Return a cached analysis dict or None; disk hits are promoted to memory"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                _LOOKUPS.inc(result="memory_hit")
+                return dict(entry)
+        path = self._path(key)
+        try:
+            entry = _deserialize(path)
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            _LOOKUPS.inc(result="miss")
+            return None
+        _LOOKUPS.inc(result="disk_hit")
+        with self._lock:
+            self.hits["disk"] += 1
+            self._remember(key, entry)
+        return dict(entry)
+
+    def put(self, key, entry):
+        """Store an analysis dict in both tiers"""
+        entry = dict(entry)
+        with self._lock:
+            self._remember(key, entry)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        data = _serialize(entry)
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._disk_used is not None:
+                self._disk_used += len(data)
+            if self._disk_used is None or self._disk_used > self.disk_bytes:
+                self._evict_disk()
+
+    def get_or_compute(self, key, compute):
+        """Return the cached entry for key, computing and storing it on a miss"""
+        entry = self.get(key)
+        if entry is None:
+            entry = compute()
+            self.put(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        size = _entry_size(entry)
+        if size > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_used -= _entry_size(self._memory.pop(key))
+        self._memory[key] = entry
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= _entry_size(evicted)
+
+    def _evict_disk(self):
+        """Delete least recently used files until the disk tier fits its budget"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".npz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._disk_used = total
+
+    def invalidate(self, version=None):
+        """Drop every entry not computed by the current (or given) model version"""
+        keep = version or model_version()
+        with self._lock:
+            for key in [k for k in self._memory if not k.startswith(keep + "/")]:
+                self._memory_used -= _entry_size(self._memory.pop(key))
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name != keep:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        self._disk_used = None
+
+    def refresh(self):
+        """Invalidate if model_version() changed since the last refresh; returns whether it did
+
+        The first call compares against the versions found on disk, so a
+        restart with the same checkpoints and config removes nothing.
+        """
+        version = model_version()
+        with self._lock:
+            previous, self._version = self._version, version
+        if previous is None:
+            stale = os.path.isdir(self.directory) and any(name != version for name in os.listdir(self.directory))
+        else:
+            stale = previous != version
+        if stale:
+            self.invalidate(version)
+        return stale
+
+    def clear(self):
+        """Remove all cached results"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+            self._disk_used = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "memory_hits": self.hits["memory"],
+                "disk_hits": self.hits["disk"],
+                "misses": self.misses,
+            }
+
+    def hit_rate(self):
+        """Share of lookups served from either tier, or None before the first lookup"""
+        with self._lock:
+            hits = self.hits["memory"] + self.hits["disk"]
+            total = hits + self.misses
+        return hits / total if total else None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide result cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache = ResultCache()
+                metrics = get_metrics()
+                metrics.gauge("safeheal_result_cache_hit_rate", "Share of result cache lookups that hit").set_function(
+                    lambda: cache.hit_rate() or 0.0
+                )
+                metrics.gauge("safeheal_result_cache_memory_bytes", "Bytes held by the in-memory result cache").set_function(
+                    lambda: cache.stats()["memory_bytes"]
+                )
+                _cache = cache
+    return _cache
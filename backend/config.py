@@ -0,0 +1,145 @@
+import os
+
+# Project layout
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.environ.get("SAFEHEAL_MODEL_DIR", os.path.join(BASE_DIR, "models"))
+DATA_DIR = os.environ.get("SAFEHEAL_DATA_DIR", os.path.join(BASE_DIR, "data"))
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+RESULTS_DIR = os.path.join(DATA_DIR, "results")
+
+# Content-addressed upload store under UPLOAD_DIR (SAFEHEAL_UPLOAD_STORE=0 keeps uploads in memory only)
+UPLOAD_STORE = os.environ.get("SAFEHEAL_UPLOAD_STORE", "1") == "1"
+UPLOAD_MAX_MB = float(os.environ.get("SAFEHEAL_UPLOAD_MAX_MB", "5120"))
+# Files unused for this long are removed (0 keeps them until the size limit)
+UPLOAD_MAX_AGE_DAYS = float(os.environ.get("SAFEHEAL_UPLOAD_MAX_AGE_DAYS", "30"))
+# Stored files at least this large are memory-mapped instead of read into memory
+UPLOAD_MMAP_MIN_MB = float(os.environ.get("SAFEHEAL_UPLOAD_MMAP_MIN_MB", "8"))
+
+# Model checkpoints
+SEGMENTATION_WEIGHTS = os.path.join(MODEL_DIR, "updated_unet_edgenext.pth")
+CLASSIFICATION_WEIGHTS = os.path.join(MODEL_DIR, "edgenext_wound_classification.pth")
+BACKBONE_NAME = os.environ.get("SAFEHEAL_BACKBONE", "edgenext_small")
+# How checkpoints are read: pth (private copy per process), mmap (torch.load(mmap=True)) or
+# flat (converted once to <checkpoint>.flat and mapped by every worker on the host)
+WEIGHTS_FORMAT = os.environ.get("SAFEHEAL_WEIGHTS_FORMAT", "pth")
+
+# Inference settings
+DEVICE = os.environ.get("SAFEHEAL_DEVICE", "cpu")
+INPUT_SIZE = int(os.environ.get("SAFEHEAL_INPUT_SIZE", "256"))
+MASK_THRESHOLD = float(os.environ.get("SAFEHEAL_MASK_THRESHOLD", "0.5"))
+# Longest side of upload previews, decoded at reduced resolution
+PREVIEW_SIZE = int(os.environ.get("SAFEHEAL_PREVIEW_SIZE", "800"))
+
+# Analysis detail levels: latency targets (p95 ms, see backend/budgets.py) and the Basic input size
+BASIC_TARGET_MS = float(os.environ.get("SAFEHEAL_BASIC_TARGET_MS", "300"))
+STANDARD_TARGET_MS = float(os.environ.get("SAFEHEAL_STANDARD_TARGET_MS", "2000"))
+DETAILED_TARGET_MS = float(os.environ.get("SAFEHEAL_DETAILED_TARGET_MS", "10000"))
+BASIC_MAX_SIDE = int(os.environ.get("SAFEHEAL_BASIC_MAX_SIDE", "512"))
+
+# Pre-inference image quality gate: reject (block unusable photos), warn or off
+QUALITY_GATE = os.environ.get("SAFEHEAL_QUALITY_GATE", "reject")
+# Optional wound-present classifier (two classes, timm backbone) confirming images that pass the checks
+QUALITY_CLASSIFIER_WEIGHTS = os.environ.get("SAFEHEAL_QUALITY_CLASSIFIER_WEIGHTS", "")
+QUALITY_CLASSIFIER_BACKBONE = os.environ.get("SAFEHEAL_QUALITY_CLASSIFIER_BACKBONE", "mobilenetv3_small_050")
+QUALITY_CLASSIFIER_SIZE = int(os.environ.get("SAFEHEAL_QUALITY_CLASSIFIER_SIZE", "128"))
+QUALITY_WOUND_THRESHOLD = float(os.environ.get("SAFEHEAL_QUALITY_WOUND_THRESHOLD", "0.3"))
+
+# Cross-session micro-batching
+BATCHING_ENABLED = os.environ.get("SAFEHEAL_BATCHING", "1") == "1"
+BATCH_MAX_SIZE = int(os.environ.get("SAFEHEAL_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_LATENCY_MS = float(os.environ.get("SAFEHEAL_BATCH_MAX_LATENCY_MS", "10"))
+BATCH_QUEUE_DEPTH = int(os.environ.get("SAFEHEAL_BATCH_QUEUE_DEPTH", "64"))
+BATCH_SUBMIT_TIMEOUT = float(os.environ.get("SAFEHEAL_BATCH_SUBMIT_TIMEOUT", "5"))
+
+# Fused single-pass segmentation + classification
+FUSED_INFERENCE = os.environ.get("SAFEHEAL_FUSED", "0") == "1"
+FUSED_ROI_CROP = os.environ.get("SAFEHEAL_FUSED_ROI_CROP", "0") == "1"
+
+# Tiled segmentation for high-resolution photos
+TILE_SIZE = int(os.environ.get("SAFEHEAL_TILE_SIZE", "512"))
+TILE_OVERLAP = int(os.environ.get("SAFEHEAL_TILE_OVERLAP", "64"))
+TILE_BATCH_SIZE = int(os.environ.get("SAFEHEAL_TILE_BATCH_SIZE", "4"))
+TILED_MIN_MEGAPIXELS = float(os.environ.get("SAFEHEAL_TILED_MIN_MEGAPIXELS", "8"))
+TILED_COARSE_TO_FINE = os.environ.get("SAFEHEAL_TILED_COARSE_TO_FINE", "1") == "1"
+
+# Video analysis
+VIDEO_SAMPLE_FPS = float(os.environ.get("SAFEHEAL_VIDEO_SAMPLE_FPS", "2"))
+VIDEO_MAX_SAMPLE_FPS = float(os.environ.get("SAFEHEAL_VIDEO_MAX_SAMPLE_FPS", "8"))
+VIDEO_KEYFRAMES = int(os.environ.get("SAFEHEAL_VIDEO_KEYFRAMES", "4"))
+VIDEO_DUPLICATE_DISTANCE = int(os.environ.get("SAFEHEAL_VIDEO_DUPLICATE_DISTANCE", "6"))
+VIDEO_MAX_FRAMES = int(os.environ.get("SAFEHEAL_VIDEO_MAX_FRAMES", "600"))
+
+# Analysis result cache
+RESULT_CACHE_DIR = os.path.join(RESULTS_DIR, "cache")
+RESULT_CACHE_MEMORY_MB = float(os.environ.get("SAFEHEAL_RESULT_CACHE_MEMORY_MB", "256"))
+RESULT_CACHE_DISK_MB = float(os.environ.get("SAFEHEAL_RESULT_CACHE_DISK_MB", "2048"))
+# Bump when the pipeline changes in a way that makes cached results stale
+PIPELINE_VERSION = "3"
+
+# Background analysis jobs
+JOB_WORKERS = int(os.environ.get("SAFEHEAL_JOB_WORKERS", "4"))
+JOB_TIMEOUT = float(os.environ.get("SAFEHEAL_JOB_TIMEOUT", "120"))
+JOB_RETENTION = float(os.environ.get("SAFEHEAL_JOB_RETENTION", "3600"))
+
+# Execution backend: eager, torchscript, compile, int8_dynamic, int8_static or onnx
+EXECUTION_BACKEND = os.environ.get("SAFEHEAL_BACKEND", "eager")
+COMPILED_MODEL_DIR = os.path.join(MODEL_DIR, "compiled")
+CALIBRATION_DIR = os.environ.get("SAFEHEAL_CALIBRATION_DIR", os.path.join(DATA_DIR, "calibration"))
+ONNX_THREADS = int(os.environ.get("SAFEHEAL_ONNX_THREADS", "0"))
+
+# Grad-CAM
+GRADCAM_LAYERS = tuple(os.environ.get("SAFEHEAL_GRADCAM_LAYERS", "stages.3").split(","))
+GRADCAM_APPROXIMATE = os.environ.get("SAFEHEAL_GRADCAM_APPROXIMATE", "1") == "1"
+SCORECAM_CHANNELS = int(os.environ.get("SAFEHEAL_SCORECAM_CHANNELS", "8"))
+SCORECAM_SIZE = int(os.environ.get("SAFEHEAL_SCORECAM_SIZE", "128"))
+
+# Reports
+REPORTS_DIR = os.path.join(RESULTS_DIR, "reports")
+REPORT_WORKERS = int(os.environ.get("SAFEHEAL_REPORT_WORKERS", str(os.cpu_count() or 1)))
+REPORT_IMAGE_QUALITY = int(os.environ.get("SAFEHEAL_REPORT_IMAGE_QUALITY", "85"))
+# Display-size result images (PREVIEW_SIZE, WebP when available) and the in-process cache of encoded overlays
+DISPLAY_IMAGE_QUALITY = int(os.environ.get("SAFEHEAL_DISPLAY_IMAGE_QUALITY", "80"))
+OVERLAY_CACHE_MB = float(os.environ.get("SAFEHEAL_OVERLAY_CACHE_MB", "64"))
+
+# Wound measurement
+MEASUREMENT_MIN_AREA = int(os.environ.get("SAFEHEAL_MEASUREMENT_MIN_AREA", "16"))
+# Off by default: without a calibration marker or ruler in the photo measurements stay in pixels
+SCALE_DETECTION = os.environ.get("SAFEHEAL_SCALE_DETECTION", "0") == "1"
+# Longest side masks are measured at in batch analysis
+BATCH_MEASURE_SIZE = int(os.environ.get("SAFEHEAL_BATCH_MEASURE_SIZE", "1024"))
+# Side of the square calibration sticker and spacing of ruler ticks, in millimetres
+SCALE_MARKER_MM = float(os.environ.get("SAFEHEAL_SCALE_MARKER_MM", "20"))
+RULER_TICK_MM = float(os.environ.get("SAFEHEAL_RULER_TICK_MM", "1"))
+
+# Similar-case retrieval: the classifier's penultimate (pre-logits) embedding of every
+# analysis goes into a vector index; below SIMILAR_EXACT_MAX cases it is searched exactly,
+# above it through an IVF index probing SIMILAR_NPROBE lists
+SIMILAR_CASES = os.environ.get("SAFEHEAL_SIMILAR_CASES", "1") == "1"
+SIMILAR_DIR = os.path.join(RESULTS_DIR, "similar")
+EMBEDDING_LAYER = os.environ.get("SAFEHEAL_EMBEDDING_LAYER", "head.pre_logits")
+SIMILAR_TOP_K = int(os.environ.get("SAFEHEAL_SIMILAR_TOP_K", "5"))
+SIMILAR_EXACT_MAX = int(os.environ.get("SAFEHEAL_SIMILAR_EXACT_MAX", "20000"))
+SIMILAR_NPROBE = int(os.environ.get("SAFEHEAL_SIMILAR_NPROBE", "8"))
+# Rows scored per NumPy block by exact search
+SIMILAR_SEARCH_BATCH = int(os.environ.get("SAFEHEAL_SIMILAR_SEARCH_BATCH", "32768"))
+
+# Patient progress tracking
+PROGRESS_DB = os.environ.get("SAFEHEAL_PROGRESS_DB", os.path.join(DATA_DIR, "progress.db"))
+PROGRESS_MASK_SIZE = int(os.environ.get("SAFEHEAL_PROGRESS_MASK_SIZE", "128"))
+
+# Headless HTTP API (python -m app.api); when API_URL is set the Streamlit UI analyses through it
+API_URL = os.environ.get("SAFEHEAL_API_URL", "").rstrip("/")
+API_HOST = os.environ.get("SAFEHEAL_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("SAFEHEAL_API_PORT", "8000"))
+API_MAX_UPLOAD_MB = float(os.environ.get("SAFEHEAL_API_MAX_UPLOAD_MB", "50"))
+API_TIMEOUT = float(os.environ.get("SAFEHEAL_API_TIMEOUT", "60"))
+
+# Telemetry: /metrics and /traces endpoint for the Streamlit process (0 disables it;
+# the HTTP API always serves /metrics), and sampling of the slowest requests
+METRICS_HOST = os.environ.get("SAFEHEAL_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("SAFEHEAL_METRICS_PORT", "0"))
+TRACE_RETENTION = int(os.environ.get("SAFEHEAL_TRACE_RETENTION", "200"))
+# Keep collapsed-stack flame data for the N slowest traced requests (0 disables profiling)
+PROFILE_SLOWEST = int(os.environ.get("SAFEHEAL_PROFILE_SLOWEST", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("SAFEHEAL_PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.path.join(RESULTS_DIR, "profiles")
@@ -0,0 +1,111 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from backend import config
+from backend.inference import ActivationRecorder, load_image, preprocess_image, resolve_model
+
+
+def classifier_tail(model, layer):
+    """Callable mapping the output of layer to class logits by running only the layers after it"""
+    if not layer.startswith("stages."):
+        raise ValueError(f"Grad-CAM layers must be EdgeNext stages ('stages.N'), got '{layer}'")
+    index = int(layer.split(".")[1])
+    remaining = model.stages[index + 1:]
+    norm_pre = getattr(model, "norm_pre", nn.Identity())
+
+    def _tail(x):
+        return model.forward_head(norm_pre(remaining(x)))
+
+    return _tail
+
+
+def _normalize(maps):
+    """Scale each N x H x W map to [0, 1]"""
+    flat = maps.flatten(1)
+    low = flat.min(dim=1).values[:, None, None]
+    high = flat.max(dim=1).values[:, None, None]
+    return (maps - low) / (high - low).clamp_min(1e-8)
+
+
+def gradcam_from_activations(classification_model, activations, target_classes, output_size=None):
+    """Grad-CAM heatmaps for several classes and layers, starting from recorded activations
+
+    Only the part of the network after each recorded layer is re-run, and
+    all target classes share one batched forward/backward pass per layer.
+    Returns {class_index: {layer: H x W float32 heatmap in [0, 1]}}.
+    """
+    model = resolve_model(classification_model)
+    output_size = output_size or (config.INPUT_SIZE, config.INPUT_SIZE)
+    classes = [int(c) for c in target_classes]
+    heatmaps = {c: {} for c in classes}
+    index = torch.arange(len(classes), device=config.DEVICE)
+    targets = torch.tensor(classes, device=config.DEVICE)
+    for layer, activation in activations.items():
+        tail = classifier_tail(model, layer)
+        features = torch.as_tensor(activation, dtype=torch.float32, device=config.DEVICE)
+        features = features.unsqueeze(0).repeat(len(classes), 1, 1, 1).requires_grad_(True)
+        with torch.enable_grad():
+            logits = tail(features)
+            (gradients,) = torch.autograd.grad(logits[index, targets].sum(), features)
+        weights = gradients.mean(dim=(2, 3), keepdim=True)
+        cams = F.relu((weights * features.detach()).sum(dim=1, keepdim=True))
+        cams = F.interpolate(cams, size=output_size, mode="bilinear", align_corners=False)[:, 0]
+        for target, cam in zip(classes, _normalize(cams).cpu().numpy()):
+            heatmaps[target][layer] = cam.astype(np.float32)
+    return heatmaps
+
+
+def combine_layers(layer_heatmaps):
+    """Average per-layer heatmaps of one class into a single map"""
+    return np.mean(list(layer_heatmaps.values()), axis=0).astype(np.float32)
+
+
+@torch.no_grad()
+def score_cam(classification_model, tensor, activation, target_class, channels=None, size=None, output_size=None):
+    """Gradient-free approximate CAM (Score-CAM) over the strongest channels only
+
+    The top channels of the recorded activation are used as soft masks on
+    a downscaled input, all scored in one batched forward pass; each
+    channel is weighted by the target-class probability it produces.
+    Cheap enough to run on every analysis. The scoring pass runs on any
+    execution backend, but the activation must come from an
+    ActivationRecorder over an eager model: TorchScript, ONNX and fused
+    passes record none, and a missing activation raises ValueError.
+    """
+    if activation is None:
+        raise ValueError("Score-CAM needs a recorded layer activation; non-eager and fused models record none")
+    model = resolve_model(classification_model)
+    channels = channels or config.SCORECAM_CHANNELS
+    size = size or config.SCORECAM_SIZE
+    output_size = output_size or (config.INPUT_SIZE, config.INPUT_SIZE)
+
+    features = torch.as_tensor(activation, dtype=torch.float32, device=config.DEVICE)
+    top = features.mean(dim=(1, 2)).topk(min(channels, features.shape[0])).indices
+    selected = features[top]
+    masks = _normalize(F.interpolate(selected[:, None], size=(size, size), mode="bilinear", align_corners=False)[:, 0])
+    image = F.interpolate(tensor.to(config.DEVICE), size=(size, size), mode="bilinear", align_corners=False)
+    scores = F.softmax(model(image * masks[:, None]), dim=1)[:, int(target_class)]
+
+    cam = F.relu((scores[:, None, None] * selected).sum(dim=0))
+    cam = F.interpolate(cam[None, None], size=output_size, mode="bilinear", align_corners=False)[0]
+    return _normalize(cam)[0].cpu().numpy().astype(np.float32)
+
+
+def compute_gradcam(image, classification_model, target_class=None, layers=None, output_size=None):
+    """Grad-CAM heatmap for one image, from scratch
+
+    Prefer gradcam_from_activations when the classification pass already
+    recorded activations; this runs the backbone once more to get them.
+    Returns an H x W float32 map in [0, 1] at output_size (the network
+    input size by default).
+    """
+    model = resolve_model(classification_model)
+    tensor = preprocess_image(load_image(image)).to(config.DEVICE)
+    # Only the Grad-CAM layers: the recorder's default also takes the embedding layer, which has no tail to re-run
+    with torch.no_grad(), ActivationRecorder(model, layers or config.GRADCAM_LAYERS) as recorder:
+        logits = model(tensor)
+    target_class = int(logits.argmax(dim=1)) if target_class is None else int(target_class)
+    heatmaps = gradcam_from_activations(model, recorder.item(0), [target_class], output_size)
+    return combine_layers(heatmaps[target_class])
@@ -0,0 +1,174 @@
+import hashlib
+import io
+import mmap
+import threading
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from backend import config
+from backend.uploads import StoredUpload
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+_ORIENTATION_TAG = 0x0112
+
+
+class DecodedImage:
+    """One uploaded image, decoded at most once and shared by preview, inference and overlays
+
+    Holds the encoded bytes and, on first use, the full-resolution upright
+    RGB image and its pixel array; EXIF orientation is applied once during
+    that decode. Thumbnails are decoded separately at reduced resolution
+    (JPEG draft mode) so a preview never needs the full-size buffer. The
+    object is file-like enough for the result cache and the API client,
+    and backend.inference.load_image() returns its decoded image directly.
+    Images from the upload store hold the file's bytes, memory-mapped when
+    large, and reuse the store's content hash; they keep decoding after
+    upload retention removes the file.
+    """
+
+    def __init__(self, data, name=None, path=None, sha256=None):
+        # A memory map stays a map rather than being copied into a bytes object
+        self.data = data if isinstance(data, (bytes, mmap.mmap)) else bytes(data)
+        self.name = name
+        self.path = path
+        self._lock = threading.Lock()
+        self._sha256 = sha256
+        self._header = None
+        self._image = None
+        self._pixels = None
+        self._thumbnails = {}
+
+    @classmethod
+    def from_upload(cls, upload):
+        """Wrap raw bytes, a file-like object (e.g. a Streamlit upload), a StoredUpload or a path"""
+        if isinstance(upload, cls):
+            return upload
+        if isinstance(upload, StoredUpload):
+            return cls(upload.open(), upload.name, path=upload.path, sha256=upload.sha256)
+        if isinstance(upload, (bytes, bytearray, memoryview)):
+            return cls(upload)
+        if hasattr(upload, "getvalue"):
+            return cls(upload.getvalue(), getattr(upload, "name", None))
+        if hasattr(upload, "read"):
+            if hasattr(upload, "seek"):
+                upload.seek(0)
+            return cls(upload.read(), getattr(upload, "name", None))
+        with open(upload, "rb") as f:
+            return cls(f.read(), str(upload))
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+    def _open(self):
+        try:
+            return Image.open(io.BytesIO(self.data))
+        except ValueError:
+            # The memory map was closed; the stored file may still be there
+            if self.path is None:
+                raise
+            return Image.open(self.path)
+
+    def _read_header(self):
+        # Image.open only parses the header; nothing is decoded here
+        if self._header is None:
+            image = self._open()
+            width, height = image.size
+            if image.getexif().get(_ORIENTATION_TAG) in _TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            self._header = (image.format, (width, height))
+        return self._header
+
+    @property
+    def format(self):
+        return self._read_header()[0]
+
+    @property
+    def size(self):
+        """Upright (width, height), read from the header without decoding"""
+        return self._read_header()[1]
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def image(self):
+        """The full-resolution upright RGB image, decoded on first call"""
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    self._image = ImageOps.exif_transpose(self._open()).convert("RGB")
+        return self._image
+
+    def pixels(self):
+        """Read-only HxWx3 uint8 view of the decoded image, converted once"""
+        if self._pixels is None:
+            pixels = np.asarray(self.image())
+            pixels.flags.writeable = False
+            self._pixels = pixels
+        return self._pixels
+
+    def thumbnail(self, max_side=None):
+        """Upright RGB image no larger than max_side, decoded at reduced resolution when possible"""
+        max_side = max_side or config.PREVIEW_SIZE
+        with self._lock:
+            thumbnail = self._thumbnails.get(max_side)
+            full = self._image
+        if thumbnail is not None:
+            return thumbnail
+        if full is not None:
+            thumbnail = full if max(full.size) <= max_side else full.resize(
+                _fit(full.size, max_side), Image.BILINEAR, reducing_gap=2.0
+            )
+        else:
+            image = self._open()
+            # JPEG decodes straight to a 1/2, 1/4 or 1/8 scale that still covers twice the target
+            image.draft("RGB", (max_side * 2, max_side * 2))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail((max_side, max_side), Image.BILINEAR)
+            thumbnail = image
+        with self._lock:
+            self._thumbnails[max_side] = thumbnail
+        return thumbnail
+
+    def release(self):
+        """Drop the decoded buffers, keeping the encoded bytes (they decode again on demand)"""
+        with self._lock:
+            self._image = None
+            self._pixels = None
+            self._thumbnails.clear()
+
+    # File-like access to the encoded bytes, for content hashing and uploads
+    def getvalue(self):
+        return self.data if isinstance(self.data, bytes) else self.data[:]
+
+    def getbuffer(self):
+        return memoryview(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        state = "decoded" if self._image is not None else "encoded"
+        return f"<DecodedImage {self.name or self.sha256[:12]} {len(self.data)} bytes ({state})>"
+
+
+def _fit(size, max_side):
+    scale = max_side / max(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def resize_mask(mask, size):
+    """Nearest-neighbour resize of a binary mask to (width, height)"""
+    mask = np.asarray(mask)
+    if mask.shape[1::-1] == tuple(size):
+        return mask
+    return np.asarray(Image.fromarray(mask.astype(np.uint8)).resize(size, Image.NEAREST))
@@ -0,0 +1,1000 @@
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import timm
+from PIL import Image, ImageOps
+
+from backend import config
+from backend.batching import MicroBatcher
+from backend.images import DecodedImage
+from backend.runtimes import prepare_model
+from backend.weights import shared_state_dict
+
+# Wound categories predicted by the classification model
+WOUND_CLASSES = [
+    "Abrasion",
+    "Bruise",
+    "Burn",
+    "Cut",
+    "Diabetic Ulcer",
+    "Laceration",
+    "Normal Skin",
+    "Pressure Ulcer",
+    "Surgical Wound",
+    "Venous Ulcer",
+]
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+class DecoderBlock(nn.Module):
+    """Upsample, concatenate the skip connection and refine with two convolutions"""
+
+    def __init__(self, in_channels, skip_channels, out_channels):
+        super().__init__()
+        self.conv = nn.Sequential(
+            nn.Conv2d(in_channels + skip_channels, out_channels, 3, padding=1, bias=False),
+            nn.BatchNorm2d(out_channels),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(out_channels, out_channels, 3, padding=1, bias=False),
+            nn.BatchNorm2d(out_channels),
+            nn.ReLU(inplace=True),
+        )
+
+    def forward(self, x, skip=None):
+        if skip is not None:
+            x = F.interpolate(x, size=skip.shape[-2:], mode="bilinear", align_corners=False)
+            x = torch.cat([x, skip], dim=1)
+        else:
+            x = F.interpolate(x, scale_factor=2, mode="bilinear", align_corners=False)
+        return self.conv(x)
+
+
+class EdgeNextUNet(nn.Module):
+    """U-Net with an EdgeNext encoder for binary wound segmentation"""
+
+    def __init__(self, backbone=None, decoder_channels=(256, 128, 64, 32)):
+        super().__init__()
+        self.encoder = timm.create_model(backbone or config.BACKBONE_NAME, pretrained=False, features_only=True)
+        encoder_channels = self.encoder.feature_info.channels()[::-1]
+        in_channels = [encoder_channels[0]] + list(decoder_channels[:-1])
+        skip_channels = list(encoder_channels[1:]) + [0]
+        self.decoder = nn.ModuleList(
+            DecoderBlock(i, s, o) for i, s, o in zip(in_channels, skip_channels, decoder_channels)
+        )
+        self.head = nn.Conv2d(decoder_channels[-1], 1, kernel_size=1)
+
+    def decode(self, features, output_size):
+        """Run the decoder over encoder features and return mask logits at output_size"""
+        features = features[::-1]
+        x = features[0]
+        skips = list(features[1:]) + [None]
+        for block, skip in zip(self.decoder, skips):
+            x = block(x, skip)
+        logits = self.head(x)
+        return F.interpolate(logits, size=output_size, mode="bilinear", align_corners=False)
+
+    def forward(self, x):
+        return self.decode(self.encoder(x), x.shape[-2:])
+
+
+def build_segmentation_model():
+    """Create an untrained segmentation network"""
+    return EdgeNextUNet()
+
+
+def build_classification_model(num_classes=len(WOUND_CLASSES)):
+    """Create an untrained classification network"""
+    return timm.create_model(config.BACKBONE_NAME, pretrained=False, num_classes=num_classes)
+
+
+def _read_checkpoint(path, weights_format=None):
+    """Load a checkpoint and unwrap the common state-dict containers
+
+    With the "mmap" or "flat" weights format the tensors are backed by a
+    memory-mapped file shared with the other processes on the host.
+    """
+    weights_format = weights_format or config.WEIGHTS_FORMAT
+    if weights_format == "flat":
+        return shared_state_dict(path, lambda source: _read_checkpoint(source, "pth"))
+    checkpoint = torch.load(path, map_location="cpu", mmap=weights_format == "mmap")
+    if isinstance(checkpoint, nn.Module):
+        return checkpoint
+    for key in ("state_dict", "model_state_dict", "model"):
+        if isinstance(checkpoint, dict) and key in checkpoint:
+            checkpoint = checkpoint[key]
+    # Strip the prefix added by DataParallel
+    return {k[7:] if k.startswith("module.") else k: v for k, v in checkpoint.items()}
+
+
+def _num_classes_from_state(state_dict):
+    """Infer the classifier width from the head weights of a state dict"""
+    for key in ("head.fc.weight", "head.weight", "fc.weight", "classifier.weight"):
+        if key in state_dict:
+            return state_dict[key].shape[0]
+    return len(WOUND_CLASSES)
+
+
+def load_segmentation_model(device=None, weights=None, weights_format=None):
+    """Load the U-Net EdgeNext segmentation model"""
+    weights_format = weights_format or config.WEIGHTS_FORMAT
+    checkpoint = _read_checkpoint(weights or config.SEGMENTATION_WEIGHTS, weights_format)
+    if isinstance(checkpoint, nn.Module):
+        model = checkpoint
+    else:
+        model = build_segmentation_model()
+        # Mapped tensors become the parameters themselves instead of being copied into private memory
+        model.load_state_dict(checkpoint, assign=weights_format != "pth")
+    return model.to(device or config.DEVICE).eval()
+
+
+def load_classification_model(device=None, weights=None, weights_format=None):
+    """Load the EdgeNext wound classification model"""
+    weights_format = weights_format or config.WEIGHTS_FORMAT
+    checkpoint = _read_checkpoint(weights or config.CLASSIFICATION_WEIGHTS, weights_format)
+    if isinstance(checkpoint, nn.Module):
+        model = checkpoint
+    else:
+        model = build_classification_model(_num_classes_from_state(checkpoint))
+        # Mapped tensors become the parameters themselves instead of being copied into private memory
+        model.load_state_dict(checkpoint, assign=weights_format != "pth")
+    return model.to(device or config.DEVICE).eval()
+
+
+def load_prepared_model(name):
+    """Load a model and convert it for the configured execution backend"""
+    loader = load_segmentation_model if name == "segmentation" else load_classification_model
+    return prepare_model(loader(), name)
+
+
+def get_reference_model(name):
+    """Eager FP32 model for code that needs hooks or gradients (Grad-CAM, parity checks)"""
+    registry = get_registry()
+    if config.EXECUTION_BACKEND == "eager":
+        return registry.get(name)
+    return registry.get(f"{name}_reference")
+
+
+def load_models(device=None):
+    """Load the segmentation and classification models from the shared registry"""
+    registry = get_registry()
+    segmentation_model = registry.acquire("segmentation")
+    classification_model = registry.acquire("classification")
+    return segmentation_model, classification_model
+
+
+def resolve_model(model):
+    """Return the underlying model for either a registry handle or a plain module"""
+    if isinstance(model, ModelHandle):
+        return model.model
+    return model
+
+
+def class_name(index):
+    """Map a class index to a human-readable wound type"""
+    if 0 <= index < len(WOUND_CLASSES):
+        return WOUND_CLASSES[index]
+    return f"Class {index}"
+
+
+def load_image(image):
+    """Open a path, file-like object, array or PIL image as an upright RGB PIL image
+
+    A DecodedImage returns its shared decoded image, so it is decoded only once.
+    """
+    if isinstance(image, DecodedImage):
+        return image.image()
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image).convert("RGB")
+    if not isinstance(image, Image.Image):
+        if hasattr(image, "seek"):
+            image.seek(0)
+        image = Image.open(image)
+    return ImageOps.exif_transpose(image).convert("RGB")
+
+
+def preprocess_array(image, size=None):
+    """Resize and normalize an image into a 3xHxW float32 array"""
+    size = size or config.INPUT_SIZE
+    image = load_image(image).resize((size, size), Image.BILINEAR)
+    array = (np.asarray(image, dtype=np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+    return np.ascontiguousarray(array.transpose(2, 0, 1))
+
+
+def preprocess_image(image, size=None):
+    """Resize and normalize an image into a 1x3xHxW float tensor"""
+    return torch.from_numpy(preprocess_array(image, size)).unsqueeze(0)
+
+
+def postprocess_mask(logits, output_size, threshold=None):
+    """Turn mask logits into a binary uint8 mask of shape output_size (h, w)"""
+    threshold = config.MASK_THRESHOLD if threshold is None else threshold
+    probs = torch.sigmoid(F.interpolate(logits, size=output_size, mode="bilinear", align_corners=False))
+    return (probs[0, 0] > threshold).to(torch.uint8).cpu().numpy()
+
+
+def summarize_probabilities(probabilities):
+    """Build the classification fields of an inference result"""
+    index = int(np.argmax(probabilities))
+    return {
+        "probabilities": probabilities,
+        "class_index": index,
+        "wound_class": class_name(index),
+        "confidence": float(probabilities[index]),
+    }
+
+
+class ActivationRecorder:
+    """Keep the outputs of named submodules during forward passes
+
+    Used around the classification forward pass so Grad-CAM can later
+    start from these activations instead of re-running the backbone. By
+    default the Grad-CAM layers are recorded, plus the embedding layer
+    (the classifier's pre-logits output) when similar cases are enabled.
+    Modules that aren't plain eager nn.Modules (TorchScript, ONNX) are
+    left alone and record nothing.
+    """
+
+    def __init__(self, model, layers=None):
+        self.activations = {}
+        self._handles = []
+        self._model = model
+        if layers is None:
+            layers = (*config.GRADCAM_LAYERS, config.EMBEDDING_LAYER) if config.SIMILAR_CASES else config.GRADCAM_LAYERS
+        self._layers = layers
+
+    def __enter__(self):
+        if isinstance(self._model, nn.Module) and not isinstance(self._model, torch.jit.ScriptModule):
+            for name in self._layers:
+                try:
+                    module = self._model.get_submodule(name)
+                except AttributeError:
+                    continue
+                self._handles.append(module.register_forward_hook(self._hook(name)))
+        return self
+
+    def _hook(self, name):
+        def _record(module, inputs, output):
+            self.activations[name] = output.detach()
+        return _record
+
+    def __exit__(self, *exc):
+        for handle in self._handles:
+            handle.remove()
+        self._handles.clear()
+
+    def item(self, index):
+        """Activations of one batch item as float32 arrays"""
+        return {name: a[index].float().cpu().numpy() for name, a in self.activations.items()}
+
+
+@torch.no_grad()
+def run_inference(image, segmentation_model, classification_model, threshold=None):
+    """Segment and classify a wound image
+
+    Returns a dict with the binary mask at the original resolution and the
+    class probabilities of the classification model.
+    """
+    segmentation_model = resolve_model(segmentation_model)
+    classification_model = resolve_model(classification_model)
+    image = load_image(image)
+    tensor = preprocess_image(image).to(config.DEVICE)
+
+    mask = postprocess_mask(segmentation_model(tensor), (image.height, image.width), threshold)
+    with ActivationRecorder(classification_model) as recorder:
+        probabilities = F.softmax(classification_model(tensor), dim=1)[0].cpu().numpy()
+
+    result = summarize_probabilities(probabilities)
+    result["mask"] = mask
+    result["activations"] = recorder.item(0)
+    return result
+
+
+@torch.no_grad()
+def segment_image(image, segmentation_model, threshold=None):
+    """Binary wound mask at the image resolution (tiled for very large photos)"""
+    image = load_image(image)
+    if image.width * image.height >= config.TILED_MIN_MEGAPIXELS * 1e6:
+        return segment_tiled(image, segmentation_model, threshold=threshold)
+    tensor = preprocess_image(image).to(config.DEVICE)
+    return postprocess_mask(resolve_model(segmentation_model)(tensor), (image.height, image.width), threshold)
+
+
+@torch.no_grad()
+def classify_image(image, classification_model):
+    """Class probabilities and the predicted wound type for an image
+
+    The result's "activations" hold the Grad-CAM layer outputs of this pass.
+    """
+    classification_model = resolve_model(classification_model)
+    tensor = preprocess_image(image).to(config.DEVICE)
+    with ActivationRecorder(classification_model) as recorder:
+        probabilities = F.softmax(classification_model(tensor), dim=1)[0].cpu().numpy()
+    result = summarize_probabilities(probabilities)
+    result["activations"] = recorder.item(0)
+    return result
+
+
+@torch.no_grad()
+def classify_image_tta(image, classification_model):
+    """classify_image averaged over the image and its horizontal, vertical and double flips
+
+    The four views run as one batch of a single forward pass; the
+    recorded activations are those of the unflipped view.
+    """
+    classification_model = resolve_model(classification_model)
+    tensor = preprocess_image(image).to(config.DEVICE)
+    batch = torch.cat([tensor, tensor.flip(3), tensor.flip(2), tensor.flip(2, 3)])
+    with ActivationRecorder(classification_model) as recorder:
+        probabilities = F.softmax(classification_model(batch), dim=1).mean(dim=0).cpu().numpy()
+    result = summarize_probabilities(probabilities)
+    result["activations"] = recorder.item(0)
+    return result
+
+
+@torch.no_grad()
+def embed_image(image, classification_model):
+    """The classifier's embedding (EMBEDDING_LAYER output) of an image, or None if it can't be recorded"""
+    classification_model = resolve_model(classification_model)
+    with ActivationRecorder(classification_model, (config.EMBEDDING_LAYER,)) as recorder:
+        classification_model(preprocess_image(image).to(config.DEVICE))
+    return recorder.item(0).get(config.EMBEDDING_LAYER)
+
+
+@torch.no_grad()
+def run_inference_batch(images, segmentation_model, classification_model, threshold=None):
+    """run_inference over a list of images with one batched forward pass per model"""
+    if not images:
+        return []
+    segmentation_model = resolve_model(segmentation_model)
+    classification_model = resolve_model(classification_model)
+    images = [load_image(image) for image in images]
+    batch = torch.cat([preprocess_image(image) for image in images]).to(config.DEVICE)
+    logits = segmentation_model(batch)
+    probabilities = F.softmax(classification_model(batch), dim=1).cpu().numpy()
+    results = []
+    for i, image in enumerate(images):
+        result = summarize_probabilities(probabilities[i])
+        result["mask"] = postprocess_mask(logits[i:i + 1], (image.height, image.width), threshold)
+        results.append(result)
+    return results
+
+
+def _backbone_state(classification_model):
+    """Classifier parameters that belong to the backbone rather than the head"""
+    return [v for k, v in classification_model.state_dict().items() if not k.startswith("head")]
+
+
+def backbones_match(segmentation_model, classification_model):
+    """Check whether the segmentation encoder and classifier backbone carry identical weights"""
+    encoder = list(segmentation_model.encoder.state_dict().values())
+    backbone = _backbone_state(classification_model)
+    if len(encoder) != len(backbone):
+        return False
+    return all(a.shape == b.shape and torch.equal(a, b) for a, b in zip(encoder, backbone))
+
+
+@torch.no_grad()
+def tie_backbone(segmentation_model, classification_model):
+    """Copy the segmentation encoder's weights into the classifier backbone, so backbones_match holds
+
+    Used to exercise the shared-backbone fused path with randomly
+    initialized models.
+    """
+    backbone = [v for k, v in classification_model.state_dict().items() if not k.startswith("head")]
+    for target, source in zip(backbone, segmentation_model.encoder.state_dict().values()):
+        target.copy_(source)
+    return classification_model
+
+
+def wound_bounding_box(mask_logits, margin=0.1):
+    """Bounding box (top, left, bottom, right) of the predicted wound, or None if empty"""
+    rows = torch.nonzero((mask_logits > 0).any(dim=-1), as_tuple=True)[0]
+    cols = torch.nonzero((mask_logits > 0).any(dim=-2), as_tuple=True)[0]
+    if rows.numel() == 0:
+        return None
+    height, width = mask_logits.shape[-2:]
+    top, bottom = int(rows[0]), int(rows[-1]) + 1
+    left, right = int(cols[0]), int(cols[-1]) + 1
+    pad_h, pad_w = int((bottom - top) * margin), int((right - left) * margin)
+    return max(top - pad_h, 0), max(left - pad_w, 0), min(bottom + pad_h, height), min(right + pad_w, width)
+
+
+def crop_to_roi(batch, mask_logits, margin=0.1):
+    """Crop each image to its predicted wound and resize back to the batch resolution"""
+    crops = []
+    for image, logits in zip(batch, mask_logits):
+        box = wound_bounding_box(logits[0], margin)
+        if box is not None:
+            top, left, bottom, right = box
+            image = F.interpolate(
+                image[None, :, top:bottom, left:right], size=batch.shape[-2:],
+                mode="bilinear", align_corners=False,
+            )[0]
+        crops.append(image)
+    return torch.stack(crops)
+
+
+class FusedWoundModel(nn.Module):
+    """Segmentation and classification in a single pass over a shared EdgeNext backbone
+
+    When the two checkpoints share backbone weights (or share_backbone=True)
+    the encoder runs once and its last stage feeds the classifier head
+    directly. Otherwise the classifier keeps its own backbone and, with
+    roi_crop=True, looks only at the predicted wound region.
+    """
+
+    def __init__(self, segmentation_model, classification_model, share_backbone=None, roi_crop=False):
+        super().__init__()
+        self.segmentation_model = segmentation_model
+        self.classification_model = classification_model
+        if share_backbone is None:
+            share_backbone = backbones_match(segmentation_model, classification_model)
+        self.share_backbone = share_backbone
+        self.roi_crop = roi_crop
+
+    def forward(self, x):
+        features = self.segmentation_model.encoder(x)
+        mask_logits = self.segmentation_model.decode(features, x.shape[-2:])
+        if self.share_backbone:
+            classifier = self.classification_model
+            class_logits = classifier.forward_head(getattr(classifier, "norm_pre", nn.Identity())(features[-1]))
+        else:
+            inputs = crop_to_roi(x, mask_logits) if self.roi_crop else x
+            class_logits = self.classification_model(inputs)
+        return mask_logits, class_logits
+
+
+def build_fused_model(segmentation_model=None, classification_model=None, share_backbone=None, roi_crop=None):
+    """Wrap the shared (or given) models in a FusedWoundModel"""
+    return FusedWoundModel(
+        resolve_model(segmentation_model) if segmentation_model is not None else get_reference_model("segmentation"),
+        resolve_model(classification_model) if classification_model is not None else get_reference_model("classification"),
+        share_backbone=share_backbone,
+        roi_crop=config.FUSED_ROI_CROP if roi_crop is None else roi_crop,
+    ).eval()
+
+
+def _load_fused_model():
+    return prepare_model(build_fused_model(), "fused")
+
+
+@torch.no_grad()
+def run_fused_inference(image, fused_model, threshold=None):
+    """Same contract as run_inference, using one FusedWoundModel forward pass"""
+    fused_model = resolve_model(fused_model)
+    image = load_image(image)
+    tensor = preprocess_image(image).to(config.DEVICE)
+    mask_logits, class_logits = fused_model(tensor)
+    result = summarize_probabilities(F.softmax(class_logits, dim=1)[0].cpu().numpy())
+    result["mask"] = postprocess_mask(mask_logits, (image.height, image.width), threshold)
+    return result
+
+
+def tile_origins(length, tile_size, overlap):
+    """Start offsets of overlapping windows covering [0, length); the last one is flush with the end"""
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)
+    return origins
+
+
+def blend_window(tile_size, overlap):
+    """2D weight window that ramps down linearly across the overlap so seams blend smoothly"""
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        edge = np.linspace(1.0 / (overlap + 1), 1.0, overlap, endpoint=False, dtype=np.float32)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+
+def _normalize_tiles(tiles):
+    """Convert a list of HxWx3 uint8 tiles into a normalized NCHW float tensor"""
+    batch = (np.stack(tiles).astype(np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+    return torch.from_numpy(batch.transpose(0, 3, 1, 2)).to(config.DEVICE)
+
+
+@torch.no_grad()
+def _coarse_logits(pixels, segmentation_model):
+    """Whole-image mask logits at the network input size"""
+    small = Image.fromarray(pixels).resize((config.INPUT_SIZE, config.INPUT_SIZE), Image.BILINEAR)
+    return segmentation_model(_normalize_tiles([np.asarray(small)]))[0, 0].cpu()
+
+
+def _coarse_tile(coarse, top, left, tile_size, height, width):
+    """Upsample the coarse logits covering one tile to the tile's full resolution"""
+    scale_y, scale_x = coarse.shape[0] / height, coarse.shape[1] / width
+    y0, y1 = int(top * scale_y), max(int(np.ceil((top + tile_size) * scale_y)), int(top * scale_y) + 1)
+    x0, x1 = int(left * scale_x), max(int(np.ceil((left + tile_size) * scale_x)), int(left * scale_x) + 1)
+    region = coarse[y0:y1, x0:x1][None, None]
+    return F.interpolate(region, size=(tile_size, tile_size), mode="bilinear", align_corners=False)[0, 0].numpy()
+
+
+def _needs_refinement(coarse, top, left, tile_size, height, width):
+    """A tile is refined if the coarse mask inside it (plus one coarse pixel) is neither all wound nor all skin"""
+    scale_y, scale_x = coarse.shape[0] / height, coarse.shape[1] / width
+    y0, y1 = max(int(top * scale_y) - 1, 0), int(np.ceil((top + tile_size) * scale_y)) + 1
+    x0, x1 = max(int(left * scale_x) - 1, 0), int(np.ceil((left + tile_size) * scale_x)) + 1
+    region = coarse[y0:y1, x0:x1] > 0
+    return bool(region.any()) and not bool(region.all())
+
+
+@torch.no_grad()
+def segment_tiled(image, segmentation_model, tile_size=None, overlap=None, batch_size=None,
+                  threshold=None, coarse_to_fine=None, stats=None):
+    """Segment a high-resolution image at full resolution with overlapping tiles
+
+    Tiles are streamed through the model batch_size at a time, one row of
+    tiles after another. Blended logits are only kept for a rolling band
+    of tile_size rows, so working memory grows with the image width and
+    not its area. With coarse_to_fine the wound is first located on a
+    downscaled copy and only tiles on the predicted boundary run at full
+    resolution; the others reuse the upsampled coarse logits.
+
+    Returns a uint8 mask the size of the image. If stats is a dict it is
+    filled with the tile counts.
+    """
+    segmentation_model = resolve_model(segmentation_model)
+    tile_size = tile_size or config.TILE_SIZE
+    overlap = config.TILE_OVERLAP if overlap is None else overlap
+    batch_size = batch_size or config.TILE_BATCH_SIZE
+    threshold = config.MASK_THRESHOLD if threshold is None else threshold
+    coarse_to_fine = config.TILED_COARSE_TO_FINE if coarse_to_fine is None else coarse_to_fine
+    if not 0 <= overlap < tile_size:
+        raise ValueError("overlap must be smaller than tile_size")
+
+    image = load_image(image)
+    pixels = np.asarray(image)
+    height, width = pixels.shape[:2]
+    # Reflect-pad images smaller than one tile so every window is full size
+    pad_h, pad_w = max(tile_size - height, 0), max(tile_size - width, 0)
+    if pad_h or pad_w:
+        pixels = np.pad(pixels, ((0, pad_h), (0, pad_w), (0, 0)), mode="reflect")
+    padded_h, padded_w = pixels.shape[:2]
+
+    coarse = _coarse_logits(pixels, segmentation_model) if coarse_to_fine else None
+    window = blend_window(tile_size, overlap)
+    logit_threshold = float(np.log(threshold / (1.0 - threshold)))
+    mask = np.zeros((padded_h, padded_w), dtype=np.uint8)
+
+    # Rolling accumulators for rows [base, base + tile_size); base is always the current tile row
+    band = tile_size
+    logit_sum = np.zeros((band, padded_w), dtype=np.float32)
+    weight_sum = np.zeros((band, padded_w), dtype=np.float32)
+    base = 0
+    tiles_total = tiles_refined = 0
+
+    rows = tile_origins(padded_h, tile_size, overlap)
+    cols = tile_origins(padded_w, tile_size, overlap)
+    for row_index, top in enumerate(rows):
+        pending = []
+        for left in cols:
+            tiles_total += 1
+            if coarse is None or _needs_refinement(coarse, top, left, tile_size, padded_h, padded_w):
+                pending.append(left)
+            else:
+                logits = _coarse_tile(coarse, top, left, tile_size, padded_h, padded_w)
+                logit_sum[:, left:left + tile_size] += logits * window
+                weight_sum[:, left:left + tile_size] += window
+        for start in range(0, len(pending), batch_size):
+            lefts = pending[start:start + batch_size]
+            batch = _normalize_tiles([pixels[top:top + tile_size, l:l + tile_size] for l in lefts])
+            logits = segmentation_model(batch)[:, 0].cpu().numpy()
+            tiles_refined += len(lefts)
+            for left, tile_logits in zip(lefts, logits):
+                logit_sum[:, left:left + tile_size] += tile_logits * window
+                weight_sum[:, left:left + tile_size] += window
+
+        # Rows above the next tile row won't receive any more contributions
+        done = rows[row_index + 1] if row_index + 1 < len(rows) else padded_h
+        finished = done - base
+        mask[base:done] = logit_sum[:finished] > logit_threshold * weight_sum[:finished]
+        logit_sum[:band - finished] = logit_sum[finished:]
+        weight_sum[:band - finished] = weight_sum[finished:]
+        logit_sum[band - finished:] = 0
+        weight_sum[band - finished:] = 0
+        base = done
+
+    if stats is not None:
+        stats.update({"tiles": tiles_total, "refined_tiles": tiles_refined, "coarse_to_fine": coarse is not None})
+    return mask[:height, :width]
+
+
+@torch.no_grad()
+def run_tiled_inference(image, segmentation_model, classification_model, threshold=None, **tile_options):
+    """Same contract as run_inference, with a full-resolution tiled mask"""
+    image = load_image(image)
+    stats = {}
+    mask = segment_tiled(image, segmentation_model, threshold=threshold, stats=stats, **tile_options)
+    tensor = preprocess_image(image).to(config.DEVICE)
+    probabilities = F.softmax(resolve_model(classification_model)(tensor), dim=1)[0].cpu().numpy()
+    result = summarize_probabilities(probabilities)
+    result["mask"] = mask
+    result["tiling"] = stats
+    return result
+
+
+def dice_score(a, b):
+    """Dice overlap between two binary masks (1.0 when both are empty)"""
+    a, b = np.asarray(a, dtype=bool), np.asarray(b, dtype=bool)
+    total = a.sum() + b.sum()
+    return 1.0 if total == 0 else float(2.0 * np.logical_and(a, b).sum() / total)
+
+
+def compare_fused(images, segmentation_model, classification_model, fused_model=None, repeats=3):
+    """Parity and latency check of the fused path against the two-model path
+
+    Returns mean mask Dice, top-1 agreement, the largest probability
+    difference and the median per-image latency of each path in ms.
+    """
+    fused_model = fused_model or build_fused_model(segmentation_model, classification_model)
+    images = [load_image(image) for image in images]
+    dice, agree, max_diff = [], [], 0.0
+    timings = {"two_model_ms": [], "fused_ms": []}
+    for image in images:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            reference = run_inference(image, segmentation_model, classification_model)
+            timings["two_model_ms"].append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            fused = run_fused_inference(image, fused_model)
+            timings["fused_ms"].append((time.perf_counter() - start) * 1000)
+        dice.append(dice_score(reference["mask"], fused["mask"]))
+        agree.append(reference["class_index"] == fused["class_index"])
+        max_diff = max(max_diff, float(np.abs(reference["probabilities"] - fused["probabilities"]).max()))
+    report = {
+        "images": len(images),
+        "share_backbone": resolve_model(fused_model).share_backbone,
+        "mean_dice": float(np.mean(dice)) if dice else 1.0,
+        "top1_agreement": float(np.mean(agree)) if agree else 1.0,
+        "max_probability_diff": max_diff,
+    }
+    report.update({key: float(np.median(values)) if values else 0.0 for key, values in timings.items()})
+    return report
+
+
+@torch.no_grad()
+def _batched_forward(batch, shapes):
+    """Run both models over a padded batch and return per-item mask logits and probabilities"""
+    registry = get_registry()
+    batch = batch.to(config.DEVICE)
+    if config.FUSED_INFERENCE:
+        logits, class_logits = registry.get("fused")(batch)
+        recorder = None
+    else:
+        logits = registry.get("segmentation")(batch)
+        classification_model = registry.get("classification")
+        with ActivationRecorder(classification_model) as recorder:
+            class_logits = classification_model(batch)
+    probabilities = F.softmax(class_logits, dim=1).cpu().numpy()
+    return [
+        (logits[i:i + 1, :, :h, :w], probabilities[i], recorder.item(i) if recorder else {})
+        for i, (h, w) in enumerate(shapes)
+    ]
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_inference_server():
+    """Return the process-wide micro-batcher shared by every session"""
+    global _server
+    if _server is None:
+        with _server_lock:
+            if _server is None:
+                _server = MicroBatcher(
+                    _batched_forward,
+                    max_batch_size=config.BATCH_MAX_SIZE,
+                    max_latency_ms=config.BATCH_MAX_LATENCY_MS,
+                    max_queue_depth=config.BATCH_QUEUE_DEPTH,
+                    name="safeheal-inference",
+                )
+    return _server
+
+
+def submit_inference(image, threshold=None, timeout=None):
+    """Queue an image on the shared micro-batcher and return a Future of the run_inference result
+
+    Raises backend.batching.QueueFullError if the queue stays full for timeout seconds.
+    """
+    image = load_image(image)
+    timeout = config.BATCH_SUBMIT_TIMEOUT if timeout is None else timeout
+    pending = get_inference_server().submit(preprocess_image(image)[0], timeout=timeout)
+    result = Future()
+
+    def _finish(done):
+        try:
+            logits, probabilities, activations = done.result()
+            output = summarize_probabilities(probabilities)
+            output["mask"] = postprocess_mask(logits, (image.height, image.width), threshold)
+            output["activations"] = activations
+        except Exception as exc:
+            result.set_exception(exc)
+        else:
+            result.set_result(output)
+
+    pending.add_done_callback(_finish)
+    return result
+
+
+def _module_nbytes(model):
+    """Count the bytes held by a module's parameters and buffers"""
+    if hasattr(model, "nbytes"):
+        return model.nbytes
+    if not isinstance(model, nn.Module):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelHandle:
+    """A session's reference to a model owned by the registry
+
+    Handles are cheap to store in st.session_state. The model itself is
+    looked up on every access, so a reload swaps it for every session at
+    once. The reference is released explicitly or when the handle is
+    garbage collected together with its session.
+    """
+
+    def __init__(self, registry, name):
+        self.name = name
+        self._registry = registry
+        self._finalizer = weakref.finalize(self, registry._release, name)
+
+    @property
+    def model(self):
+        if not self._finalizer.alive:
+            raise RuntimeError(f"Handle for '{self.name}' has been released")
+        return self._registry.get(self.name)
+
+    @property
+    def released(self):
+        return not self._finalizer.alive
+
+    def release(self):
+        """Drop this handle's reference to the shared model"""
+        self._finalizer()
+
+    def __call__(self, *args, **kwargs):
+        return self.model(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __repr__(self):
+        state = "released" if self.released else "active"
+        return f"<ModelHandle {self.name} ({state})>"
+
+
+class _Entry:
+    """Registry bookkeeping for one named model"""
+
+    def __init__(self, loader, warmup, depends_on, preload):
+        self.loader = loader
+        self.warmup = warmup
+        self.preload = preload
+        self.depends_on = tuple(depends_on)
+        self.model = None
+        self.refcount = 0
+        self.lock = threading.Lock()
+        self.load_seconds = None
+        self.loaded_at = None
+        self.last_used = None
+
+
+class ModelRegistry:
+    """Process-wide store that loads each model once and shares it across sessions"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(name) whenever a model is unloaded or reloaded"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _notify(self, name):
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback(name)
+
+    def register(self, name, loader, warmup=None, depends_on=(), preload=True):
+        """Register a zero-argument loader (and optional warm-up callable) under name
+
+        A model is rebuilt lazily whenever one of the models it depends_on is
+        unloaded or reloaded, and its memory isn't counted twice. Models with
+        preload=False are skipped by a default warm_up().
+        """
+        with self._lock:
+            if name in self._entries:
+                raise ValueError(f"Model '{name}' is already registered")
+            self._entries[name] = _Entry(loader, warmup, depends_on, preload)
+
+    def _invalidate_dependents(self, name):
+        with self._lock:
+            dependents = [e for e in self._entries.values() if name in e.depends_on]
+        for entry in dependents:
+            with entry.lock:
+                entry.model = None
+                entry.loaded_at = None
+
+    def names(self):
+        with self._lock:
+            return list(self._entries)
+
+    def _entry(self, name):
+        with self._lock:
+            try:
+                return self._entries[name]
+            except KeyError:
+                raise KeyError(f"Unknown model '{name}'") from None
+
+    def _ensure_loaded(self, entry):
+        """Load the model on first use; concurrent callers wait on the same load"""
+        if entry.model is not None:
+            return entry.model
+        with entry.lock:
+            if entry.model is None:
+                start = time.perf_counter()
+                model = entry.loader()
+                entry.load_seconds = time.perf_counter() - start
+                entry.loaded_at = time.time()
+                entry.model = model
+        return entry.model
+
+    def get(self, name):
+        """Return the shared model itself, loading it if needed"""
+        entry = self._entry(name)
+        model = self._ensure_loaded(entry)
+        entry.last_used = time.time()
+        return model
+
+    def _release(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.refcount > 0:
+                entry.refcount -= 1
+
+    def acquire(self, name):
+        """Return a handle to the shared model, loading it lazily on first access"""
+        entry = self._entry(name)
+        with self._lock:
+            entry.refcount += 1
+        return ModelHandle(self, name)
+
+    def warm_up(self, names=None, background=False):
+        """Load models ahead of the first request and run their warm-up callables
+
+        With background=True the work runs on a daemon thread which is returned.
+        """
+        if names is None:
+            with self._lock:
+                names = [name for name, entry in self._entries.items() if entry.preload]
+
+        def _warm():
+            for name in names:
+                entry = self._entry(name)
+                model = self._ensure_loaded(entry)
+                if entry.warmup is not None:
+                    entry.warmup(model)
+
+        if background:
+            thread = threading.Thread(target=_warm, name="safeheal-warmup", daemon=True)
+            thread.start()
+            return thread
+        _warm()
+        return None
+
+    def is_loaded(self, name):
+        return self._entry(name).model is not None
+
+    def unload(self, name=None, force=False):
+        """Free one model (or all of them); refuses while sessions hold handles unless forced"""
+        for model_name in [name] if name else self.names():
+            entry = self._entry(model_name)
+            with entry.lock:
+                if entry.refcount > 0 and not force:
+                    raise RuntimeError(
+                        f"Model '{model_name}' is still referenced by {entry.refcount} handle(s)"
+                    )
+                entry.model = None
+                entry.loaded_at = None
+            self._invalidate_dependents(model_name)
+            self._notify(model_name)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def reload(self, name=None):
+        """Load fresh copies and swap them in; existing handles see the new model"""
+        for model_name in [name] if name else self.names():
+            entry = self._entry(model_name)
+            start = time.perf_counter()
+            model = entry.loader()
+            with entry.lock:
+                entry.model = model
+                entry.load_seconds = time.perf_counter() - start
+                entry.loaded_at = time.time()
+            self._invalidate_dependents(model_name)
+            self._notify(model_name)
+            if entry.warmup is not None:
+                entry.warmup(model)
+
+    def memory_report(self):
+        """Describe every registered model: load state, references and memory footprint"""
+        report = {}
+        with self._lock:
+            entries = dict(self._entries)
+        for name, entry in entries.items():
+            model = entry.model
+            report[name] = {
+                "loaded": model is not None,
+                "refcount": entry.refcount,
+                "parameters": sum(p.numel() for p in model.parameters()) if isinstance(model, nn.Module) else 0,
+                "bytes": 0 if entry.depends_on else _module_nbytes(model),
+                "load_seconds": entry.load_seconds,
+                "loaded_at": entry.loaded_at,
+                "last_used": entry.last_used,
+            }
+        report["total_bytes"] = sum(r["bytes"] for r in report.values())
+        return report
+
+
+@torch.no_grad()
+def _warm_up_model(model):
+    """Run a dummy forward pass so the first real request doesn't pay for lazy init"""
+    model(torch.zeros(1, 3, config.INPUT_SIZE, config.INPUT_SIZE, device=config.DEVICE))
+
+
+def _load_wound_presence_model():
+    from backend.quality import load_wound_presence_model
+    return load_wound_presence_model()
+
+
+def _load_llm():
+    from backend.llm_service import initialize_llm
+    return initialize_llm()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the process-wide model registry, creating it on first use"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = ModelRegistry()
+                registry.register("segmentation", lambda: load_prepared_model("segmentation"), _warm_up_model)
+                registry.register("classification", lambda: load_prepared_model("classification"), _warm_up_model)
+                # Eager FP32 copies, only loaded when a non-eager backend is active and they are needed
+                registry.register("segmentation_reference", load_segmentation_model, preload=False)
+                registry.register("classification_reference", load_classification_model, preload=False)
+                registry.register(
+                    "fused", _load_fused_model, _warm_up_model,
+                    depends_on=("segmentation", "classification", "segmentation_reference", "classification_reference"),
+                    preload=config.FUSED_INFERENCE,
+                )
+                registry.register("llm", _load_llm)
+                # Optional quality-gate classifier, loaded on first use when configured
+                registry.register("wound_presence", _load_wound_presence_model, preload=False)
+                _registry = registry
+    return _registry
@@ -0,0 +1,222 @@
+import contextlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import config
+from backend.telemetry import get_metrics, span
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+SKIPPED = "skipped"
+
+FINAL_STATES = {DONE, FAILED, CANCELLED, TIMED_OUT}
+
+_JOBS = get_metrics().counter("safeheal_jobs_total", "Finished jobs by final status", ("status",))
+_JOB_SECONDS = get_metrics().histogram("safeheal_job_seconds", "Time from job submission to its final state")
+_JOBS_ACTIVE = get_metrics().gauge("safeheal_jobs", "Jobs waiting for or running on a worker", ("status",))
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled or has run past its timeout"""
+
+
+class Job:
+    """State of one background analysis, safe to poll from any thread
+
+    The worker reports progress through stage() and publish(); readers
+    use snapshot() to get a consistent copy of the status, per-stage
+    progress and whatever partial results are available so far.
+    """
+
+    def __init__(self, stages, timeout=None):
+        self.id = uuid.uuid4().hex
+        self.status = PENDING
+        self.stages = {name: PENDING for name in stages}
+        self.results = {}
+        self.events = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timeout = config.JOB_TIMEOUT if timeout is None else timeout
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    def _event(self, kind, **fields):
+        self.events.append({"time": time.time(), "event": kind, **fields})
+
+    @property
+    def deadline(self):
+        return self.created_at + self.timeout if self.timeout else None
+
+    @property
+    def progress(self):
+        """Fraction of stages that have finished or been skipped"""
+        with self._lock:
+            finished = sum(state in (DONE, SKIPPED) for state in self.stages.values())
+            return finished / len(self.stages) if self.stages else 1.0
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def _expire(self):
+        """Mark the job timed out once its deadline has passed"""
+        if self.deadline is not None and time.time() > self.deadline:
+            self._finish(TIMED_OUT, error=f"Timed out after {self.timeout:.0f}s")
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled or its deadline has passed"""
+        self._expire()
+        if self._cancel.is_set():
+            raise JobCancelled(self.status)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Mark a stage as running for the duration of the block"""
+        self.check()
+        with self._lock:
+            self.stages[name] = RUNNING
+            self._event("stage_started", stage=name)
+        started = time.perf_counter()
+        with span(name):
+            yield
+        with self._lock:
+            self.stages[name] = DONE
+            self._event("stage_finished", stage=name, seconds=time.perf_counter() - started)
+
+    def skip(self, name):
+        with self._lock:
+            self.stages[name] = SKIPPED
+            self._event("stage_skipped", stage=name)
+
+    def publish(self, key, value):
+        """Expose a partial result as soon as it is available"""
+        with self._lock:
+            self.results[key] = value
+            self._event("result", key=key)
+
+    def cancel(self):
+        """Ask the job to stop at the next stage boundary"""
+        if self._finish(CANCELLED):
+            self._cancel.set()
+            return True
+        return False
+
+    def _finish(self, status, error=None):
+        with self._lock:
+            if self.status in FINAL_STATES:
+                return False
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+            self._event(status, error=error)
+        self._cancel.set()
+        self._done.set()
+        _JOBS.inc(status=status)
+        _JOB_SECONDS.observe(self.finished_at - self.created_at)
+        return True
+
+    def wait(self, timeout=None):
+        """Block until the job reaches a final state; returns whether it did"""
+        return self._done.wait(timeout)
+
+    def snapshot(self):
+        """Consistent copy of the job state for polling clients"""
+        self._expire()
+        with self._lock:
+            finished = sum(state in (DONE, SKIPPED) for state in self.stages.values())
+            return {
+                "id": self.id,
+                "status": self.status,
+                "progress": finished / len(self.stages) if self.stages else 1.0,
+                "stages": dict(self.stages),
+                "results": dict(self.results),
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """Runs jobs on a bounded worker pool and keeps them addressable by id"""
+
+    def __init__(self, workers=None, retention=None):
+        self._executor = ThreadPoolExecutor(max_workers=workers or config.JOB_WORKERS,
+                                            thread_name_prefix="safeheal-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.retention = config.JOB_RETENTION if retention is None else retention
+        for status in (PENDING, RUNNING):
+            _JOBS_ACTIVE.set_function(lambda status=status: self.count(status), status=status)
+
+    def submit(self, fn, stages, *args, timeout=None, **kwargs):
+        """Start fn(job, *args, **kwargs) in the background and return its Job"""
+        job = Job(stages, timeout)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check()
+            with job._lock:
+                if job.status == PENDING:
+                    job.status = RUNNING
+                    job.started_at = time.time()
+            fn(job, *args, **kwargs)
+        except JobCancelled:
+            pass
+        except Exception as exc:
+            job._finish(FAILED, error=f"{type(exc).__name__}: {exc}")
+        else:
+            job._finish(DONE)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def count(self, status):
+        with self._lock:
+            return sum(job.status == status for job in self._jobs.values())
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        return job.cancel() if job is not None else False
+
+    def _prune(self):
+        """Forget finished jobs older than the retention window"""
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=wait)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide job manager"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager()
+    return _manager
@@ -0,0 +1,363 @@
+import collections
+import json
+import math
+import os
+import threading
+import time
+import urllib.request
+
+from backend.telemetry import get_metrics
+
+# OpenAI-compatible chat completions endpoint; without one the service falls back to templated advice
+LLM_URL = os.environ.get("SAFEHEAL_LLM_URL", "")
+LLM_MODEL = os.environ.get("SAFEHEAL_LLM_MODEL", "gpt-4o-mini")
+LLM_API_KEY = os.environ.get("SAFEHEAL_LLM_API_KEY", "")
+LLM_TIMEOUT = float(os.environ.get("SAFEHEAL_LLM_TIMEOUT", "30"))
+LLM_CACHE_SIZE = int(os.environ.get("SAFEHEAL_LLM_CACHE_SIZE", "512"))
+
+SYSTEM_PROMPT = (
+    "You are a first aid assistant. Given an automated wound assessment, reply with "
+    "a short list of first aid steps (one per line, starting with '- ') followed by a "
+    "line 'Explanation:' and a brief plain-language explanation. Never give a diagnosis."
+)
+
+GENERIC_RECOMMENDATIONS = [
+    "Clean the wound with mild soap and water",
+    "Apply gentle pressure with a clean cloth to stop any bleeding",
+    "Apply antibiotic ointment if available",
+    "Cover with a sterile bandage",
+    "Seek medical attention if the wound is deep or shows signs of infection",
+]
+
+TEMPLATE_RECOMMENDATIONS = {
+    "Burn": [
+        "Cool the burn under cool (not cold) running water for 20 minutes",
+        "Remove jewellery or tight clothing near the burn",
+        "Cover loosely with a sterile, non-stick dressing",
+        "Do not apply ice, butter or ointments to the burn",
+        "Seek medical attention for large, deep or blistering burns",
+    ],
+    "Bruise": [
+        "Apply a cold compress for 15-20 minutes at a time",
+        "Elevate the injured area if possible",
+        "Rest the affected area",
+        "Seek medical attention if swelling or pain gets worse",
+    ],
+    "Pressure Ulcer": [
+        "Relieve pressure on the area by repositioning regularly",
+        "Keep the wound clean and moist with an appropriate dressing",
+        "Check the surrounding skin daily for changes",
+        "Consult a healthcare provider for a wound care plan",
+    ],
+    "Diabetic Ulcer": [
+        "Keep weight off the affected foot",
+        "Clean gently and cover with a sterile dressing",
+        "Monitor blood glucose closely",
+        "See a healthcare provider promptly; diabetic ulcers need professional care",
+    ],
+    "Venous Ulcer": [
+        "Elevate the leg above heart level when resting",
+        "Keep the wound clean and covered",
+        "Ask a healthcare provider about compression therapy",
+        "Seek care if the wound grows or shows signs of infection",
+    ],
+}
+
+
+_LOOKUPS = get_metrics().counter(
+    "safeheal_llm_cache_lookups_total", "LLM reply cache lookups: hit, miss or coalesced into an in-flight reply", ("result",)
+)
+_FIRST_CHUNK_SECONDS = get_metrics().histogram("safeheal_llm_first_chunk_seconds", "Time to the first chunk of a fresh reply")
+_FALLBACKS = get_metrics().counter("safeheal_llm_fallbacks_total", "Replies served from templates instead of the LLM")
+
+
+class _InFlight:
+    """A response being generated; identical concurrent requests subscribe instead of re-asking"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        # Set when the reply is templated advice rather than the LLM's, which is never cached
+        self.fallback = False
+        # Identical requests replaying this reply (counted under WoundLLM._lock)
+        self.followers = 0
+        self.condition = threading.Condition()
+
+    def append(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def subscribe(self):
+        """Yield every chunk from the start, then new ones as they arrive"""
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.chunks) and not self.done:
+                    self.condition.wait()
+                pending = self.chunks[index:]
+                finished, error = self.done, self.error
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class WoundLLM:
+    """Generates first aid recommendations and explanations for an analysis
+
+    Replies are streamed chunk by chunk. Finished replies are cached by
+    the structured inputs of the request (wound class, risk level, binned
+    measurements, analysis depth), and identical requests that arrive
+    while a reply is still being generated share that one generation.
+    """
+
+    def __init__(self, url=None, model=None, api_key=None, timeout=None, cache_size=None):
+        self.url = LLM_URL if url is None else url
+        self.model = model or LLM_MODEL
+        self.api_key = LLM_API_KEY if api_key is None else api_key
+        self.timeout = timeout or LLM_TIMEOUT
+        self.cache_size = LLM_CACHE_SIZE if cache_size is None else cache_size
+        self._cache = collections.OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    @property
+    def available(self):
+        return bool(self.url)
+
+    def _request(self, prompt, stream):
+        payload = {
+            "model": self.model,
+            "stream": stream,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+        }
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(self.url, json.dumps(payload).encode(), headers)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def complete(self, prompt):
+        """Send a prompt to the chat completions endpoint and return the reply text"""
+        with self._request(prompt, stream=False) as response:
+            body = json.load(response)
+        return body["choices"][0]["message"]["content"]
+
+    def stream(self, prompt):
+        """Yield reply text chunks from a server-sent-events chat completion"""
+        with self._request(prompt, stream=True) as response:
+            for raw in response:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                delta = json.loads(data)["choices"][0].get("delta", {})
+                if delta.get("content"):
+                    yield delta["content"]
+
+    def _generate(self, wound_class, risk_level, metrics, depth, reply=None):
+        """Chunks of a fresh reply, falling back to templated advice when the LLM is unreachable
+
+        reply, if given, is flagged with fallback=True when the templated
+        advice is served.
+        """
+        if self.available:
+            emitted = False
+            try:
+                for chunk in self.stream(build_prompt(wound_class, risk_level, metrics, depth)):
+                    emitted = True
+                    yield chunk
+                return
+            except (OSError, ValueError, KeyError):
+                if emitted:
+                    raise
+        _FALLBACKS.inc()
+        if reply is not None:
+            reply.fallback = True
+        for line in template_reply(wound_class, risk_level).splitlines(keepends=True):
+            yield line
+
+    def stream_recommendations(self, wound_class, risk_level, metrics=None, depth="Standard"):
+        """Yield the reply text for an analysis as it is generated
+
+        Cached replies are yielded in one piece. Followers of an identical
+        in-flight request replay the leader's chunks as they arrive; if the
+        leader's consumer stops reading, the reply is finished in the
+        background for them. Templated fallback advice is not cached, so
+        the LLM is asked again once it is reachable.
+        """
+        key = cache_key(wound_class, risk_level, metrics, depth)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                _LOOKUPS.inc(result="hit")
+                cached = self._cache[key]
+            else:
+                cached = None
+                in_flight = self._in_flight.get(key)
+                leader = in_flight is None
+                if leader:
+                    in_flight = self._in_flight[key] = _InFlight()
+                    self.stats["misses"] += 1
+                    _LOOKUPS.inc(result="miss")
+                else:
+                    in_flight.followers += 1
+                    self.stats["coalesced"] += 1
+                    _LOOKUPS.inc(result="coalesced")
+        if cached is not None:
+            yield cached
+            return
+        if not leader:
+            yield from in_flight.subscribe()
+            return
+
+        chunks = self._generate(wound_class, risk_level, metrics, depth, in_flight)
+        start = time.perf_counter()
+        try:
+            for chunk in chunks:
+                if not in_flight.chunks:
+                    _FIRST_CHUNK_SECONDS.observe(time.perf_counter() - start)
+                in_flight.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            # This consumer stopped reading; followers still need the whole reply
+            with self._lock:
+                handoff = in_flight.followers > 0
+                if not handoff:
+                    self._in_flight.pop(key, None)
+            if handoff:
+                threading.Thread(
+                    target=self._drain, args=(key, in_flight, chunks), name="safeheal-llm-reply", daemon=True
+                ).start()
+            else:
+                chunks.close()
+                in_flight.finish(RuntimeError("The reply was abandoned before it finished"))
+            raise
+        except BaseException as exc:
+            error = exc if isinstance(exc, Exception) else RuntimeError("The reply was abandoned before it finished")
+            self._fail(key, in_flight, error)
+            raise
+        self._complete(key, in_flight)
+
+    def _drain(self, key, in_flight, chunks):
+        # Finish a reply its leader abandoned, for the followers replaying it
+        try:
+            for chunk in chunks:
+                in_flight.append(chunk)
+        except Exception as exc:
+            self._fail(key, in_flight, exc)
+            return
+        self._complete(key, in_flight)
+
+    def _fail(self, key, in_flight, error):
+        in_flight.finish(error)
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _complete(self, key, in_flight):
+        text = "".join(in_flight.chunks)
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if not in_flight.fallback:
+                self._cache[key] = text
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        in_flight.finish()
+
+    def generate_recommendations(self, wound_class, risk_level, metrics=None, depth="Standard", on_chunk=None):
+        """Return (recommendations, explanation) for a classified wound
+
+        on_chunk, if given, is called with the accumulated reply text after
+        every streamed chunk.
+        """
+        text = ""
+        for chunk in self.stream_recommendations(wound_class, risk_level, metrics, depth):
+            text += chunk
+            if on_chunk is not None:
+                on_chunk(text)
+        return parse_reply(text)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def _bin(value):
+    """Coarse power-of-two bucket for a measurement so similar wounds share cached advice"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    if value <= 0 or math.isnan(value):
+        return 0
+    return 2.0 ** round(math.log2(value))
+
+
+def cache_key(wound_class, risk_level, metrics=None, depth="Standard"):
+    """Response-cache key built from the structured inputs of a request"""
+    binned = tuple(sorted((k, _bin(v)) for k, v in (metrics or {}).items()))
+    return (wound_class, risk_level, binned, depth)
+
+
+def build_prompt(wound_class, risk_level, metrics=None, depth="Standard"):
+    """Describe the analysis in a prompt for the LLM"""
+    lines = [f"Wound type: {wound_class}", f"Risk level: {risk_level}", f"Detail level: {depth}"]
+    for key, value in (metrics or {}).items():
+        lines.append(f"{key.replace('_', ' ').capitalize()}: {value}")
+    return "\n".join(lines)
+
+
+def parse_reply(reply):
+    """Split an LLM reply into recommendation steps and an explanation"""
+    steps, explanation = [], []
+    in_explanation = False
+    for line in reply.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.lower().startswith("explanation:"):
+            in_explanation = True
+            line = line.split(":", 1)[1].strip()
+        if in_explanation:
+            explanation.append(line)
+        elif line[0] in "-*•" or line[0].isdigit():
+            steps.append(line.lstrip("-*•0123456789.) ").strip())
+    return steps or GENERIC_RECOMMENDATIONS, " ".join(explanation)
+
+
+def template_recommendations(wound_class, risk_level):
+    """Offline fallback advice keyed by wound type"""
+    recommendations = TEMPLATE_RECOMMENDATIONS.get(wound_class, GENERIC_RECOMMENDATIONS)
+    explanation = (
+        f"The image was classified as {wound_class.lower()} with a {risk_level.lower()} risk level. "
+        "These are general first aid steps; a healthcare professional should assess the wound "
+        "if you are unsure or it does not improve."
+    )
+    return list(recommendations), explanation
+
+
+def template_reply(wound_class, risk_level):
+    """Templated advice in the same text format the LLM is asked to produce"""
+    recommendations, explanation = template_recommendations(wound_class, risk_level)
+    return "".join(f"- {step}\n" for step in recommendations) + f"Explanation: {explanation}\n"
+
+
+def initialize_llm():
+    """Create the LLM client used for recommendations"""
+    return WoundLLM()
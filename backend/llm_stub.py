@@ -0,0 +1,125 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend.llm_service import template_reply
+
+# Stand-in for an OpenAI-compatible chat completions server, for offline development
+# and testing of the LLM service. It answers every prompt with the templated advice
+# for the wound type named in the prompt, word by word with a fixed per-token delay.
+#   python -m backend.llm_stub --port 8001
+#   SAFEHEAL_LLM_URL=http://127.0.0.1:8001/v1/chat/completions streamlit run app/main.py
+
+
+def _field(prompt, name, default):
+    for line in prompt.splitlines():
+        if line.lower().startswith(name.lower() + ":"):
+            return line.split(":", 1)[1].strip()
+    return default
+
+
+def reply_for(messages):
+    """Templated reply text for the last user message"""
+    prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    return template_reply(_field(prompt, "Wound type", "Unknown"), _field(prompt, "Risk level", "Moderate"))
+
+
+def tokens(text):
+    """Split text into word-sized chunks that concatenate back to the original"""
+    chunks, start = [], 0
+    for index, char in enumerate(text):
+        if char in " \n":
+            chunks.append(text[start:index + 1])
+            start = index + 1
+    if start < len(text):
+        chunks.append(text[start:])
+    return chunks
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    token_delay = 0.02
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_error(400, "Invalid JSON")
+            return
+        self.server.requests += 1
+        text = reply_for(payload.get("messages", []))
+        model = payload.get("model", "stub")
+        if payload.get("stream"):
+            self._stream(text, model)
+        else:
+            time.sleep(self.token_delay * len(tokens(text)))
+            self._send_json({
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            })
+
+    def _send_json(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, text, model):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for chunk in tokens(text):
+            time.sleep(self.token_delay)
+            event = {
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def start_stub_server(host="127.0.0.1", port=0, token_delay=None):
+    """Serve the stub on a background thread and return (server, chat completions URL)
+
+    port=0 picks a free port. Call server.shutdown() to stop it;
+    server.requests counts the completions it has served.
+    """
+    handler = type("Handler", (StubHandler,), {} if token_delay is None else {"token_delay": token_delay})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, name="safeheal-llm-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.llm_stub", description="Local stand-in LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--token-delay", type=float, default=StubHandler.token_delay, help="seconds per streamed token")
+    args = parser.parse_args(argv)
+    server, url = start_stub_server(args.host, args.port, args.token_delay)
+    print(f"Stub LLM listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+import collections
+import threading
+
+import numpy as np
+from PIL import Image, features
+
+from backend import config
+from backend.images import DecodedImage, resize_mask
+from backend.report_generator import encode_image
+
+# Result images: the mask fill and contour ("overlay") and the Grad-CAM heatmap with the
+# same contour ("gradcam") are composited in one vectorized pass over the pixels, in bands
+# of rows so a full-resolution photo never needs a float copy of the whole image. Each is
+# encoded twice: a display-size WebP (JPEG when Pillow lacks WebP) for the UI and the
+# full-resolution JPEG for reports. Encoded bytes are memoized by result id, so Streamlit
+# reruns, tab switches and exact Grad-CAM requests never re-blend or re-encode an image.
+FILL_COLOR = (229, 62, 62)
+FILL_ALPHA = 0.4
+CONTOUR_COLOR = (197, 48, 48)
+HEAT_ALPHA = 0.5
+# Rows blended per step; bounds the float32 working set to BAND_ROWS x width x 3
+BAND_ROWS = 256
+LAYERS = ("overlay", "gradcam")
+DISPLAY_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+
+
+def contour(mask, width=2):
+    """Boolean map of the mask's boundary pixels, about width pixels thick"""
+    mask = np.asarray(mask).astype(bool)
+    inner = mask.copy()
+    for _ in range(width):
+        # 4-neighbour erosion by shifted ANDs; the image border counts as background
+        eroded = inner.copy()
+        eroded[1:] &= inner[:-1]
+        eroded[:-1] &= inner[1:]
+        eroded[:, 1:] &= inner[:, :-1]
+        eroded[:, :-1] &= inner[:, 1:]
+        eroded[[0, -1]] = False
+        eroded[:, [0, -1]] = False
+        inner = eroded
+    return mask & ~inner
+
+
+def _heat_map(heatmap, size):
+    """A [0, 1] heatmap resized to (width, height) as float32"""
+    heat = Image.fromarray((np.clip(heatmap, 0, 1) * 255).astype(np.uint8)).resize(size, Image.BILINEAR)
+    return np.asarray(heat, dtype=np.float32) / 255.0
+
+
+def composite(pixels, mask=None, heatmap=None, fill=True, edge=True):
+    """Blend the heatmap, the mask fill and the mask contour over RGB pixels in one pass
+
+    pixels is an HxWx3 uint8 array; mask an HxW array at the same size and
+    heatmap a [0, 1] map of any size (resized bilinearly). Layers are
+    stacked heatmap, fill, contour, and each output pixel is computed once
+    as pixels * weight + paint. Returns a new uint8 array.
+    """
+    pixels = np.asarray(pixels)
+    height, width = pixels.shape[:2]
+    selected = None if mask is None else resize_mask(mask, (width, height)).astype(bool)
+    edges = contour(selected) if selected is not None and edge else None
+    heat = None if heatmap is None else _heat_map(heatmap, (width, height))
+    out = np.empty_like(pixels, dtype=np.uint8)
+    fill_color = np.array(FILL_COLOR, dtype=np.float32)
+    for top in range(0, height, BAND_ROWS):
+        rows = slice(top, top + BAND_ROWS)
+        # Weight of the original pixel and the colour painted over it, accumulated layer by layer
+        weight = np.ones(pixels[rows].shape[:2] + (1,), dtype=np.float32)
+        paint = np.zeros(pixels[rows].shape, dtype=np.float32)
+        if heat is not None:
+            alpha = HEAT_ALPHA * heat[rows, :, None]
+            # Red-to-yellow ramp: green rises as the heat falls
+            paint[..., 0] = 255.0 * alpha[..., 0]
+            paint[..., 1] = 255.0 * alpha[..., 0] * (1.0 - heat[rows])
+            weight *= 1.0 - alpha
+        if selected is not None and fill:
+            alpha = FILL_ALPHA * selected[rows, :, None]
+            paint *= 1.0 - alpha
+            paint += alpha * fill_color
+            weight *= 1.0 - alpha
+        if edges is not None:
+            band = edges[rows]
+            paint[band] = CONTOUR_COLOR
+            weight[band] = 0.0
+        np.clip(pixels[rows] * weight + paint, 0, 255, out=paint)
+        out[rows] = paint
+    return out
+
+
+def _pixels(image, max_side=None):
+    """RGB pixels of a DecodedImage or PIL image, reduced to max_side when given"""
+    if isinstance(image, DecodedImage):
+        return np.asarray(image.thumbnail(max_side)) if max_side else image.pixels()
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    return np.asarray(image.convert("RGB"))
+
+
+def render_layer(image, layer, mask, heatmap=None, max_side=None):
+    """One result layer ("overlay" or "gradcam") as a PIL image, at full size or within max_side"""
+    pixels = _pixels(image, max_side)
+    if layer == "overlay":
+        return Image.fromarray(composite(pixels, mask))
+    return Image.fromarray(composite(pixels, mask, heatmap, fill=False))
+
+
+def encode_layer(image, layer, mask, heatmap=None):
+    """Full-resolution JPEG and display-size bytes of one layer"""
+    return {
+        f"{layer}_image": encode_image(render_layer(image, layer, mask, heatmap)),
+        f"{layer}_display": encode_image(
+            render_layer(image, layer, mask, heatmap, config.PREVIEW_SIZE), DISPLAY_FORMAT, config.DISPLAY_IMAGE_QUALITY
+        ),
+    }
+
+
+class OverlayCache:
+    """LRU of encoded overlay bytes keyed by result id, layer and Grad-CAM mode"""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = int(config.OVERLAY_CACHE_MB * 2**20) if max_bytes is None else max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        size = sum(len(data) for data in entry.values())
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= sum(len(data) for data in previous.values())
+            if size > self.max_bytes:
+                return entry
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self._bytes -= sum(len(data) for data in dropped.values())
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_overlay_cache = None
+_overlay_cache_lock = threading.Lock()
+
+
+def get_overlay_cache():
+    """Return the process-wide overlay cache"""
+    global _overlay_cache
+    if _overlay_cache is None:
+        with _overlay_cache_lock:
+            if _overlay_cache is None:
+                _overlay_cache = OverlayCache()
+    return _overlay_cache
+
+
+def render_overlays(image, mask, heatmap=None, result_id=None, gradcam_mode=None):
+    """Encoded overlay and, with a heatmap, Grad-CAM images: {"<layer>_image": ..., "<layer>_display": ...}
+
+    With a result_id each layer is rendered once per process; a new
+    Grad-CAM mode (e.g. exact Grad-CAM replacing Score-CAM) re-renders
+    only the gradcam layer.
+    """
+    cache = get_overlay_cache()
+    images = {}
+    for layer in LAYERS:
+        if layer == "gradcam" and heatmap is None:
+            continue
+        key = (result_id, layer, gradcam_mode if layer == "gradcam" else None)
+        entry = cache.get(key) if result_id is not None else None
+        if entry is None:
+            entry = encode_layer(image, layer, mask, heatmap)
+            if result_id is not None:
+                cache.put(key, entry)
+        images.update(entry)
+    return images
+
+
+def display_image(analysis, layer):
+    """Bytes to show in the UI for a layer: the display variant, or the full image for older results"""
+    for name in (f"{layer}_display", f"{layer}_image"):
+        data = analysis.get(name)
+        if data is not None:
+            return data if isinstance(data, bytes) else np.ascontiguousarray(data, dtype=np.uint8).tobytes()
+    return None
@@ -0,0 +1,320 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from backend import config
+
+SECONDS_PER_DAY = 86400.0
+# Metric columns kept for every visit, read from analysis["metrics"]
+METRIC_COLUMNS = (
+    "coverage", "area", "perimeter", "length", "width", "irregularity",
+    "granulation_fraction", "slough_fraction", "necrotic_fraction",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    result_id TEXT,
+    wound_class TEXT,
+    risk_level TEXT,
+    confidence REAL,
+    unit TEXT,
+    coverage REAL,
+    area REAL,
+    perimeter REAL,
+    length REAL,
+    width REAL,
+    irregularity REAL,
+    granulation_fraction REAL,
+    slough_fraction REAL,
+    necrotic_fraction REAL,
+    mask BLOB,
+    mask_height INTEGER,
+    mask_width INTEGER,
+    UNIQUE (patient_id, result_id)
+);
+CREATE INDEX IF NOT EXISTS visits_by_patient_time ON visits (patient_id, timestamp);
+CREATE TABLE IF NOT EXISTS trends (
+    patient_id TEXT PRIMARY KEY,
+    unit TEXT,
+    visits INTEGER NOT NULL,
+    origin REAL NOT NULL,
+    first_timestamp REAL,
+    first_area REAL,
+    previous_timestamp REAL,
+    previous_area REAL,
+    last_timestamp REAL,
+    last_area REAL,
+    sum_t REAL NOT NULL,
+    sum_a REAL NOT NULL,
+    sum_tt REAL NOT NULL,
+    sum_ta REAL NOT NULL
+);
+"""
+
+
+def pack_mask(mask, max_side=None):
+    """Downscale a mask to at most max_side pixels and bit-pack it into a compressed blob"""
+    max_side = max_side or config.PROGRESS_MASK_SIZE
+    mask = np.asarray(mask).astype(bool)
+    step = max(1, int(np.ceil(max(mask.shape) / max_side)))
+    small = mask[::step, ::step]
+    return zlib.compress(np.packbits(small).tobytes()), small.shape
+
+
+def unpack_mask(blob, shape):
+    bits = np.unpackbits(np.frombuffer(zlib.decompress(blob), dtype=np.uint8), count=shape[0] * shape[1])
+    return bits.reshape(shape).astype(bool)
+
+
+def _visit_metrics(metrics):
+    """Unit-free metric columns from a wound_metrics() dict, plus the length unit"""
+    unit = "mm" if "area_cm2" in metrics else "px"
+    values = {
+        "coverage": metrics.get("coverage"),
+        # Areas are stored in mm² or px² so the trend columns share one scale
+        "area": metrics["area_cm2"] * 100 if unit == "mm" else metrics.get("area_px"),
+        "perimeter": metrics.get(f"perimeter_{unit}"),
+        "length": metrics.get(f"length_{unit}"),
+        "width": metrics.get(f"width_{unit}"),
+        "irregularity": metrics.get("irregularity"),
+    }
+    for column in METRIC_COLUMNS:
+        if column.endswith("_fraction"):
+            values[column] = metrics.get(column)
+    return unit, values
+
+
+def trend_summary(row):
+    """Healing statistics from a trends row: least-squares area slope and percentage change"""
+    if row is None:
+        return None
+    (unit, visits, origin, first_ts, first_area, prev_ts, prev_area,
+     last_ts, last_area, sum_t, sum_a, sum_tt, sum_ta) = row
+    summary = {
+        "unit": unit,
+        "visits": visits,
+        "first_visit": first_ts,
+        "last_visit": last_ts,
+        "first_area": first_area,
+        "last_area": last_area,
+        "area_change": None,
+        "area_slope_per_day": None,
+        "healing_rate_per_week": None,
+        "recent_rate_per_day": None,
+    }
+    if first_area:
+        summary["area_change"] = (last_area - first_area) / first_area
+    denominator = visits * sum_tt - sum_t ** 2
+    if visits >= 2 and denominator > 1e-12:
+        slope = (visits * sum_ta - sum_t * sum_a) / denominator
+        summary["area_slope_per_day"] = slope
+        if first_area:
+            # Share of the initial area closed per week; positive while the wound heals
+            summary["healing_rate_per_week"] = -slope * 7 / first_area
+    if prev_ts is not None and last_ts > prev_ts:
+        summary["recent_rate_per_day"] = (last_area - prev_area) / ((last_ts - prev_ts) / SECONDS_PER_DAY)
+    return summary
+
+
+class ProgressStore:
+    """Per-patient visit history in an embedded SQLite database
+
+    Every visit keeps its compact metrics and a bit-packed, downscaled mask,
+    indexed by (patient, timestamp). Each patient's healing trend is kept as
+    running sums in the trends table and updated in the same transaction as
+    the insert, so reading a trend never rescans the history.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.PROGRESS_DB
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self):
+        # SQLite connections are per thread; Streamlit sessions and jobs run on several
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def add_visit(self, patient_id, analysis, timestamp=None):
+        """Record an analysis as a visit and fold it into the patient's trend
+
+        Returns False if this analysis (same result_id) is already recorded
+        for the patient.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        unit, values = _visit_metrics(analysis.get("metrics") or {})
+        blob, shape = (None, (None, None))
+        if analysis.get("mask") is not None:
+            blob, shape = pack_mask(analysis["mask"])
+        db = self._connect()
+        with db:
+            cursor = db.execute(
+                f"INSERT OR IGNORE INTO visits (patient_id, timestamp, result_id, wound_class, risk_level, confidence, "
+                f"unit, {', '.join(METRIC_COLUMNS)}, mask, mask_height, mask_width) "
+                f"VALUES ({', '.join('?' * (10 + len(METRIC_COLUMNS)))})",
+                (patient_id, timestamp, analysis.get("result_id"), analysis.get("wound_class"),
+                 analysis.get("risk_level"), analysis.get("confidence"), unit,
+                 *(values.get(column) for column in METRIC_COLUMNS), blob, *shape),
+            )
+            if cursor.rowcount == 0:
+                return False
+            if values["area"] is not None:
+                self._update_trend(db, patient_id, timestamp, float(values["area"]), unit)
+        return True
+
+    def _update_trend(self, db, patient_id, timestamp, area, unit):
+        row = db.execute(
+            "SELECT unit, origin, first_timestamp, previous_timestamp, last_timestamp, last_area "
+            "FROM trends WHERE patient_id = ?", (patient_id,)
+        ).fetchone()
+        if row is None:
+            db.execute(
+                "INSERT INTO trends VALUES (?, ?, 1, ?, ?, ?, NULL, NULL, ?, ?, 0, ?, 0, 0)",
+                (patient_id, unit, timestamp, timestamp, area, timestamp, area, area),
+            )
+            return
+        trend_unit, origin, first_ts, prev_ts, last_ts, last_area = row
+        if unit != trend_unit:
+            # Pixel and millimetre areas are not comparable. The first calibrated visit
+            # restarts the trend in mm² from every calibrated visit; later pixel-only
+            # visits stay out of a millimetre trend.
+            if unit == "mm":
+                self._fold_visits(db, patient_id, unit)
+            return
+        # Days relative to the patient's first recorded visit keep the running sums well conditioned
+        t = (timestamp - origin) / SECONDS_PER_DAY
+        updates = {}
+        if timestamp < first_ts:
+            updates.update(first_timestamp=timestamp, first_area=area)
+        if timestamp >= last_ts:
+            updates.update(previous_timestamp=last_ts, previous_area=last_area, last_timestamp=timestamp, last_area=area)
+        elif prev_ts is None or timestamp > prev_ts:
+            updates.update(previous_timestamp=timestamp, previous_area=area)
+        assignments = "".join(f", {column} = ?" for column in updates)
+        db.execute(
+            "UPDATE trends SET visits = visits + 1, sum_t = sum_t + ?, sum_a = sum_a + ?, "
+            f"sum_tt = sum_tt + ?, sum_ta = sum_ta + ?{assignments} WHERE patient_id = ?",
+            (t, area, t * t, t * area, *updates.values(), patient_id),
+        )
+
+    def _fold_visits(self, db, patient_id, unit):
+        # Replace the patient's trend with one built from their visits measured in unit
+        db.execute("DELETE FROM trends WHERE patient_id = ?", (patient_id,))
+        rows = db.execute(
+            "SELECT timestamp, area FROM visits WHERE patient_id = ? AND unit = ? AND area IS NOT NULL ORDER BY id",
+            (patient_id, unit),
+        ).fetchall()
+        for timestamp, area in rows:
+            self._update_trend(db, patient_id, timestamp, area, unit)
+
+    def trend(self, patient_id):
+        """Healing statistics for a patient (see trend_summary), or None without visits"""
+        row = self._connect().execute(
+            "SELECT unit, visits, origin, first_timestamp, first_area, previous_timestamp, previous_area, "
+            "last_timestamp, last_area, sum_t, sum_a, sum_tt, sum_ta FROM trends WHERE patient_id = ?",
+            (patient_id,),
+        ).fetchone()
+        return trend_summary(row)
+
+    def series(self, patient_id, columns=("area",), start=None, end=None, unit=None):
+        """Column arrays of a patient's visits in [start, end), oldest first, for charts
+
+        With a unit ("mm" or "px"), only visits measured in it are included,
+        e.g. the trend's unit so a chart never mixes pixel and millimetre areas.
+        Returns {"timestamp": array, column: array, ...}; missing values are NaN.
+        """
+        unknown = set(columns) - set(METRIC_COLUMNS) - {"confidence"}
+        if unknown:
+            raise ValueError(f"Unknown progress columns: {', '.join(sorted(unknown))}")
+        query = f"SELECT timestamp, {', '.join(columns)} FROM visits WHERE patient_id = ?"
+        params = [patient_id]
+        if unit is not None:
+            query += " AND unit = ?"
+            params.append(unit)
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND timestamp < ?"
+            params.append(end)
+        rows = self._connect().execute(query + " ORDER BY timestamp", params).fetchall()
+        data = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns) + 1)
+        return {name: data[:, i] for i, name in enumerate(("timestamp", *columns))}
+
+    def visits(self, patient_id, start=None, end=None, limit=None):
+        """Visit rows (without masks) in [start, end), newest first"""
+        query = (
+            "SELECT id, timestamp, result_id, wound_class, risk_level, confidence, unit, "
+            f"{', '.join(METRIC_COLUMNS)} FROM visits WHERE patient_id = ?"
+        )
+        params = [patient_id]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND timestamp < ?"
+            params.append(end)
+        query += " ORDER BY timestamp DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor = self._connect().execute(query, params)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def mask(self, visit_id):
+        """The stored (downscaled) mask of a visit"""
+        row = self._connect().execute(
+            "SELECT mask, mask_height, mask_width FROM visits WHERE id = ?", (visit_id,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return unpack_mask(row[0], (row[1], row[2]))
+
+    def patients(self):
+        """Healing statistics of every patient, keyed by patient id"""
+        rows = self._connect().execute(
+            "SELECT patient_id, unit, visits, origin, first_timestamp, first_area, previous_timestamp, "
+            "previous_area, last_timestamp, last_area, sum_t, sum_a, sum_tt, sum_ta FROM trends"
+        ).fetchall()
+        return {row[0]: trend_summary(row[1:]) for row in rows}
+
+    def rebuild_trends(self):
+        """Recompute every trend from the visit history, e.g. after editing visits by hand"""
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM trends")
+            # In millimetres for every patient with a calibrated visit, as add_visit() keeps them
+            rows = db.execute(
+                "SELECT patient_id, MAX(unit = 'mm') FROM visits WHERE area IS NOT NULL GROUP BY patient_id"
+            ).fetchall()
+            for patient_id, calibrated in rows:
+                self._fold_visits(db, patient_id, "mm" if calibrated else "px")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_progress_store():
+    """Return the process-wide progress store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ProgressStore()
+    return _store
@@ -0,0 +1,221 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from backend import config
+from backend.images import DecodedImage
+from backend.telemetry import get_metrics
+
+# Pre-inference quality gate for uploads and camera captures. Blur (Laplacian variance),
+# exposure, glare (bright, unsaturated pixels) and skin presence (YCrCb skin-tone range)
+# are scored on a QUALITY_THUMBNAIL-sized copy in a few milliseconds. Each check has a
+# warn and a reject threshold; with SAFEHEAL_QUALITY_CLASSIFIER_WEIGHTS set, a tiny
+# wound-present classifier confirms images that pass. SAFEHEAL_QUALITY_GATE is "reject"
+# (default), "warn" (never block an analysis) or "off".
+QUALITY_THUMBNAIL = 256
+OK = "ok"
+WARN = "warn"
+REJECT = "reject"
+_SEVERITY = {OK: 0, WARN: 1, REJECT: 2}
+
+# (issue, score, fails when "below"/"above", warn threshold, reject threshold, advice)
+CHECKS = (
+    ("blurry", "sharpness", "below", 60.0, 15.0, "The photo is blurry. Hold the camera steady and tap the wound to focus."),
+    ("dark", "brightness", "below", 0.25, 0.10, "The photo is too dark. Add light or move somewhere brighter."),
+    ("overexposed", "brightness", "above", 0.85, 0.95, "The photo is overexposed. Avoid pointing a lamp straight at the wound."),
+    ("glare", "glare", "above", 0.05, 0.25, "There is strong glare. Turn off the flash or tilt the camera slightly."),
+    ("no_skin", "skin", "below", 0.10, 0.02, "No skin is visible. Frame the wound together with the skin around it."),
+)
+# Confirmation by the wound-present classifier only ever warns
+NO_WOUND_ADVICE = "No wound was recognised. Move closer so the wound fills most of the frame."
+# Glare: near-white pixels with little colour (specular reflections off moist tissue or dressings)
+GLARE_MIN_VALUE = 240
+GLARE_MAX_SATURATION = 40
+# Skin tones in YCrCb (Chai and Ngan), widened on Cr to include reddened and wounded skin
+SKIN_CR = (133, 180)
+SKIN_CB = (77, 127)
+
+_VERDICTS = get_metrics().counter("safeheal_quality_verdicts_total", "Quality gate verdicts", ("verdict",))
+_ISSUES = get_metrics().counter("safeheal_quality_issues_total", "Quality gate findings by issue", ("issue", "verdict"))
+_CLASSIFIER_ERRORS = get_metrics().counter(
+    "safeheal_quality_classifier_errors_total", "Wound-present confirmations skipped because the classifier raised", ("error",)
+)
+# (path, mtime) of checkpoints that failed to load, so every upload doesn't retry them; a new file is tried again
+_broken_weights = set()
+
+
+def thumbnail_pixels(image, size=QUALITY_THUMBNAIL):
+    """RGB pixels no larger than size, from a DecodedImage, a PIL image or an RGB array"""
+    if isinstance(image, DecodedImage):
+        # Decoded straight to a reduced size
+        return np.asarray(image.thumbnail(size))
+    pixels = np.asarray(image.convert("RGB")) if hasattr(image, "convert") else np.asarray(image)
+    height, width = pixels.shape[:2]
+    scale = size / max(height, width)
+    if scale < 1:
+        pixels = cv2.resize(pixels, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return pixels
+
+
+def frame_quality(pixels):
+    """Score sharpness (Laplacian variance) and exposure on a thumbnail; higher is better"""
+    gray = cv2.cvtColor(thumbnail_pixels(pixels), cv2.COLOR_RGB2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    brightness = float(gray.mean()) / 255.0
+    clipped = float(np.count_nonzero((gray < 5) | (gray > 250))) / gray.size
+    exposure = max(0.0, 1.0 - abs(brightness - 0.5) * 2.0) * (1.0 - clipped)
+    return {
+        "sharpness": sharpness,
+        "brightness": brightness,
+        "clipped": clipped,
+        "score": float(np.log1p(sharpness) * exposure),
+    }
+
+
+def image_scores(pixels):
+    """frame_quality plus the glare and skin-tone fractions of a thumbnail"""
+    pixels = thumbnail_pixels(pixels)
+    scores = frame_quality(pixels)
+    hsv = cv2.cvtColor(pixels, cv2.COLOR_RGB2HSV)
+    glare = (hsv[..., 2] >= GLARE_MIN_VALUE) & (hsv[..., 1] <= GLARE_MAX_SATURATION)
+    ycrcb = cv2.cvtColor(pixels, cv2.COLOR_RGB2YCrCb)
+    cr, cb = ycrcb[..., 1], ycrcb[..., 2]
+    skin = (cr >= SKIN_CR[0]) & (cr <= SKIN_CR[1]) & (cb >= SKIN_CB[0]) & (cb <= SKIN_CB[1])
+    scores["glare"] = float(np.count_nonzero(glare)) / glare.size
+    scores["skin"] = float(np.count_nonzero(skin)) / skin.size
+    return scores
+
+
+class ImageRejected(ValueError):
+    """Raised when the quality gate rejects an image; report holds the findings"""
+
+    def __init__(self, report):
+        super().__init__("; ".join(report.messages))
+        self.report = report
+
+
+class QualityReport:
+    """Scores of one image and the issues found, worst first"""
+
+    def __init__(self, scores, issues, seconds):
+        self.scores = scores
+        # (issue, verdict, advice) tuples
+        self.issues = sorted(issues, key=lambda issue: -_SEVERITY[issue[1]])
+        self.seconds = seconds
+
+    @property
+    def verdict(self):
+        return self.issues[0][1] if self.issues else OK
+
+    @property
+    def rejected(self):
+        return self.verdict == REJECT
+
+    @property
+    def messages(self):
+        return [advice for _, _, advice in self.issues]
+
+    def to_dict(self):
+        return {
+            "verdict": self.verdict,
+            "issues": [{"issue": issue, "verdict": verdict, "advice": advice} for issue, verdict, advice in self.issues],
+            "scores": self.scores,
+            "seconds": self.seconds,
+        }
+
+    def __repr__(self):
+        return f"<QualityReport {self.verdict} {[issue for issue, _, _ in self.issues]}>"
+
+
+def _check(value, direction, warn, reject):
+    worse = (lambda a, b: a < b) if direction == "below" else (lambda a, b: a > b)
+    if worse(value, reject):
+        return REJECT
+    if worse(value, warn):
+        return WARN
+    return OK
+
+
+def load_wound_presence_model(weights=None):
+    """The optional two-class (no wound, wound) classifier confirming that a wound is in view"""
+    import timm
+    import torch
+
+    model = timm.create_model(config.QUALITY_CLASSIFIER_BACKBONE, pretrained=False, num_classes=2)
+    model.load_state_dict(torch.load(weights or config.QUALITY_CLASSIFIER_WEIGHTS, map_location="cpu"))
+    return model.to(config.DEVICE).eval()
+
+
+def classifier_available():
+    """Whether the wound-present classifier is configured and the models have finished loading"""
+    from backend.startup import get_startup
+
+    weights = config.QUALITY_CLASSIFIER_WEIGHTS
+    if not weights or not os.path.exists(weights) or not get_startup().ready:
+        return False
+    return _weights_id(weights) not in _broken_weights
+
+
+def _weights_id(weights):
+    try:
+        return weights, os.path.getmtime(weights)
+    except OSError:
+        return weights, None
+
+
+def wound_probability(pixels, model=None):
+    """Probability that a wound is in view, from the wound-present classifier"""
+    import torch
+
+    from backend.inference import get_registry, preprocess_image
+
+    model = model or get_registry().get("wound_presence")
+    tensor = preprocess_image(thumbnail_pixels(pixels), config.QUALITY_CLASSIFIER_SIZE).to(config.DEVICE)
+    with torch.no_grad():
+        return float(torch.softmax(model(tensor), dim=1)[0, 1])
+
+
+def _confirm_wound(pixels, classifier=None):
+    # The confirmation is advisory: a bad checkpoint must never fail the upload it was meant to check
+    try:
+        return wound_probability(pixels, classifier)
+    except Exception as exc:
+        _CLASSIFIER_ERRORS.inc(error=type(exc).__name__)
+        if classifier is None and config.QUALITY_CLASSIFIER_WEIGHTS:
+            _broken_weights.add(_weights_id(config.QUALITY_CLASSIFIER_WEIGHTS))
+        return None
+
+
+def assess_quality(image, classifier=None, mode=None):
+    """Run the quality gate on an image (DecodedImage, PIL image or RGB array)
+
+    classifier overrides the registry's wound-present classifier; with
+    neither configured that confirmation is skipped, and so it is (counted
+    in safeheal_quality_classifier_errors_total) when the classifier
+    fails to load or run. In "warn" mode rejections are downgraded to
+    warnings.
+    """
+    mode = mode or config.QUALITY_GATE
+    start = time.perf_counter()
+    pixels = thumbnail_pixels(image)
+    scores = image_scores(pixels)
+    issues = []
+    for issue, score, direction, warn, reject, advice in CHECKS:
+        verdict = _check(scores[score], direction, warn, reject)
+        if verdict != OK:
+            issues.append((issue, verdict, advice))
+    if not any(verdict == REJECT for _, verdict, _ in issues) and (classifier is not None or classifier_available()):
+        probability = _confirm_wound(pixels, classifier)
+        if probability is not None:
+            scores["wound_probability"] = probability
+            if probability < config.QUALITY_WOUND_THRESHOLD:
+                issues.append(("no_wound", WARN, NO_WOUND_ADVICE))
+    if mode == "warn":
+        issues = [(issue, WARN, advice) for issue, _, advice in issues]
+    report = QualityReport(scores, issues, time.perf_counter() - start)
+    _VERDICTS.inc(verdict=report.verdict)
+    for issue, verdict, _ in report.issues:
+        _ISSUES.inc(issue=issue, verdict=verdict)
+    return report
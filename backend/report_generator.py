@@ -0,0 +1,227 @@
+import argparse
+import base64
+import datetime
+import html
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from string import Template
+
+import numpy as np
+
+from backend import config
+
+# Templates are compiled once at import; a report is their substitutions written out in
+# order with the already-encoded images base64-streamed in between, so no report is
+# ever held in memory as a whole.
+_HEADER = Template("""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>SafeHeal Wound Report</title></head>
+<body style="font-family: sans-serif; color: #2d3748;">
+<h1 style="color: #1a365d;">SafeHeal Wound Analysis Report</h1>
+<p>Generated $created</p>
+<h2>Summary</h2>
+<p><strong>Wound Type:</strong> $wound_class</p>
+<p><strong>Risk Level:</strong> $risk_level</p>
+<p><strong>Confidence:</strong> $confidence</p>
+$metrics<h2>Recommendations</h2>
+<ol>$recommendations</ol>
+<h2>AI Assessment</h2>
+<p>$explanation</p>
+""")
+_METRIC = Template("<p><strong>$name:</strong> $value</p>\n")
+_IMAGE_OPEN = Template('<figure style="margin: 1rem 0;"><img style="max-width: 100%;" alt="$caption" src="data:$mime;base64,')
+_IMAGE_CLOSE = Template('"/><figcaption>$caption</figcaption></figure>\n')
+_FOOTER = """<p style="font-size: 0.8rem;">SafeHeal is not a substitute for professional medical advice, diagnosis, or treatment.</p>
+</body>
+</html>
+"""
+
+# Embedded images in report order: analysis/images key and caption
+REPORT_IMAGES = (("overlay", "Wound Segmentation"), ("gradcam", "Grad-CAM Attention Map"))
+# Fields a report reads; everything else (masks, activations) stays out of worker processes
+REPORT_FIELDS = ("wound_class", "risk_level", "confidence", "recommendations", "explanation", "metrics")
+# Multiple of 3 so every chunk base64-encodes without padding
+_BASE64_CHUNK = 3 * 2**16
+_MIME_SIGNATURES = ((b"\xff\xd8", "image/jpeg"), (b"\x89PNG", "image/png"), (b"RIFF", "image/webp"))
+
+
+def encode_image(image, format="JPEG", quality=None):
+    """Encode a PIL image once so the same bytes can be displayed and embedded in reports"""
+    buffer = io.BytesIO()
+    if format == "JPEG":
+        image.convert("RGB").save(buffer, format, quality=quality or config.REPORT_IMAGE_QUALITY, optimize=True)
+    elif format == "WEBP":
+        image.save(buffer, format, quality=quality or config.REPORT_IMAGE_QUALITY)
+    else:
+        image.save(buffer, format)
+    return buffer.getvalue()
+
+
+def _image_bytes(data):
+    """Encoded image bytes from bytes or a uint8 array (how the result cache stores them)"""
+    if isinstance(data, np.ndarray):
+        return memoryview(np.ascontiguousarray(data, dtype=np.uint8)).cast("B")
+    return memoryview(data)
+
+
+def mime_type(data):
+    """MIME type of encoded image bytes, from their signature"""
+    for signature, mime in _MIME_SIGNATURES:
+        if bytes(data[:len(signature)]) == signature:
+            return mime
+    return "application/octet-stream"
+
+
+def _format_metric(name, value):
+    if isinstance(value, float) and (name == "coverage" or name.endswith("_fraction")):
+        return f"{value:.1%}"
+    if isinstance(value, float):
+        return f"{value:.4g}" if name == "mm_per_pixel" else f"{value:.1f}"
+    return str(value)
+
+
+def report_fields(analysis):
+    """The part of an analysis a report needs, cheap to pickle to a worker process"""
+    fields = {key: analysis[key] for key in REPORT_FIELDS if key in analysis}
+    for key, _ in REPORT_IMAGES:
+        image = analysis.get(f"{key}_image")
+        if image is not None:
+            fields[f"{key}_image"] = bytes(_image_bytes(image))
+    return fields
+
+
+def iter_report(analysis, images=None):
+    """Yield the HTML report for an analysis as UTF-8 byte chunks
+
+    images maps REPORT_IMAGES keys to encoded JPEG/PNG/WebP bytes; by
+    default they are taken from the analysis' '<key>_image' entries.
+    Images are base64-encoded chunk by chunk as they are written.
+    """
+    metrics = analysis.get("metrics") or {}
+    yield _HEADER.substitute(
+        created=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+        wound_class=html.escape(str(analysis.get("wound_class", ""))),
+        risk_level=html.escape(str(analysis.get("risk_level", ""))),
+        confidence=f"{analysis.get('confidence', 0):.0%}",
+        metrics="".join(
+            _METRIC.substitute(name=html.escape(name.replace("_", " ").capitalize()), value=html.escape(_format_metric(name, value)))
+            for name, value in metrics.items()
+        ),
+        recommendations="".join(f"<li>{html.escape(r)}</li>" for r in analysis.get("recommendations", [])),
+        explanation=html.escape(analysis.get("explanation", "")),
+    ).encode()
+
+    images = images if images is not None else {key: analysis.get(f"{key}_image") for key, _ in REPORT_IMAGES}
+    for key, caption in REPORT_IMAGES:
+        if images.get(key) is None:
+            continue
+        data = _image_bytes(images[key])
+        yield _IMAGE_OPEN.substitute(caption=caption, mime=mime_type(data)).encode()
+        for start in range(0, len(data), _BASE64_CHUNK):
+            yield base64.b64encode(data[start:start + _BASE64_CHUNK])
+        yield _IMAGE_CLOSE.substitute(caption=caption).encode()
+    yield _FOOTER.encode()
+
+
+def generate_report(analysis, images=None):
+    """Render an analysis dict as a standalone HTML report string"""
+    return b"".join(iter_report(analysis, images)).decode()
+
+
+def write_report(analysis, path, images=None):
+    """Stream a report to path atomically and return the path"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        for chunk in iter_report(analysis, images):
+            f.write(chunk)
+    os.replace(temp_path, path)
+    return path
+
+
+def _write_named(item):
+    path, analysis = item
+    return write_report(analysis, path)
+
+
+def export_reports(analyses, output_dir=None, workers=None, chunksize=8):
+    """Write many reports in parallel worker processes
+
+    analyses is an iterable of (name, analysis) pairs; each report is
+    written to '<output_dir>/<name>.html'. Only report_fields() of each
+    analysis is sent to the workers. Returns the written paths in order.
+    """
+    output_dir = output_dir or config.REPORTS_DIR
+    items = [(os.path.join(output_dir, f"{name}.html"), report_fields(analysis)) for name, analysis in analyses]
+    workers = workers or config.REPORT_WORKERS
+    if workers <= 1 or len(items) <= chunksize:
+        return [_write_named(item) for item in items]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_write_named, items, chunksize=chunksize))
+
+
+def synthetic_analysis(seed=0, image_size=512):
+    """A plausible analysis with encoded overlay and Grad-CAM images, for benchmarking"""
+    from PIL import Image
+
+    from backend.llm_service import TEMPLATE_RECOMMENDATIONS, template_recommendations
+
+    rng = np.random.default_rng(seed)
+    wound_class = list(TEMPLATE_RECOMMENDATIONS)[seed % len(TEMPLATE_RECOMMENDATIONS)]
+    recommendations, explanation = template_recommendations(wound_class, "Medium")
+    gradient = np.linspace(0, 255, image_size, dtype=np.float32)
+    base = np.stack([np.add.outer(gradient, gradient) / 2] * 3, axis=-1)
+    images = {}
+    for key, _ in REPORT_IMAGES:
+        pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+        images[f"{key}_image"] = encode_image(Image.fromarray(pixels))
+    return {
+        "wound_class": wound_class,
+        "risk_level": "Medium",
+        "confidence": float(rng.uniform(0.6, 0.99)),
+        "recommendations": recommendations,
+        "explanation": explanation,
+        "metrics": {"coverage": float(rng.uniform(0.01, 0.4))},
+        **images,
+    }
+
+
+def benchmark(count=200, workers=None, image_size=512):
+    """Reports/s and MB/s of export_reports on synthetic analyses, serial and parallel"""
+    workers = workers or config.REPORT_WORKERS
+    samples = [synthetic_analysis(seed, image_size) for seed in range(8)]
+    analyses = [(f"patient-{i:05d}", samples[i % len(samples)]) for i in range(count)]
+    results = {"reports": count, "image_size": image_size}
+    for label, worker_count in (("serial", 1), ("parallel", workers)):
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            paths = export_reports(analyses, directory, workers=worker_count)
+            seconds = time.perf_counter() - start
+            size = sum(os.path.getsize(path) for path in paths)
+        results[label] = {
+            "workers": worker_count,
+            "seconds": seconds,
+            "reports_per_s": count / seconds,
+            "mb_per_s": size / 2**20 / seconds,
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.report_generator", description="SafeHeal reports")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("benchmark", help="batch report export throughput")
+    bench.add_argument("--count", type=int, default=200)
+    bench.add_argument("--workers", type=int, default=config.REPORT_WORKERS)
+    bench.add_argument("--image-size", type=int, default=512)
+    args = parser.parse_args(argv)
+    print(json.dumps(benchmark(args.count, args.workers, args.image_size), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
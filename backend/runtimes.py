@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from backend import config
+
+# Every backend turns an eager FP32 model into something called like the original
+# (tensor in, tensor or tuple of tensors out):
+#   eager         plain PyTorch
+#   torchscript   traced and frozen TorchScript
+#   compile       torch.compile
+#   int8_dynamic  dynamic INT8 quantization of the Linear layers
+#   int8_static   FX graph-mode static INT8 quantization, calibrated on images
+#   onnx          exported ONNX graph run by ONNX Runtime
+# Exported artifacts live in models/compiled/ and are rebuilt when the checkpoint is newer.
+BACKENDS = ("eager", "torchscript", "compile", "int8_dynamic", "int8_static", "onnx")
+EXPORTED_BACKENDS = ("torchscript", "int8_static", "onnx")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Checkpoints each artifact is derived from, to decide when it is stale
+_SOURCES = {
+    "segmentation": lambda: [config.SEGMENTATION_WEIGHTS],
+    "classification": lambda: [config.CLASSIFICATION_WEIGHTS],
+    "fused": lambda: [config.SEGMENTATION_WEIGHTS, config.CLASSIFICATION_WEIGHTS],
+}
+
+
+class OnnxModel:
+    """Callable wrapper around an ONNX Runtime session with a torch-tensor interface"""
+
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = config.ONNX_THREADS if threads is None else threads
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @property
+    def nbytes(self):
+        return os.path.getsize(self.path)
+
+    def __call__(self, x):
+        outputs = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})
+        tensors = tuple(torch.from_numpy(output) for output in outputs)
+        return tensors[0] if len(tensors) == 1 else tensors
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+def artifact_path(name, backend):
+    extension = "onnx" if backend == "onnx" else "ts.pt"
+    return os.path.join(config.COMPILED_MODEL_DIR, f"{name}-{backend}.{extension}")
+
+
+def _is_fresh(path, name):
+    """True if the artifact exists and is newer than the checkpoints it came from"""
+    if not os.path.exists(path):
+        return False
+    sources = [p for p in _SOURCES.get(name, list)() if os.path.exists(p)]
+    return all(os.path.getmtime(path) >= os.path.getmtime(p) for p in sources)
+
+
+def example_input(batch_size=1, size=None):
+    size = size or config.INPUT_SIZE
+    return torch.zeros(batch_size, 3, size, size, device=config.DEVICE)
+
+
+def list_images(directory):
+    """Sorted image paths in a directory, so calibration and parity sets are reproducible"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def calibration_batches(images, batch_size=8):
+    """Yield preprocessed batches from a list of image paths"""
+    from backend.inference import preprocess_image
+
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        yield torch.cat([preprocess_image(path) for path in chunk]).to(config.DEVICE)
+
+
+@torch.no_grad()
+def export_torchscript(model, path):
+    traced = torch.jit.freeze(torch.jit.trace(model.eval(), example_input(), strict=False))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.jit.save(traced, path)
+    return traced
+
+
+@torch.no_grad()
+def export_onnx(model, path, opset=17):
+    example = example_input()
+    outputs = model.eval()(example)
+    output_count = len(outputs) if isinstance(outputs, tuple) else 1
+    output_names = [f"output_{i}" for i in range(output_count)]
+    dynamic_axes = {"input": {0: "batch", 2: "height", 3: "width"}}
+    dynamic_axes.update({name: {0: "batch"} for name in output_names})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.onnx.export(
+        model, example, path, opset_version=opset,
+        input_names=["input"], output_names=output_names, dynamic_axes=dynamic_axes,
+    )
+    return path
+
+
+def quantize_dynamic(model):
+    """INT8 weights with dynamically quantized activations for every Linear layer"""
+    return torch.ao.quantization.quantize_dynamic(model.eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static(model, images, path=None):
+    """FX graph-mode static INT8 quantization calibrated on a fixed image set"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    if not images:
+        raise ValueError(f"Static quantization needs calibration images in {config.CALIBRATION_DIR}")
+    prepared = prepare_fx(model.eval(), get_default_qconfig_mapping("x86"), (example_input(),))
+    for batch in calibration_batches(images):
+        prepared(batch)
+    quantized = convert_fx(prepared)
+    if path is not None:
+        export_torchscript(quantized, path)
+    return quantized
+
+
+def prepare_model(model, name, backend=None, calibration_images=None):
+    """Convert an eager model for the configured execution backend
+
+    Exported artifacts (TorchScript, static INT8, ONNX) are reused from
+    models/compiled/ when they are newer than the source checkpoint.
+    """
+    backend = backend or config.EXECUTION_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown execution backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    if backend == "eager":
+        return model
+    if backend == "compile":
+        return torch.compile(model)
+    if backend == "int8_dynamic":
+        return quantize_dynamic(model)
+
+    path = artifact_path(name, backend)
+    if backend == "onnx":
+        if not _is_fresh(path, name):
+            export_onnx(model, path)
+        return OnnxModel(path)
+    if _is_fresh(path, name):
+        return torch.jit.load(path, map_location=config.DEVICE).eval()
+    if backend == "torchscript":
+        return export_torchscript(model, path)
+    images = list_images(config.CALIBRATION_DIR) if calibration_images is None else calibration_images
+    return quantize_static(model, images, path)
+
+
+def export(backend, names=("segmentation", "classification"), calibration_dir=None):
+    """Build (or rebuild) the artifacts for an exported backend and return their paths"""
+    if backend not in EXPORTED_BACKENDS:
+        raise ValueError(f"'{backend}' has no exported artifacts")
+    from backend.inference import load_classification_model, load_segmentation_model
+
+    loaders = {"segmentation": load_segmentation_model, "classification": load_classification_model}
+    images = list_images(calibration_dir or config.CALIBRATION_DIR)
+    paths = {}
+    for name in names:
+        path = artifact_path(name, backend)
+        if os.path.exists(path):
+            os.remove(path)
+        prepare_model(loaders[name](), name, backend, calibration_images=images)
+        paths[name] = path
+    return paths
+
+
+@torch.no_grad()
+def check_parity(backend, image_dir=None, threshold=None):
+    """Compare a backend against the eager FP32 reference on a fixed image set
+
+    Returns mean/min mask Dice for segmentation, top-1 agreement for
+    classification and the mean per-image latency of both paths in ms.
+    """
+    from backend.inference import (
+        dice_score,
+        load_classification_model,
+        load_segmentation_model,
+        preprocess_image,
+    )
+
+    images = list_images(image_dir or config.CALIBRATION_DIR)
+    if not images:
+        raise ValueError(f"No parity images found in {image_dir or config.CALIBRATION_DIR}")
+    threshold = config.MASK_THRESHOLD if threshold is None else threshold
+    reference = {"segmentation": load_segmentation_model(), "classification": load_classification_model()}
+    candidate = {
+        name: prepare_model(load(), name, backend, calibration_images=images)
+        for name, load in (("segmentation", load_segmentation_model), ("classification", load_classification_model))
+    }
+
+    dice, agree = [], []
+    timings = {"reference_ms": [], "backend_ms": []}
+    for path in images:
+        tensor = preprocess_image(path).to(config.DEVICE)
+        outputs = {}
+        for label, models in (("reference_ms", reference), ("backend_ms", candidate)):
+            start = time.perf_counter()
+            mask = torch.sigmoid(models["segmentation"](tensor))[0, 0] > threshold
+            top1 = int(models["classification"](tensor).argmax(dim=1))
+            timings[label].append((time.perf_counter() - start) * 1000)
+            outputs[label] = (mask.cpu().numpy(), top1)
+        dice.append(dice_score(outputs["reference_ms"][0], outputs["backend_ms"][0]))
+        agree.append(outputs["reference_ms"][1] == outputs["backend_ms"][1])
+
+    return {
+        "backend": backend,
+        "images": len(images),
+        "mean_dice": float(np.mean(dice)),
+        "min_dice": float(np.min(dice)),
+        "top1_agreement": float(np.mean(agree)),
+        "reference_ms": float(np.mean(timings["reference_ms"])),
+        "backend_ms": float(np.mean(timings["backend_ms"])),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.runtimes", description="SafeHeal execution backends")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="calibrate/export model artifacts for a backend")
+    export_parser.add_argument("backend", choices=EXPORTED_BACKENDS)
+    export_parser.add_argument("--calibration-dir", default=config.CALIBRATION_DIR)
+
+    parity_parser = commands.add_parser("parity", help="Dice and top-1 agreement against the FP32 reference")
+    parity_parser.add_argument("backend", choices=BACKENDS)
+    parity_parser.add_argument("--images", default=config.CALIBRATION_DIR)
+    parity_parser.add_argument("--min-dice", type=float, default=0.95)
+    parity_parser.add_argument("--min-agreement", type=float, default=0.98)
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        print(json.dumps(export(args.backend, calibration_dir=args.calibration_dir), indent=2))
+        return 0
+    report = check_parity(args.backend, args.images)
+    print(json.dumps(report, indent=2))
+    passed = report["mean_dice"] >= args.min_dice and report["top1_agreement"] >= args.min_agreement
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,542 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from backend import config
+from backend.telemetry import get_metrics
+
+# Similar past cases, by the classification model's penultimate (pre-logits) embedding.
+# Every finished analysis adds one case to an index under data/results/similar/, one per
+# embedding version (classifier checkpoint, backbone and embedding layer) since embeddings
+# of different classifiers are not comparable; settings that only change the mask, such
+# as the threshold or tiling, share an index:
+#   <version>.db       SQLite: case id, result id, image hash and the labels the panel shows
+#   <version>.f32      L2-normalized float32 embeddings, case id - 1 as the row, memory-mapped
+#   <version>.ivf.npz  IVF centroids and the list of each row they were trained on
+# An insert writes its row inside the SQLite transaction that assigns the case id, so
+# several processes can add cases to one index. Up to SIMILAR_EXACT_MAX cases a search
+# scores every row by cosine similarity, in NumPy blocks of SIMILAR_SEARCH_BATCH rows.
+# Above it an inverted-file (IVF) index of ~sqrt(N) k-means lists is trained in the
+# background, and a query scores only the rows of its SIMILAR_NPROBE nearest lists (so the
+# ranking within them is exact). Later cases join their nearest list as they are seen, and
+# the lists are retrained once the number of cases has doubled.
+#   python -m backend.similar stats
+#   python -m backend.similar build                      train the IVF index now
+#   python -m backend.similar benchmark --cases 100000   latency and recall on synthetic cases
+EXACT = "exact"
+IVF = "ivf"
+# Rows sampled per list to train the IVF centroids
+IVF_TRAIN_SAMPLES = 64
+IVF_ITERATIONS = 10
+# Columns returned for each similar case
+CASE_COLUMNS = ("id", "result_id", "sha256", "timestamp", "wound_class", "risk_level", "confidence", "depth")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER PRIMARY KEY,
+    result_id TEXT UNIQUE,
+    sha256 TEXT,
+    timestamp REAL NOT NULL,
+    wound_class TEXT,
+    risk_level TEXT,
+    confidence REAL,
+    depth TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_SEARCH_SECONDS = get_metrics().histogram(
+    "safeheal_similar_search_seconds", "Similar-case search time by method", ("method",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+_CASES = get_metrics().counter("safeheal_similar_cases_total", "Cases offered to the similar-case index", ("result",))
+
+
+def normalize(vectors):
+    """Rows scaled to unit length as float32 (all-zero rows stay zero)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, k):
+    """Column indices of the k highest scores of each row, best first"""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+def exact_search(vectors, queries, k, batch_rows=None):
+    """Rows and scores of the k rows with the highest dot product with each query
+
+    vectors is scanned in blocks of batch_rows, keeping a running top k,
+    so a memory-mapped index is never read into memory as a whole.
+    """
+    batch_rows = batch_rows or config.SIMILAR_SEARCH_BATCH
+    queries = np.atleast_2d(queries)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), batch_rows):
+        scores = queries @ np.asarray(vectors[start:start + batch_rows]).T
+        top = _top_k(scores, k)
+        rows = np.concatenate([best_rows, top + start], axis=1)
+        merged = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        keep = _top_k(merged, k)
+        best_rows = np.take_along_axis(rows, keep, axis=1)
+        best_scores = np.take_along_axis(merged, keep, axis=1)
+    return best_rows, best_scores
+
+
+def nearest_centroids(vectors, centroids, batch_rows=None):
+    """Index of the closest centroid of each row"""
+    batch_rows = batch_rows or config.SIMILAR_SEARCH_BATCH
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_rows):
+        labels[start:start + batch_rows] = np.argmax(np.asarray(vectors[start:start + batch_rows]) @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, nlist=None, iterations=IVF_ITERATIONS, seed=0):
+    """Spherical k-means centroids of unit-length rows, trained on a sample of IVF_TRAIN_SAMPLES rows per list"""
+    count = len(vectors)
+    nlist = min(count, nlist or max(1, int(np.sqrt(count))))
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, min(count, nlist * IVF_TRAIN_SAMPLES), replace=False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+    for _ in range(iterations):
+        labels = nearest_centroids(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        starts = np.searchsorted(labels[order], np.arange(nlist))
+        sums = np.zeros_like(centroids)
+        # Per-list sums of the sorted rows; lists left empty are reseeded from random rows
+        empty = counts == 0
+        sums[~empty] = np.add.reduceat(sample[order], starts[~empty], axis=0)
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted lists over the rows of an index: each row belongs to its nearest centroid"""
+
+    def __init__(self, centroids, labels, trained_count):
+        self.centroids = centroids
+        # Case count the centroids were trained at; retrained once it has doubled
+        self.trained_count = trained_count
+        self.lists = [[] for _ in range(len(centroids))]
+        self.size = 0
+        self._arrays = None
+        self.extend(labels)
+
+    def extend(self, labels):
+        """Add the next rows, given the list each one belongs to"""
+        for row, label in enumerate(labels, self.size):
+            self.lists[label].append(row)
+        self.size += len(labels)
+        self._arrays = None
+
+    def candidates(self, query, nprobe):
+        """Rows of the nprobe lists whose centroids are closest to the query"""
+        arrays = self._arrays
+        if arrays is None:
+            arrays = self._arrays = [np.asarray(rows, dtype=np.int64) for rows in self.lists]
+        probe = _top_k((self.centroids @ query)[None], nprobe)[0]
+        return np.concatenate([arrays[i] for i in probe])
+
+    def search(self, vectors, queries, k, nprobe=None):
+        """Like exact_search, scoring only the candidates of each query"""
+        nprobe = nprobe or config.SIMILAR_NPROBE
+        queries = np.atleast_2d(queries)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            rows = np.sort(self.candidates(query, nprobe))
+            # Rows another thread has added since these vectors were mapped
+            rows = rows[rows < len(vectors)]
+            if not len(rows):
+                continue
+            scores = (np.asarray(vectors[rows]) @ query)[None]
+            top = _top_k(scores, k)[0]
+            best_rows[i, :len(top)] = rows[top]
+            best_scores[i, :len(top)] = scores[0, top]
+        return best_rows, best_scores
+
+
+def embedding_version():
+    """Short hash of what the embeddings depend on: the classifier checkpoint, its backbone and the layer read"""
+    from backend.cache import _fingerprint
+
+    parts = [_fingerprint(config.CLASSIFICATION_WEIGHTS), config.BACKBONE_NAME, config.EMBEDDING_LAYER]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:16]
+
+
+def _write_npz(path, **arrays):
+    # Atomically, so another process never loads a partial file
+    fd, temp_path = tempfile.mkstemp(prefix=".ivf-", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            np.savez(out, **arrays)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class CaseIndex:
+    """Persistent, append-only index of case embeddings with exact and IVF top-k search"""
+
+    def __init__(self, directory=None, version=None, exact_max=None):
+        self.directory = directory or config.SIMILAR_DIR
+        self.version = embedding_version() if version is None else version
+        base = os.path.join(self.directory, self.version)
+        self.db_path = base + ".db"
+        self.vectors_path = base + ".f32"
+        self.ivf_path = base + ".ivf.npz"
+        self.exact_max = config.SIMILAR_EXACT_MAX if exact_max is None else exact_max
+        self._local = threading.local()
+        # Guards the mapped rows and the IVF lists, which every search thread shares
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._count = 0
+        self._ivf = None
+        self._ivf_loaded = False
+        self._training = False
+        os.makedirs(self.directory, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self):
+        # SQLite connections are per thread; Streamlit sessions and jobs run on several
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @property
+    def dim(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        return int(row[0]) if row else None
+
+    def __len__(self):
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM cases").fetchone()[0]
+
+    def add(self, embedding, result_id=None, sha256=None, wound_class=None, risk_level=None, confidence=None,
+            depth=None, timestamp=None):
+        """Add one case; returns its id, or None when a case with this result_id is already indexed"""
+        case = {
+            "result_id": result_id, "sha256": sha256, "wound_class": wound_class, "risk_level": risk_level,
+            "confidence": confidence, "depth": depth, "timestamp": timestamp,
+        }
+        return self.add_many(np.asarray(embedding).reshape(1, -1), [case])[0]
+
+    def add_many(self, embeddings, cases=None):
+        """Add a batch of cases in one transaction; returns their ids (None for duplicates)
+
+        cases are dicts of the CASE_COLUMNS fields (all optional).
+        """
+        vectors = normalize(np.asarray(embeddings).reshape(len(embeddings), -1))
+        cases = cases or [{}] * len(vectors)
+        now = time.time()
+        ids = []
+        db = self._connect()
+        # Taken up front, so concurrent writers never interleave their rows
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            if row is None:
+                db.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (str(vectors.shape[1]),))
+            elif int(row[0]) != vectors.shape[1]:
+                raise ValueError(f"Embedding has {vectors.shape[1]} dimensions, the index {row[0]}")
+            fd = os.open(self.vectors_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                for vector, case in zip(vectors, cases):
+                    cursor = db.execute(
+                        "INSERT OR IGNORE INTO cases (result_id, sha256, timestamp, wound_class, risk_level, confidence, "
+                        "depth) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (case.get("result_id"), case.get("sha256"), case.get("timestamp") or now,
+                         case.get("wound_class"), case.get("risk_level"), case.get("confidence"), case.get("depth")),
+                    )
+                    if cursor.rowcount == 0:
+                        ids.append(None)
+                        continue
+                    # Written before the commit: a reader that sees the case also finds its row
+                    os.pwrite(fd, vector.tobytes(), (cursor.lastrowid - 1) * vector.nbytes)
+                    ids.append(cursor.lastrowid)
+            finally:
+                os.close(fd)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return ids
+
+    def _refresh(self):
+        """Map the rows added since the last search (by any process) and put them in their IVF lists"""
+        count = len(self)
+        with self._lock:
+            if self._vectors is None or count != self._count:
+                if count:
+                    self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+                else:
+                    self._vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+                self._count = count
+            if not self._ivf_loaded:
+                self._ivf_loaded = True
+                self._ivf = self._load_ivf()
+            if self._ivf is not None and self._ivf.size < count:
+                self._ivf.extend(nearest_centroids(self._vectors[self._ivf.size:], self._ivf.centroids))
+            return self._vectors, self._ivf
+
+    def _load_ivf(self):
+        try:
+            with np.load(self.ivf_path) as data:
+                centroids, labels = data["centroids"], data["labels"]
+        except (OSError, KeyError, ValueError):
+            return None
+        if centroids.shape[1] != self._vectors.shape[1] or len(labels) > self._count:
+            return None
+        return IVFIndex(centroids, labels, len(labels))
+
+    def build(self, nlist=None):
+        """Train the IVF lists over every case now and save them; returns the IVFIndex"""
+        vectors, _ = self._refresh()
+        count = len(vectors)
+        if not count:
+            return None
+        centroids = train_centroids(vectors, nlist)
+        labels = nearest_centroids(vectors, centroids)
+        _write_npz(self.ivf_path, centroids=centroids, labels=labels)
+        ivf = IVFIndex(centroids, labels, count)
+        with self._lock:
+            # Rows added while training are picked up by the next refresh
+            self._ivf = ivf
+        return ivf
+
+    def _train_in_background(self):
+        with self._lock:
+            if self._training:
+                return
+            self._training = True
+
+        def _train():
+            try:
+                self.build()
+            finally:
+                self._training = False
+
+        threading.Thread(target=_train, name="safeheal-similar-ivf", daemon=True).start()
+
+    def search_rows(self, queries, k, method=None, nprobe=None):
+        """(rows, scores) of the top k cases of each query; rows are case ids - 1, -1 where there are fewer
+
+        method forces EXACT or IVF. By default the IVF lists are used once
+        the index holds more than exact_max cases; until they are trained
+        (in the background) searches stay exact.
+        """
+        vectors, ivf = self._refresh()
+        queries = normalize(np.atleast_2d(queries))
+        if method is None and len(vectors) > self.exact_max:
+            if ivf is None or len(vectors) >= 2 * ivf.trained_count:
+                self._train_in_background()
+            method = IVF if ivf is not None else EXACT
+        if method == IVF and ivf is None:
+            raise ValueError("The IVF index has not been built; run python -m backend.similar build")
+        start = time.perf_counter()
+        if method == IVF:
+            rows, scores = ivf.search(vectors, queries, k, nprobe)
+        else:
+            method = EXACT
+            rows, scores = exact_search(vectors, queries, k)
+        _SEARCH_SECONDS.observe(time.perf_counter() - start, method=method)
+        return rows, scores
+
+    def cases(self, ids):
+        """CASE_COLUMNS dicts of the given case ids, in that order"""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        rows = self._connect().execute(
+            f"SELECT {', '.join(CASE_COLUMNS)} FROM cases WHERE id IN ({', '.join('?' * len(ids))})", ids
+        ).fetchall()
+        found = {row[0]: dict(zip(CASE_COLUMNS, row)) for row in rows}
+        return [found[i] for i in ids if i in found]
+
+    def image_hash(self, result_id):
+        """sha256 of the image behind an indexed result, or None"""
+        row = self._connect().execute("SELECT sha256 FROM cases WHERE result_id = ?", (result_id,)).fetchone()
+        return row[0] if row else None
+
+    def search(self, embedding, k=None, exclude=(), method=None):
+        """The k cases most similar to an embedding, best first, each with its cosine "score"
+
+        Cases of the image hashes in exclude (e.g. the query image's own
+        analyses at other detail levels) are left out.
+        """
+        k = k or config.SIMILAR_TOP_K
+        exclude = set(exclude)
+        # Room for the excluded image's own cases, one per detail level at most
+        extra = 4 * len(exclude)
+        rows, scores = self.search_rows(np.asarray(embedding).reshape(1, -1), k + extra, method)
+        hits = [(int(row) + 1, float(score)) for row, score in zip(rows[0], scores[0]) if row >= 0]
+        cases = self.cases([case_id for case_id, _ in hits])
+        scores = dict(hits)
+        similar = [{**case, "score": scores[case["id"]]} for case in cases if case["sha256"] not in exclude]
+        return similar[:k]
+
+    def stats(self):
+        vectors, ivf = self._refresh()
+        return {
+            "path": self.db_path,
+            "cases": len(vectors),
+            "dim": self.dim,
+            "ivf_lists": len(ivf.centroids) if ivf is not None else None,
+            "ivf_trained_cases": ivf.trained_count if ivf is not None else None,
+            "exact_max": self.exact_max,
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_case_index():
+    """Return the process-wide similar-case index for the current classifier"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = CaseIndex()
+    return _index
+
+
+def reset_case_index(name=None):
+    """Model registry listener: after the classifier is reloaded, reopen the index for its embedding version"""
+    global _index
+    if name in (None, "classification"):
+        with _index_lock:
+            _index = None
+
+
+def index_analysis(analysis, sha256=None):
+    """Add a finished analysis to the index; returns its case id, or None if it was not added
+
+    Indexing never fails an analysis: analyses without an embedding, or
+    that the index cannot take, are only counted.
+    """
+    embedding = analysis.get("embedding")
+    if embedding is None:
+        _CASES.inc(result="no_embedding")
+        return None
+    try:
+        case_id = get_case_index().add(
+            embedding, analysis.get("result_id"), sha256, analysis.get("wound_class"), analysis.get("risk_level"),
+            analysis.get("confidence"), analysis.get("depth"),
+        )
+    except (OSError, sqlite3.Error, ValueError):
+        _CASES.inc(result="error")
+        return None
+    _CASES.inc(result="added" if case_id is not None else "duplicate")
+    return case_id
+
+
+def similar_cases(analysis, k=None, sha256=None):
+    """Past cases most similar to an analysis, excluding analyses of the same image (empty without an embedding)"""
+    embedding = analysis.get("embedding")
+    if embedding is None:
+        return []
+    index = get_case_index()
+    sha256 = sha256 or (index.image_hash(analysis["result_id"]) if analysis.get("result_id") else None)
+    return index.search(embedding, k, [sha256] if sha256 else [])
+
+
+def run_benchmark(cases=100000, dim=304, queries=200, k=None, nprobe=None, clusters=200, seed=0):
+    """Search latency (p50/p95 ms) of exact and IVF search and the IVF recall@k, on synthetic embeddings
+
+    The synthetic cases are noisy copies of random cluster centres, so,
+    like real embeddings, they are far from uniformly spread.
+    """
+    k = k or config.SIMILAR_TOP_K
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+
+    def synthetic(count):
+        return centres[rng.integers(clusters, size=count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory(prefix="safeheal-similar-") as directory:
+        index = CaseIndex(directory, "benchmark", exact_max=cases)
+        start = time.perf_counter()
+        for first in range(0, cases, 10000):
+            index.add_many(synthetic(min(10000, cases - first)))
+        insert_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        index.build()
+        build_seconds = time.perf_counter() - start
+
+        probes = synthetic(queries)
+        results = {"cases": cases, "dim": dim, "k": k, "insert_per_case_ms": insert_seconds / cases * 1000,
+                   "ivf_build_s": build_seconds}
+        found = {}
+        for method in (EXACT, IVF):
+            latencies = []
+            rows = []
+            for query in probes:
+                start = time.perf_counter()
+                hits, _ = index.search_rows(query, k, method, nprobe)
+                latencies.append(time.perf_counter() - start)
+                rows.append(hits[0])
+            found[method] = rows
+            results[f"{method}_p50_ms"] = float(np.percentile(latencies, 50) * 1000)
+            results[f"{method}_p95_ms"] = float(np.percentile(latencies, 95) * 1000)
+        results["ivf_recall"] = float(np.mean([
+            len(set(exact) & set(approximate)) / len(exact) for exact, approximate in zip(found[EXACT], found[IVF])
+        ]))
+        index._connect().close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.similar", description="SafeHeal similar-case index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="size of the current classifier's index")
+    build = commands.add_parser("build", help="train the IVF lists over every case now")
+    build.add_argument("--lists", type=int, help="default: the square root of the number of cases")
+    benchmark = commands.add_parser("benchmark", help="search latency and recall on synthetic embeddings")
+    benchmark.add_argument("--cases", type=int, default=100000)
+    benchmark.add_argument("--dim", type=int, default=304)
+    benchmark.add_argument("--queries", type=int, default=200)
+    benchmark.add_argument("--k", type=int, default=config.SIMILAR_TOP_K)
+    benchmark.add_argument("--nprobe", type=int, default=config.SIMILAR_NPROBE)
+    args = parser.parse_args(argv)
+
+    if args.command == "benchmark":
+        print(json.dumps(run_benchmark(args.cases, args.dim, args.queries, args.k, args.nprobe), indent=2))
+        return 0
+    index = get_case_index()
+    if args.command == "build":
+        if index.build(args.lists) is None:
+            print("The index is empty")
+            return 1
+    print(json.dumps(index.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,176 @@
+import argparse
+import importlib
+import json
+import threading
+import time
+
+from backend import config
+from backend.telemetry import get_metrics
+
+# Cold start of the app: the Streamlit shell renders from light modules only while a
+# background thread imports the pipeline (torch, timm, OpenCV), loads the models and
+# runs a dummy forward pass through each. Readiness gates the Analyze button. Phase
+# timings are exported as safeheal_startup_seconds{phase=...}, including the time from
+# process start to the first finished analysis (phase="first_analysis").
+#   python -m backend.startup       measure a cold start and first analysis in a fresh interpreter
+STARTED = time.perf_counter()
+# Imported in this order so each entry's time excludes the modules before it
+HEAVY_MODULES = ("numpy", "PIL.Image", "cv2", "torch", "timm", "backend.inference", "backend.llm_service", "app.routes")
+
+# Models whose checkpoints feed the result cache key; reloading the LLM or the
+# wound-presence check leaves cached analyses valid
+CACHED_MODELS = ("segmentation", "classification", "fused")
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+_STARTUP_SECONDS = get_metrics().gauge("safeheal_startup_seconds", "Duration of each cold start phase", ("phase",))
+
+
+class Startup:
+    """Background import and model warm-up of the process, with a readiness flag
+
+    Phases and their durations in seconds are kept in timings: one
+    "import:<module>" entry per heavy module, "models" for loading and the
+    dummy forward passes, then "ready" and "first_analysis" measured from
+    process start.
+    """
+
+    def __init__(self, models=None, started=None):
+        self.models = models
+        self.started = STARTED if started is None else started
+        self.status = PENDING
+        self.error = None
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.status == READY
+
+    def record(self, phase, seconds):
+        """Record a phase duration once; later calls for the same phase are ignored"""
+        with self._lock:
+            if phase in self.timings:
+                return
+            self.timings[phase] = seconds
+        _STARTUP_SECONDS.set(seconds, phase=phase)
+
+    def start(self):
+        """Begin warming up on a daemon thread (once) and return self"""
+        with self._lock:
+            if self._thread is None:
+                self.status = LOADING
+                self._thread = threading.Thread(target=self._run, name="safeheal-startup", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for module in HEAVY_MODULES:
+                start = time.perf_counter()
+                importlib.import_module(module)
+                self.record(f"import:{module}", time.perf_counter() - start)
+
+            from backend.cache import get_result_cache
+            from backend.inference import get_registry
+            from backend.similar import reset_case_index
+
+            start = time.perf_counter()
+            # Loads every preloaded model and runs its warm-up (a dummy forward pass)
+            registry = get_registry()
+            registry.warm_up(self.models)
+            self.record("models", time.perf_counter() - start)
+            # Cached analyses are purged when the model version has changed since they were
+            # computed: now, and after a reload of a model that the version covers
+            cache = get_result_cache()
+            cache.refresh()
+            registry.add_listener(lambda name: name in CACHED_MODELS and cache.refresh())
+            # A new classifier checkpoint gets its own similar-case index
+            registry.add_listener(reset_case_index)
+        except Exception as exc:
+            with self._lock:
+                self.status = FAILED
+                self.error = f"{type(exc).__name__}: {exc}"
+        else:
+            self.record("ready", time.perf_counter() - self.started)
+            with self._lock:
+                self.status = READY
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until warm-up has finished or failed; returns whether it is ready"""
+        self._done.wait(timeout)
+        return self.ready
+
+    def analysis_finished(self):
+        """Note a finished analysis; the first one sets time-to-first-analysis"""
+        if "first_analysis" not in self.timings:
+            self.record("first_analysis", time.perf_counter() - self.started)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "error": self.error,
+                "elapsed": self.elapsed(),
+                "timings": dict(self.timings),
+            }
+
+
+_startup = None
+_startup_lock = threading.Lock()
+
+
+def get_startup():
+    """Return the process-wide startup state (not started until start() is called)"""
+    global _startup
+    if _startup is None:
+        with _startup_lock:
+            if _startup is None:
+                _startup = Startup()
+    return _startup
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.startup", description="Measure SafeHeal cold start")
+    parser.add_argument("--image", help="image for the first analysis (default: a synthetic wound)")
+    parser.add_argument("--output", help="also write the timings as JSON to this path")
+    args = parser.parse_args(argv)
+
+    startup = get_startup().start()
+    if not startup.wait():
+        print(json.dumps(startup.snapshot(), indent=2))
+        return 1
+
+    from app.routes import analyze_image
+    from backend.inference import get_registry
+
+    if args.image:
+        image = args.image
+    else:
+        from backend.benchmark import synthetic_wound
+
+        image = synthetic_wound(config.INPUT_SIZE)[0]
+    registry = get_registry()
+    with registry.acquire("segmentation") as segmentation, registry.acquire("classification") as classification, \
+            registry.acquire("llm") as llm:
+        analyze_image(image, segmentation, classification, llm, use_cache=False)
+    snapshot = startup.snapshot()
+    print(json.dumps(snapshot, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(snapshot, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,469 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend import config
+
+# Process-local instrumentation of the analysis pipeline:
+#   with trace("analysis", job.id):   root of a request; its id tags every span inside it
+#       with span("segmentation"):    timed stage, also observed in safeheal_stage_seconds
+# Counters, gauges and histograms are rendered in the Prometheus text format by
+# render_metrics() and served at /metrics (the HTTP API, or SAFEHEAL_METRICS_PORT for the
+# Streamlit process). Recent and slowest traces are served as JSON at /traces. With
+# SAFEHEAL_PROFILE_SLOWEST=N every trace is stack-sampled and the N slowest keep their
+# samples under data/results/profiles as collapsed stacks (flamegraph.pl, speedscope).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels) or set(labels) != set(self.labels):
+            raise ValueError(f"Metric '{self.name}' takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self._samples()]
+
+
+class Counter(_Metric):
+    """A count that only goes up, e.g. requests served or cache hits"""
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(list(zip(self.labels, key)))} {_format_value(v)}" for key, v in values]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, set directly or read from a callback at scrape time"""
+
+    type = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, fn, **labels):
+        """Report fn() for these labels; the series is dropped once fn returns None"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = fn
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            value = fn()
+            if value is None:
+                with self._lock:
+                    if self._functions.get(key) is fn:
+                        del self._functions[key]
+                continue
+            values[key] = value
+        return [
+            f"{self.name}{_format_labels(list(zip(self.labels, key)))} {_format_value(v)}"
+            for key, v in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (durations, sizes) in cumulative buckets"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One count per bucket plus the +Inf overflow, then the running sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics of this process; asking twice for the same name returns the same metric"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, help, labels, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **options)
+            elif type(metric) is not cls or metric.labels != tuple(labels):
+                raise ValueError(f"Metric '{name}' is already registered as a different {metric.type}")
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get_or_create(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get_or_create(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labels, buckets=buckets)
+
+    def get(self, name):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Return the process-wide metrics registry"""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = MetricsRegistry()
+    return _metrics
+
+
+def render_metrics():
+    return get_metrics().render()
+
+
+_STAGE_SECONDS = get_metrics().histogram("safeheal_stage_seconds", "Duration of pipeline stages", ("stage",))
+_STAGE_ERRORS = get_metrics().counter("safeheal_stage_errors_total", "Pipeline stages that raised", ("stage", "error"))
+_TRACE_SECONDS = get_metrics().histogram("safeheal_request_seconds", "End-to-end duration of traced requests", ("name",))
+get_metrics().gauge("safeheal_process_start_time_seconds", "Start time of the process").set(time.time())
+
+_current_trace = contextvars.ContextVar("safeheal_trace", default=None)
+
+
+class Trace:
+    """The spans recorded for one request, identified by its correlation id"""
+
+    def __init__(self, name, correlation_id=None):
+        self.name = name
+        self.id = correlation_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.seconds = None
+        self.spans = []
+        self.profile = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, seconds, error=None, attributes=None):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "offset": start - self._start,
+                "seconds": seconds,
+                "thread": threading.current_thread().name,
+                "error": error,
+                **(attributes or {}),
+            })
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "spans": spans,
+            "profile": self.profile,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def correlation_id():
+    """Id of the request being traced in this context, or None"""
+    trace_ = _current_trace.get()
+    return trace_.id if trace_ is not None else None
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Time a block as a stage of the current trace; recorded in the stage histogram either way"""
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as exc:
+        error = type(exc).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _STAGE_SECONDS.observe(seconds, stage=name)
+        if error is not None:
+            _STAGE_ERRORS.inc(stage=name, error=error)
+        trace_ = _current_trace.get()
+        if trace_ is not None:
+            trace_.add_span(name, start, seconds, error, attributes)
+
+
+@contextlib.contextmanager
+def trace(name, correlation_id=None):
+    """Root of a request: binds a correlation id for every span run inside the block
+
+    When profiling is enabled the calling thread's stack is sampled for
+    the duration of the block.
+    """
+    current = Trace(name, correlation_id)
+    token = _current_trace.set(current)
+    profiler = SamplingProfiler().start() if config.PROFILE_SLOWEST > 0 else None
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - current._start
+        _current_trace.reset(token)
+        _TRACE_SECONDS.observe(current.seconds, name=name)
+        get_trace_log().record(current, profiler.stop() if profiler is not None else None)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack on a timer and counts the collapsed stacks
+
+    Stacks are "outer;inner;leaf" strings of module:function frames, the
+    format flamegraph.pl and speedscope read. Sampling runs on its own
+    daemon thread; the profiled thread only pays for the GIL hand-offs.
+    """
+
+    def __init__(self, thread_id=None, interval_ms=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = (interval_ms or config.PROFILE_INTERVAL_MS) / 1000.0
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="safeheal-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+                stack.append(f"{module}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stop sampling and return the stack counts"""
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+def write_flame(stacks, path):
+    """Write stack counts as collapsed-stack lines ("a;b;c 12"), atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+    os.replace(temp_path, path)
+    return path
+
+
+class TraceLog:
+    """The most recent traces plus the slowest ones seen by this process
+
+    Sampled stacks of a trace are written to directory while it is among
+    the slowest and deleted when a slower trace pushes it out, so the
+    directory always holds flame data for the current top N.
+    """
+
+    def __init__(self, retention=None, slowest=None, directory=None):
+        self.slowest = slowest or config.PROFILE_SLOWEST or 10
+        self.directory = directory or config.PROFILE_DIR
+        self._recent = collections.deque(maxlen=retention or config.TRACE_RETENTION)
+        self._slowest = []
+        self._lock = threading.Lock()
+
+    def record(self, trace_, stacks=None):
+        with self._lock:
+            self._recent.append(trace_)
+            if len(self._slowest) >= self.slowest and trace_.seconds <= self._slowest[0][0]:
+                return
+            heapq.heappush(self._slowest, (trace_.seconds, trace_.id, trace_))
+            dropped = heapq.heappop(self._slowest)[2] if len(self._slowest) > self.slowest else None
+            if stacks:
+                name = f"{trace_.seconds * 1000:08.0f}ms-{trace_.name}-{trace_.id}.folded"
+                trace_.profile = write_flame(stacks, os.path.join(self.directory, name))
+            if dropped is not None and dropped.profile is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(dropped.profile)
+
+    def recent(self):
+        with self._lock:
+            return list(reversed(self._recent))
+
+    def slowest_traces(self):
+        with self._lock:
+            return [item[2] for item in sorted(self._slowest, reverse=True)]
+
+    def find(self, correlation_id):
+        with self._lock:
+            return next((t for t in reversed(self._recent) if t.id == correlation_id), None)
+
+    def snapshot(self):
+        return {
+            "recent": [t.to_dict() for t in self.recent()],
+            "slowest": [t.to_dict() for t in self.slowest_traces()],
+        }
+
+
+_trace_log = None
+_trace_log_lock = threading.Lock()
+
+
+def get_trace_log():
+    """Return the process-wide trace log"""
+    global _trace_log
+    if _trace_log is None:
+        with _trace_log_lock:
+            if _trace_log is None:
+                _trace_log = TraceLog()
+    return _trace_log
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body, content_type = render_metrics().encode(), CONTENT_TYPE
+        elif path == "/traces":
+            body, content_type = json.dumps(get_trace_log().snapshot()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(host=None, port=None):
+    """Serve /metrics and /traces on a background thread and return (server, base URL)
+
+    port=0 picks a free port. Call server.shutdown() to stop it.
+    """
+    host = host or config.METRICS_HOST
+    server = ThreadingHTTPServer((host, config.METRICS_PORT if port is None else port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="safeheal-metrics", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def serve_metrics():
+    """Start the process-wide metrics endpoint once, if SAFEHEAL_METRICS_PORT is set; returns its URL"""
+    global _metrics_server
+    if not config.METRICS_PORT:
+        return None
+    if _metrics_server is None:
+        with _metrics_server_lock:
+            if _metrics_server is None:
+                _metrics_server = start_metrics_server()
+    return _metrics_server[1]
@@ -0,0 +1,234 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+
+from backend import config
+
+# Content-addressed store for uploaded images and videos:
+#   data/uploads/<sha256[:2]>/<sha256><ext>
+# Storing the same bytes again writes nothing and only refreshes the file's
+# last-use time. Files larger than UPLOAD_MMAP_MIN_MB are memory-mapped for reads.
+# Retention drops files older than UPLOAD_MAX_AGE_DAYS, then least recently used
+# ones until the store fits UPLOAD_MAX_MB. Because result cache keys are the same
+# SHA-256, a re-uploaded photo is found in the result cache without being hashed again.
+#   python -m backend.uploads stats
+#   python -m backend.uploads prune
+COPY_CHUNK_SIZE = 1 << 20
+# How often put() also sweeps for expired files
+_AGE_SWEEP_INTERVAL = 3600.0
+_HEX = set("0123456789abcdef")
+
+
+class StoredUpload:
+    """A file in the upload store; usable wherever a path is (os.PathLike)"""
+
+    __slots__ = ("sha256", "path", "size", "name", "duplicate")
+
+    def __init__(self, sha256, path, size, name=None, duplicate=False):
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+        self.name = name
+        # True when the same content was already stored
+        self.duplicate = duplicate
+
+    def __fspath__(self):
+        return self.path
+
+    def open(self, mmap_min_bytes=None):
+        """The file's bytes, memory-mapped read-only when the file is large"""
+        mmap_min_bytes = int(config.UPLOAD_MMAP_MIN_MB * 2**20) if mmap_min_bytes is None else mmap_min_bytes
+        with open(self.path, "rb") as f:
+            if self.size >= mmap_min_bytes and self.size > 0:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return f.read()
+
+    def __repr__(self):
+        state = " (duplicate)" if self.duplicate else ""
+        return f"<StoredUpload {self.name or self.sha256[:12]} {self.size} bytes{state}>"
+
+
+def _extension(name):
+    ext = os.path.splitext(name or "")[1].lower()
+    return ext if 1 < len(ext) <= 6 and ext[1:].isalnum() else ""
+
+
+class UploadStore:
+    """Deduplicating, size- and age-bounded store of uploads keyed by content hash"""
+
+    def __init__(self, directory=None, max_bytes=None, max_age=None):
+        self.directory = directory or config.UPLOAD_DIR
+        self.max_bytes = int(config.UPLOAD_MAX_MB * 2**20) if max_bytes is None else max_bytes
+        self.max_age = config.UPLOAD_MAX_AGE_DAYS * 86400 if max_age is None else max_age
+        self._lock = threading.Lock()
+        self._used = None
+        self._last_sweep = 0.0
+
+    def _path(self, sha256, ext=""):
+        return os.path.join(self.directory, sha256[:2], sha256 + ext)
+
+    def find(self, sha256):
+        """The stored upload with this hash, or None"""
+        shard = os.path.join(self.directory, sha256[:2])
+        try:
+            names = [n for n in os.listdir(shard) if n.startswith(sha256) and not n.endswith(".tmp")]
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+        path = os.path.join(shard, names[0])
+        try:
+            size = os.path.getsize(path)
+            os.utime(path)
+        except OSError:
+            return None
+        return StoredUpload(sha256, path, size, names[0], duplicate=True)
+
+    def put(self, upload, name=None, sha256=None):
+        """Store bytes or a file-like object (streamed) and return its StoredUpload
+
+        Content that is already stored is not written again; its last-use
+        time is refreshed and the result has duplicate=True. sha256 may
+        pass the digest of bytes when the caller already has it.
+        """
+        name = name or getattr(upload, "name", None)
+        if isinstance(upload, (bytes, bytearray, memoryview)):
+            sha256 = sha256 or hashlib.sha256(upload).hexdigest()
+            existing = self.find(sha256)
+            if existing is not None:
+                existing.name = name or existing.name
+                return existing
+            return self._write(sha256, name, lambda out: out.write(upload))
+
+        # Streams are hashed while being copied to a temp file, so large videos never sit in memory
+        if hasattr(upload, "seek"):
+            upload.seek(0)
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = os.path.join(self.directory, f".upload-{threading.get_ident()}-{time.time_ns()}.tmp")
+        digest = hashlib.sha256()
+        try:
+            with open(temp_path, "wb") as out:
+                for chunk in iter(lambda: upload.read(COPY_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+            sha256 = digest.hexdigest()
+            existing = self.find(sha256)
+            if existing is not None:
+                existing.name = name or existing.name
+                return existing
+            return self._write(sha256, name, temp_path=temp_path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+
+    def _write(self, sha256, name, write=None, temp_path=None):
+        path = self._path(sha256, _extension(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if temp_path is None:
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as out:
+                write(out)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._used is not None:
+                self._used += size
+            over_budget = self._used is None or self._used > self.max_bytes
+            sweep_due = self.max_age and time.time() - self._last_sweep > _AGE_SWEEP_INTERVAL
+        if over_budget or sweep_due:
+            self.enforce()
+        return StoredUpload(sha256, path, size, name)
+
+    def _shards(self):
+        # Only the two-hex-digit shard directories belong to the store; other files are left alone
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in names if len(n) == 2 and all(c in _HEX for c in n)]
+
+    def _files(self):
+        files = []
+        for shard in self._shards():
+            for name in os.listdir(shard):
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(shard, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def enforce(self):
+        """Apply age and size retention; returns the number of files removed"""
+        files = sorted(self._files())
+        cutoff = time.time() - self.max_age if self.max_age else None
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            if (cutoff is None or mtime >= cutoff) and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._used = total
+            self._last_sweep = time.time()
+        return removed
+
+    def stats(self):
+        files = self._files()
+        return {
+            "directory": self.directory,
+            "files": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+            "max_age_days": self.max_age / 86400 if self.max_age else None,
+        }
+
+    def clear(self):
+        """Remove every stored upload"""
+        with self._lock:
+            self._used = None
+        for shard in self._shards():
+            shutil.rmtree(shard, ignore_errors=True)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_upload_store():
+    """Return the process-wide upload store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = UploadStore()
+    return _store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.uploads", description="SafeHeal upload store")
+    parser.add_argument("command", choices=("stats", "prune"))
+    args = parser.parse_args(argv)
+    store = get_upload_store()
+    if args.command == "prune":
+        print(f"Removed {store.enforce()} file(s)")
+    print(json.dumps(store.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
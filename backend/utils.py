@@ -0,0 +1,364 @@
+import cv2
+import numpy as np
+
+from backend import config
+
+# Tissue classes by HSV colour (OpenCV ranges: H 0-179, S and V 0-255); pixels that
+# match none of them (pink epithelium, surrounding skin) count as "other"
+NECROTIC_MAX_VALUE = 60
+GRANULATION_HUES = ((0, 12), (160, 179))
+SLOUGH_HUES = ((15, 40),)
+MIN_TISSUE_SATURATION = 50
+TISSUE_CLASSES = ("granulation", "slough", "necrotic", "other")
+
+# Scale markers: a calibration sticker is a flat, uniformly coloured square with crisp edges.
+# A candidate must fill its bounding rectangle, have a side within a plausible share of the
+# image's shorter side, a uniform interior and a sharp step in brightness to the skin right
+# around it; moles, eschar and shadows fail at least one of these. Rulers are this elongated.
+MARKER_SQUARENESS = 0.85
+MARKER_MIN_FILL = 0.96
+MARKER_SIDE_FRACTION = (0.03, 0.3)
+MARKER_MAX_INTERIOR_STD = 12.0
+# Brightness step across the edge relative to the skin around it, so it holds in dim light
+MARKER_MIN_CONTRAST = 0.55
+# Pixels sampled inside and outside the marker edge for the contrast check
+MARKER_EDGE_BAND = 3
+# Relative difference within which two scale cues (markers or a ruler) agree
+SCALE_AGREEMENT = 0.15
+RULER_MIN_ASPECT = 6.0
+
+
+def _to_uint8_mask(mask):
+    return (np.asarray(mask) > 0).astype(np.uint8)
+
+
+def _to_rgb(image, shape=None):
+    pixels = np.asarray(image.convert("RGB") if hasattr(image, "convert") else image)
+    if pixels.ndim == 2:
+        pixels = np.repeat(pixels[..., None], 3, axis=-1)
+    if shape is not None and pixels.shape[:2] != tuple(shape):
+        pixels = cv2.resize(pixels, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(pixels[..., :3], dtype=np.uint8)
+
+
+def tissue_labels(image, shape=None):
+    """Per-pixel index into TISSUE_CLASSES, classified by colour in one vectorized pass"""
+    hsv = cv2.cvtColor(_to_rgb(image, shape), cv2.COLOR_RGB2HSV)
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    saturated = (saturation >= MIN_TISSUE_SATURATION) & (value >= NECROTIC_MAX_VALUE)
+
+    def in_ranges(ranges):
+        selected = np.zeros(hue.shape, dtype=bool)
+        for low, high in ranges:
+            selected |= (hue >= low) & (hue <= high)
+        return selected
+
+    labels = np.full(hue.shape, TISSUE_CLASSES.index("other"), dtype=np.uint8)
+    labels[saturated & in_ranges(GRANULATION_HUES)] = TISSUE_CLASSES.index("granulation")
+    labels[saturated & in_ranges(SLOUGH_HUES)] = TISSUE_CLASSES.index("slough")
+    labels[value < NECROTIC_MAX_VALUE] = TISSUE_CLASSES.index("necrotic")
+    return labels
+
+
+def _crack_edges(labels):
+    """Number of 4-neighbour pixel sides on each label's boundary, image border included"""
+    padded = np.pad(labels, 1)
+    counts = np.zeros(int(labels.max()) + 1 if labels.size else 1, dtype=np.int64)
+    for a, b in ((padded[:, 1:], padded[:, :-1]), (padded[1:, :], padded[:-1, :])):
+        boundary = a != b
+        counts += np.bincount(a[boundary], minlength=counts.size)[:counts.size]
+        counts += np.bincount(b[boundary], minlength=counts.size)[:counts.size]
+    return counts
+
+
+def _component_stats(labels, count, tissue=None):
+    """Area, perimeter, ellipse axes and tissue histogram for labels 1..count, all via bincount"""
+    ys, xs = np.nonzero(labels)
+    owners = labels[ys, xs]
+    size = count + 1
+    area = np.bincount(owners, minlength=size).astype(np.float64)
+    safe = np.maximum(area, 1)
+    xs, ys = xs.astype(np.float64), ys.astype(np.float64)
+    mean_x = np.bincount(owners, xs, size) / safe
+    mean_y = np.bincount(owners, ys, size) / safe
+    var_x = np.bincount(owners, xs * xs, size) / safe - mean_x ** 2
+    var_y = np.bincount(owners, ys * ys, size) / safe - mean_y ** 2
+    cov_xy = np.bincount(owners, xs * ys, size) / safe - mean_x * mean_y
+    spread = np.sqrt(np.maximum((var_x - var_y) ** 2 / 4 + cov_xy ** 2, 0))
+    # Axes of the ellipse with the same second moments as the component
+    major = 4 * np.sqrt(np.maximum((var_x + var_y) / 2 + spread, 0))
+    minor = 4 * np.sqrt(np.maximum((var_x + var_y) / 2 - spread, 0))
+    # Counting pixel sides overestimates the length of a smooth boundary by 4/pi on average
+    perimeter = _crack_edges(labels)[:size] * (np.pi / 4)
+    stats = {
+        "area": area[1:],
+        "perimeter": perimeter[1:],
+        "major_axis": major[1:],
+        "minor_axis": minor[1:],
+        "centroid": np.stack([mean_x[1:], mean_y[1:]], axis=1),
+    }
+    if tissue is not None:
+        histogram = np.bincount(owners * len(TISSUE_CLASSES) + tissue[labels > 0], minlength=size * len(TISSUE_CLASSES))
+        stats["tissue"] = histogram.reshape(size, len(TISSUE_CLASSES))[1:] / safe[1:, None]
+    return stats
+
+
+def irregularity(area, perimeter):
+    """Perimeter relative to a circle of the same area: 1 for a circle, larger for ragged edges"""
+    area = np.asarray(area, dtype=np.float64)
+    return np.asarray(perimeter, dtype=np.float64) / np.maximum(2 * np.sqrt(np.pi * area), 1e-8)
+
+
+def measure_masks(masks, images=None, mm_per_pixel=None, min_area=None):
+    """Measure every wound component of many masks in one batched pass
+
+    masks is a sequence of H x W arrays (sizes may differ); images, if
+    given, are the matching photos used for tissue composition. Lengths are
+    in millimetres where a scale is known (mm_per_pixel, a number or one per
+    mask) and in pixels otherwise. Returns one dict per mask with totals
+    and a 'components' list, largest component first.
+    """
+    min_area = config.MEASUREMENT_MIN_AREA if min_area is None else min_area
+    images = images if images is not None else [None] * len(masks)
+    scales = mm_per_pixel if isinstance(mm_per_pixel, (list, tuple)) else [mm_per_pixel] * len(masks)
+
+    # Label each mask, then shift its labels so all masks share one label space
+    blocks, tissues, owners, offset = [], [], [], 0
+    for index, (mask, image) in enumerate(zip(masks, images)):
+        mask = _to_uint8_mask(mask)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        keep = np.zeros(count, dtype=np.int32)
+        kept = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= min_area) + 1
+        keep[kept] = np.arange(1, kept.size + 1) + offset
+        blocks.append(keep[labels])
+        tissues.append(tissue_labels(image, mask.shape) if image is not None else None)
+        owners.extend([index] * kept.size)
+        offset += kept.size
+
+    with_tissue = all(t is not None for t in tissues) and offset > 0
+    # Perimeters need 2-D neighbourhoods, so stack the masks with a blank row between them
+    width = max((b.shape[1] for b in blocks), default=0)
+    canvas = np.concatenate(
+        [np.pad(b, ((0, 1), (0, width - b.shape[1]))) for b in blocks]
+    ) if blocks else np.zeros((0, 0), dtype=np.int32)
+    tissue = None
+    if with_tissue:
+        tissue = np.concatenate(
+            [np.pad(t, ((0, 1), (0, width - t.shape[1]))) for t in tissues]
+        )
+    stats = _component_stats(canvas, offset, tissue)
+
+    owners = np.asarray(owners, dtype=np.int64)
+    # Centroids are in canvas coordinates; shift them back into each mask's own
+    row_starts = np.cumsum([0] + [b.shape[0] + 1 for b in blocks])
+    stats["centroid"][:, 1] -= row_starts[owners]
+    results = []
+    for index in range(len(masks)):
+        selected = np.flatnonzero(owners == index)
+        selected = selected[np.argsort(-stats["area"][selected])]
+        scale = scales[index]
+        length = scale or 1.0
+        area = stats["area"][selected] * length ** 2
+        perimeter = stats["perimeter"][selected] * length
+        components = [
+            {
+                "area": float(area[i]),
+                "perimeter": float(perimeter[i]),
+                "length": float(stats["major_axis"][c] * length),
+                "width": float(stats["minor_axis"][c] * length),
+                "irregularity": float(irregularity(stats["area"][c], stats["perimeter"][c])),
+                "centroid": tuple(float(v) for v in stats["centroid"][c]),
+                **({"tissue": dict(zip(TISSUE_CLASSES, map(float, stats["tissue"][c])))} if with_tissue else {}),
+            }
+            for i, c in enumerate(selected)
+        ]
+        total_area_px = float(stats["area"][selected].sum())
+        result = {
+            "units": "mm" if scale else "px",
+            "mm_per_pixel": scale,
+            "component_count": len(components),
+            "area": float(area.sum()),
+            "perimeter": float(perimeter.sum()),
+            "length": components[0]["length"] if components else 0.0,
+            "width": components[0]["width"] if components else 0.0,
+            "irregularity": float(irregularity(total_area_px, stats["perimeter"][selected].sum())) if components else 0.0,
+            "components": components,
+        }
+        if with_tissue:
+            weights = stats["area"][selected, None] / max(total_area_px, 1.0)
+            result["tissue"] = dict(zip(TISSUE_CLASSES, map(float, (stats["tissue"][selected] * weights).sum(axis=0))))
+        results.append(result)
+    return results
+
+
+def _marker_contrast(gray, region):
+    """Grey-level spread inside a filled region and the brightness step across its edge relative to outside"""
+    kernel = np.ones((3, 3), np.uint8)
+    interior = cv2.erode(region, kernel, iterations=MARKER_EDGE_BAND)
+    inner_band = region & ~interior
+    outer_band = cv2.dilate(region, kernel, iterations=MARKER_EDGE_BAND) & ~region
+    if not interior.any() or not outer_band.any():
+        return float("inf"), 0.0
+    inside = gray[interior.astype(bool)].astype(np.float32)
+    outside = float(gray[outer_band.astype(bool)].mean())
+    step = abs(float(gray[inner_band.astype(bool)].mean()) - outside)
+    return float(inside.std()), step / max(outside, 1.0)
+
+
+def _square_markers(gray, exclude):
+    """Sides in pixels of the regions that pass as a square calibration marker, most square first"""
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 51, 10)
+    contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    shorter = min(gray.shape)
+    min_side, max_side = (fraction * shorter for fraction in MARKER_SIDE_FRACTION)
+    candidates = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if not min_side ** 2 <= area <= max_side ** 2:
+            continue
+        approx = cv2.approxPolyDP(contour, 0.04 * cv2.arcLength(contour, True), True)
+        if len(approx) != 4 or not cv2.isContourConvex(approx):
+            continue
+        (_, _), (w, h), _ = cv2.minAreaRect(contour)
+        squareness = min(w, h) / max(w, h, 1e-8)
+        if squareness < MARKER_SQUARENESS or area / max(w * h, 1e-8) < MARKER_MIN_FILL:
+            continue
+        x, y, bw, bh = cv2.boundingRect(approx)
+        if exclude[y:y + bh, x:x + bw].any():
+            continue
+        region = np.zeros(gray.shape, dtype=np.uint8)
+        cv2.drawContours(region, [contour], -1, 1, thickness=cv2.FILLED)
+        spread, step = _marker_contrast(gray, region)
+        if spread > MARKER_MAX_INTERIOR_STD or step < MARKER_MIN_CONTRAST:
+            continue
+        candidates.append((float(np.sqrt(area)), squareness))
+    return [side for side, _ in sorted(candidates, key=lambda c: (-c[1], -c[0]))]
+
+
+def _agree(a, b):
+    return abs(a - b) <= SCALE_AGREEMENT * max(a, b)
+
+
+def _ruler_period(gray, exclude):
+    """Tick spacing in pixels of the most elongated strip in the image, or None"""
+    edges = cv2.Canny(gray, 50, 150)
+    contours, _ = cv2.findContours(cv2.dilate(edges, None, iterations=2), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    best = None
+    for contour in contours:
+        (cx, cy), (w, h), angle = cv2.minAreaRect(contour)
+        long_side, short_side = max(w, h), min(w, h)
+        if short_side < 8 or long_side / short_side < RULER_MIN_ASPECT:
+            continue
+        x, y, bw, bh = cv2.boundingRect(contour)
+        if exclude[y:y + bh, x:x + bw].any():
+            continue
+        if best is None or long_side > best[1][0]:
+            best = ((cx, cy), (long_side, short_side), angle if w >= h else angle + 90)
+    if best is None:
+        return None
+    (cx, cy), (long_side, short_side), angle = best
+    rotation = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+    upright = cv2.warpAffine(gray, rotation, (gray.shape[1], gray.shape[0]))
+    x0, y0 = int(cx - long_side / 2), int(cy - short_side / 2)
+    strip = upright[max(y0, 0):y0 + int(short_side), max(x0, 0):x0 + int(long_side)].astype(np.float32)
+    if strip.shape[1] < 64:
+        return None
+    # Tick marks make the column profile periodic; its strongest frequency gives the spacing
+    profile = strip.mean(axis=0)
+    profile -= profile.mean()
+    spectrum = np.abs(np.fft.rfft(profile * np.hanning(profile.size)))
+    frequencies = np.fft.rfftfreq(profile.size)
+    valid = (frequencies >= 1 / 64) & (frequencies <= 1 / 3)
+    if not valid.any() or spectrum[valid].max() < 3 * np.median(spectrum[valid]):
+        return None
+    return float(1 / frequencies[valid][np.argmax(spectrum[valid])])
+
+
+def detect_scale(image, mask=None, marker_mm=None, ruler_tick_mm=None):
+    """Millimetres per pixel from a square calibration marker or a ruler in the photo
+
+    Looks for a square sticker of side marker_mm (see the MARKER_*
+    thresholds) and for a ruler with ticks every ruler_tick_mm. Regions
+    covered by the wound mask are ignored. When several cues are found
+    they must agree within SCALE_AGREEMENT. Returns None if no cue is
+    found or the cues disagree, so measurements fall back to pixels.
+    """
+    marker_mm = config.SCALE_MARKER_MM if marker_mm is None else marker_mm
+    ruler_tick_mm = config.RULER_TICK_MM if ruler_tick_mm is None else ruler_tick_mm
+    gray = cv2.cvtColor(_to_rgb(image), cv2.COLOR_RGB2GRAY)
+    exclude = np.zeros(gray.shape, dtype=bool)
+    if mask is not None:
+        exclude = _to_uint8_mask(mask).astype(bool)
+        if exclude.shape != gray.shape:
+            exclude = cv2.resize(exclude.astype(np.uint8), (gray.shape[1], gray.shape[0]),
+                                 interpolation=cv2.INTER_NEAREST).astype(bool)
+    scales = [marker_mm / side for side in _square_markers(gray, exclude)]
+    period = _ruler_period(gray, exclude)
+    if period:
+        scales.append(ruler_tick_mm / period)
+    if not scales or not all(_agree(scales[0], scale) for scale in scales[1:]):
+        return None
+    return scales[0]
+
+
+# Every key summarize_measurement() can return; calibration decides between the _mm/cm2 and _px ones
+METRIC_NAMES = (
+    "coverage", "components", "mm_per_pixel", "area_cm2", "area_px",
+    "perimeter_mm", "perimeter_px", "length_mm", "length_px", "width_mm", "width_px", "irregularity",
+    *(f"{name}_fraction" for name in TISSUE_CLASSES),
+)
+
+
+def summarize_measurement(measurement, coverage, pixel_scale=1.0):
+    """Flat metrics dict from one measure_masks() result
+
+    pixel_scale converts uncalibrated pixel measurements taken on a
+    downscaled mask back to pixels of the original image.
+    """
+    calibrated = measurement["units"] == "mm"
+    unit = "mm" if calibrated else "px"
+    length = 1.0 if calibrated else pixel_scale
+    metrics = {"coverage": float(coverage), "components": measurement["component_count"]}
+    if calibrated:
+        metrics.update(mm_per_pixel=measurement["mm_per_pixel"], area_cm2=measurement["area"] / 100)
+    else:
+        metrics["area_px"] = measurement["area"] * length ** 2
+    metrics.update({
+        f"perimeter_{unit}": measurement["perimeter"] * length,
+        f"length_{unit}": measurement["length"] * length,
+        f"width_{unit}": measurement["width"] * length,
+        "irregularity": measurement["irregularity"],
+    })
+    for name, share in measurement.get("tissue", {}).items():
+        metrics[f"{name}_fraction"] = share
+    return metrics
+
+
+def wound_metrics_batch(masks, images=None, mm_per_pixel=None, pixel_scales=None, detect_scales=None):
+    """wound_metrics for many masks with one batched measurement pass
+
+    mm_per_pixel is one scale per mask; missing ones are detected from the
+    images unless detect_scales is False.
+    """
+    detect_scales = config.SCALE_DETECTION if detect_scales is None else detect_scales
+    mm_per_pixel = list(mm_per_pixel) if mm_per_pixel is not None else [None] * len(masks)
+    if images is not None and detect_scales:
+        mm_per_pixel = [
+            detect_scale(image, mask) if scale is None and image is not None else scale
+            for mask, image, scale in zip(masks, images, mm_per_pixel)
+        ]
+    measurements = measure_masks(masks, images, mm_per_pixel)
+    pixel_scales = pixel_scales or [1.0] * len(masks)
+    return [
+        summarize_measurement(measurement, np.asarray(mask).astype(bool).mean(), pixel_scale)
+        for measurement, mask, pixel_scale in zip(measurements, masks, pixel_scales)
+    ]
+
+
+def wound_metrics(mask, image=None, mm_per_pixel=None):
+    """Flat measurement summary of one wound mask, as shown in the UI and sent to the LLM
+
+    The scale is detected from the image when not given. Areas are in
+    cm² and lengths in mm when calibrated, in pixels otherwise.
+    """
+    return wound_metrics_batch([mask], [image] if image is not None else None, [mm_per_pixel])[0]
@@ -0,0 +1,174 @@
+import contextlib
+import heapq
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+from backend import config
+from backend.inference import run_inference_batch, summarize_probabilities
+from backend.quality import frame_quality
+
+COPY_CHUNK_SIZE = 1 << 20
+
+
+class Frame:
+    """A sampled video frame with its position and perceptual hash"""
+
+    __slots__ = ("index", "timestamp", "pixels", "hash", "quality")
+
+    def __init__(self, index, timestamp, pixels, frame_hash):
+        self.index = index
+        self.timestamp = timestamp
+        self.pixels = pixels
+        self.hash = frame_hash
+        self.quality = None
+
+
+@contextlib.contextmanager
+def spooled_video(source, suffix=".mp4"):
+    """Yield a file path for a video, copying uploads to a temp file that is always removed
+
+    OpenCV can only decode from a path, so file-like uploads are streamed
+    to disk in chunks instead of being read into memory first.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        yield os.fspath(source)
+        return
+    name = getattr(source, "name", "")
+    suffix = os.path.splitext(name)[1] or suffix
+    fd, path = tempfile.mkstemp(prefix="safeheal-", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if hasattr(source, "seek"):
+                source.seek(0)
+            shutil.copyfileobj(source, out, COPY_CHUNK_SIZE)
+        yield path
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def dhash(pixels, size=8):
+    """64-bit difference hash of an RGB frame; near-identical frames differ in few bits"""
+    gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def iter_frames(path, sample_fps=None, max_sample_fps=None, max_frames=None, stats=None):
+    """Lazily decode frames from a video, sampling adaptively
+
+    Frames are sampled at sample_fps while the scene is stable and at up
+    to max_sample_fps when consecutive samples differ a lot (the camera is
+    moving). Skipped frames are only grabbed, never decoded to pixels.
+    """
+    sample_fps = sample_fps or config.VIDEO_SAMPLE_FPS
+    max_sample_fps = max(max_sample_fps or config.VIDEO_MAX_SAMPLE_FPS, sample_fps)
+    max_frames = max_frames or config.VIDEO_MAX_FRAMES
+    stats = {} if stats is None else stats
+    stats.setdefault("frames_read", 0)
+    stats.setdefault("frames_sampled", 0)
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {path}")
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        slow_step = max(int(round(fps / sample_fps)), 1)
+        fast_step = max(int(round(fps / max_sample_fps)), 1)
+        step, next_index, index, previous = slow_step, 0, 0, None
+        while stats["frames_sampled"] < max_frames and capture.grab():
+            stats["frames_read"] += 1
+            if index == next_index:
+                ok, bgr = capture.retrieve()
+                if not ok:
+                    break
+                pixels = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+                frame = Frame(index, index / fps, pixels, dhash(pixels))
+                if previous is not None:
+                    moving = hamming(frame.hash, previous) > 2 * config.VIDEO_DUPLICATE_DISTANCE
+                    step = fast_step if moving else slow_step
+                previous = frame.hash
+                stats["frames_sampled"] += 1
+                yield frame
+                next_index = index + step
+            index += 1
+    finally:
+        capture.release()
+
+
+def unique_frames(frames, max_distance=None, stats=None):
+    """Drop frames whose hash is within max_distance bits of the last kept frame"""
+    max_distance = config.VIDEO_DUPLICATE_DISTANCE if max_distance is None else max_distance
+    stats = {} if stats is None else stats
+    stats.setdefault("duplicates_skipped", 0)
+    last = None
+    for frame in frames:
+        if last is not None and hamming(frame.hash, last) <= max_distance:
+            stats["duplicates_skipped"] += 1
+            continue
+        last = frame.hash
+        yield frame
+
+
+def select_keyframes(frames, count=None):
+    """Keep the count best-scoring frames, holding at most count frames in memory at once"""
+    count = count or config.VIDEO_KEYFRAMES
+    best = []
+    for frame in frames:
+        frame.quality = frame_quality(frame.pixels)
+        item = (frame.quality["score"], -frame.index, frame)
+        if len(best) < count:
+            heapq.heappush(best, item)
+        elif item[:2] > best[0][:2]:
+            heapq.heapreplace(best, item)
+        else:
+            frame.pixels = None
+    return sorted((item[2] for item in best), key=lambda f: f.index)
+
+
+def analyze_video(source, segmentation_model, classification_model, keyframes=None, batch_size=4):
+    """Analyze a video by running the models on its best distinct keyframes
+
+    Class probabilities are averaged across keyframes; the mask comes from
+    the highest-quality keyframe. Any temp copy of the upload is deleted
+    before returning.
+    """
+    stats = {}
+    with spooled_video(source) as path:
+        frames = unique_frames(iter_frames(path, stats=stats), stats=stats)
+        selected = select_keyframes(frames, keyframes)
+    if not selected:
+        raise ValueError("No frames could be decoded from the video")
+
+    results = []
+    for start in range(0, len(selected), batch_size):
+        chunk = selected[start:start + batch_size]
+        results.extend(run_inference_batch([f.pixels for f in chunk], segmentation_model, classification_model))
+
+    best = max(range(len(selected)), key=lambda i: selected[i].quality["score"])
+    summary = summarize_probabilities(np.mean([r["probabilities"] for r in results], axis=0))
+    summary.update({
+        "mask": results[best]["mask"],
+        "frame": selected[best].pixels,
+        "keyframes": [
+            {
+                "index": frame.index,
+                "timestamp": frame.timestamp,
+                "quality": frame.quality,
+                "wound_class": result["wound_class"],
+                "confidence": result["confidence"],
+            }
+            for frame, result in zip(selected, results)
+        ],
+        "video_stats": stats,
+    })
+    return summary
@@ -0,0 +1,287 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+import torch
+
+from backend import config
+
+# Model weights shared by every worker process on a host. A checkpoint is converted once
+# to a flat file next to it (<checkpoint>.flat): a JSON index of tensor names, dtypes,
+# shapes and offsets followed by the raw, 64-byte aligned tensor data. Workers map that
+# file copy-on-write and build tensors directly over the mapping, and the models take
+# those tensors as their parameters (load_state_dict(assign=True)), so the weights live
+# once in the page cache however many workers load them. SAFEHEAL_WEIGHTS_FORMAT picks
+# how checkpoints are read: "pth" (torch.load into private memory), "mmap" (torch.load
+# with mmap=True over the .pth itself) or "flat".
+#   python -m backend.weights convert                    convert both checkpoints now
+#   python -m backend.weights benchmark --workers 1 2 4 8  per-worker memory by format
+WEIGHTS_FORMATS = ("pth", "mmap", "flat")
+MAGIC = b"SHWFLAT1"
+ALIGNMENT = 64
+_HEADER = struct.Struct("<8sQ")
+
+# Mapped files, kept open for the life of the process; reloading an unchanged file reuses its mapping
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def flat_path(source):
+    """Flat weight file for a checkpoint"""
+    return os.path.splitext(source)[0] + ".flat"
+
+
+def _source_stamp(source):
+    stat = os.stat(source)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_index(path):
+    """The JSON index of a flat weight file and the offset its data starts at"""
+    with open(path, "rb") as f:
+        magic, length = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not a flat weight file")
+        index = json.loads(f.read(length))
+    return index, _aligned(_HEADER.size + length)
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def is_current(path, source):
+    """Whether a flat file exists and was converted from the checkpoint as it is now"""
+    try:
+        index, _ = read_index(path)
+    except (OSError, ValueError):
+        return False
+    return not os.path.exists(source) or index.get("source") == _source_stamp(source)
+
+
+def write_flat(state_dict, path, source=None):
+    """Write a state dict as a flat weight file (atomically, so workers never map a partial file)"""
+    tensors, offset = {}, 0
+    for name, tensor in state_dict.items():
+        nbytes = tensor.numel() * tensor.element_size()
+        tensors[name] = {
+            "dtype": str(tensor.dtype).split(".")[-1], "shape": list(tensor.shape), "offset": offset, "nbytes": nbytes,
+        }
+        offset = _aligned(offset + nbytes)
+    index = json.dumps({"tensors": tensors, "source": _source_stamp(source) if source else None}).encode()
+    start = _aligned(_HEADER.size + len(index))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".weights-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(_HEADER.pack(MAGIC, len(index)))
+            out.write(index)
+            for name, tensor in state_dict.items():
+                out.seek(start + tensors[name]["offset"])
+                if tensor.numel():
+                    out.write(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+            out.truncate(start + offset)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return path
+
+
+def _map(path):
+    stamp = os.stat(path)
+    key = (os.path.abspath(path), stamp.st_size, stamp.st_mtime_ns)
+    with _maps_lock:
+        mapping = _maps.get(key)
+        if mapping is None:
+            with open(path, "rb") as f:
+                # Copy-on-write: pages stay shared with other workers unless a tensor is written to
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            _maps[key] = mapping
+    return mapping
+
+
+def read_flat(path):
+    """State dict whose tensors are views over the memory-mapped flat file"""
+    index, start = read_index(path)
+    mapping = _map(path)
+    state_dict = {}
+    for name, entry in index["tensors"].items():
+        dtype = getattr(torch, entry["dtype"])
+        count = entry["nbytes"] // torch.empty((), dtype=dtype).element_size()
+        if count:
+            tensor = torch.frombuffer(mapping, dtype=dtype, count=count, offset=start + entry["offset"])
+        else:
+            tensor = torch.empty(0, dtype=dtype)
+        state_dict[name] = tensor.reshape(entry["shape"])
+    return state_dict
+
+
+def shared_state_dict(source, read_checkpoint):
+    """State dict of a checkpoint, mapped from its flat file (converted first if missing or stale)
+
+    read_checkpoint(source) returns the checkpoint's state dict or module
+    and is only called when a conversion is needed.
+    """
+    path = flat_path(source)
+    if not is_current(path, source):
+        checkpoint = read_checkpoint(source)
+        state_dict = checkpoint.state_dict() if isinstance(checkpoint, torch.nn.Module) else checkpoint
+        write_flat(state_dict, path, source=source)
+    return read_flat(path)
+
+
+def memory_usage():
+    """This process's memory in MB: RSS, PSS (shared pages split between their users) and private (USS)
+
+    PSS and private memory come from /proc/self/smaps_rollup and are None
+    where that is unavailable.
+    """
+    usage = {"rss_mb": None, "pss_mb": None, "private_mb": None}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.rstrip().endswith("kB")}
+    except OSError:
+        import resource
+
+        usage["rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+        return usage
+    usage["rss_mb"] = fields.get("Rss", 0) / 2**10
+    usage["pss_mb"] = fields.get("Pss", 0) / 2**10
+    usage["private_mb"] = (fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 2**10
+    return usage
+
+
+def _worker(args):
+    # One benchmark worker: load both models and run a forward pass, signal readiness, then
+    # report memory once the parent asks, i.e. after every worker has loaded, so shared
+    # pages are split between all of them; exits when the parent closes stdin
+    from backend.inference import load_classification_model, load_segmentation_model
+
+    segmentation = load_segmentation_model("cpu", args.segmentation, args.format)
+    classification = load_classification_model("cpu", args.classification, args.format)
+    with torch.no_grad():
+        batch = torch.zeros(1, 3, config.INPUT_SIZE, config.INPUT_SIZE)
+        segmentation(batch)
+        classification(batch)
+    print("ready", flush=True)
+    sys.stdin.readline()
+    print(json.dumps(memory_usage()), flush=True)
+    sys.stdin.read()
+    return 0
+
+
+def _synthetic_checkpoints(directory):
+    """Randomly initialized checkpoints, for benchmarking without the real ones"""
+    from backend.inference import build_classification_model, build_segmentation_model
+
+    paths = (os.path.join(directory, "segmentation.pth"), os.path.join(directory, "classification.pth"))
+    torch.save(build_segmentation_model().state_dict(), paths[0])
+    torch.save(build_classification_model().state_dict(), paths[1])
+    return paths
+
+
+def run_memory_benchmark(worker_counts=(1, 2, 4, 8), formats=WEIGHTS_FORMATS, checkpoints=None):
+    """Start N workers per format and return each configuration's per-worker memory
+
+    Rows hold the mean per-worker RSS, PSS and private memory, measured
+    while all N workers are loaded. RSS counts shared pages in full, so it
+    is the same in every format; with shared weights the private memory
+    stays at the interpreter's own heap and the PSS per worker falls as
+    workers are added, whereas "pth" adds a full copy of the weights to
+    each worker's private memory.
+    """
+    with tempfile.TemporaryDirectory(prefix="safeheal-weights-") as directory:
+        if checkpoints is None:
+            real = (config.SEGMENTATION_WEIGHTS, config.CLASSIFICATION_WEIGHTS)
+            checkpoints = real if all(os.path.exists(p) for p in real) else _synthetic_checkpoints(directory)
+        if "flat" in formats:
+            # Converted up front so conversion cost isn't measured in the first worker
+            from backend.inference import _read_checkpoint
+
+            for path in checkpoints:
+                shared_state_dict(path, lambda source: _read_checkpoint(source, "pth"))
+        results = []
+        for weights_format in formats:
+            for count in worker_counts:
+                command = [
+                    sys.executable, "-m", "backend.weights", "worker", "--format", weights_format,
+                    "--segmentation", checkpoints[0], "--classification", checkpoints[1],
+                ]
+                workers = [
+                    subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=config.BASE_DIR, text=True)
+                    for _ in range(count)
+                ]
+                try:
+                    for worker in workers:
+                        if worker.stdout.readline().strip() != "ready":
+                            raise RuntimeError(f"Benchmark worker failed to load the '{weights_format}' weights")
+                    for worker in workers:
+                        worker.stdin.write("\n")
+                        worker.stdin.flush()
+                    reports = [json.loads(worker.stdout.readline()) for worker in workers]
+                finally:
+                    for worker in workers:
+                        worker.stdin.close()
+                        worker.wait()
+                row = {"format": weights_format, "workers": count}
+                for field in ("rss_mb", "pss_mb", "private_mb"):
+                    values = [r[field] for r in reports if r[field] is not None]
+                    row[f"{field[:-3]}_per_worker_mb"] = sum(values) / len(values) if values else None
+                # Memory the workers take from the host together
+                row["pss_total_mb"] = row["pss_per_worker_mb"] * count if row["pss_per_worker_mb"] is not None else None
+                results.append(row)
+    return results
+
+
+def format_table(results):
+    lines = [f"{'format':<8}{'workers':>8}{'RSS MB':>10}{'PSS MB':>10}{'private MB':>12}{'host PSS MB':>13}"]
+    for row in results:
+        cells = [row[k] for k in ("rss_per_worker_mb", "pss_per_worker_mb", "private_per_worker_mb", "pss_total_mb")]
+        lines.append(f"{row['format']:<8}{row['workers']:>8}" + "".join(
+            f"{'-' if v is None else f'{v:.1f}':>{w}}" for v, w in zip(cells, (10, 10, 12, 13))
+        ))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.weights", description="SafeHeal shared model weights")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="convert checkpoints to flat weight files")
+    convert.add_argument("checkpoints", nargs="*", help="default: the segmentation and classification checkpoints")
+    benchmark = commands.add_parser("benchmark", help="per-worker memory as the number of workers grows")
+    benchmark.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    benchmark.add_argument("--formats", nargs="+", choices=WEIGHTS_FORMATS, default=list(WEIGHTS_FORMATS))
+    benchmark.add_argument("--output", help="also write the rows as JSON to this path")
+    worker = commands.add_parser("worker")
+    worker.add_argument("--format", choices=WEIGHTS_FORMATS, required=True)
+    worker.add_argument("--segmentation", required=True)
+    worker.add_argument("--classification", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        return _worker(args)
+    if args.command == "convert":
+        from backend.inference import _read_checkpoint
+
+        for source in args.checkpoints or (config.SEGMENTATION_WEIGHTS, config.CLASSIFICATION_WEIGHTS):
+            shared_state_dict(source, lambda path: _read_checkpoint(path, "pth"))
+            print(f"{source} -> {flat_path(source)}")
+        return 0
+    results = run_memory_benchmark(tuple(args.workers), tuple(args.formats))
+    print(format_table(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
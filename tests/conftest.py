@@ -0,0 +1,67 @@
+import io
+import sys
+
+import pytest
+
+from backend import config
+
+# On-disk locations every test gets its own copy of
+_DATA_PATHS = {
+    "UPLOAD_DIR": "uploads",
+    "RESULTS_DIR": "results",
+    "RESULT_CACHE_DIR": "results/cache",
+    "REPORTS_DIR": "results/reports",
+    "SIMILAR_DIR": "results/similar",
+    "PROFILE_DIR": "results/profiles",
+    "PROGRESS_DB": "progress.db",
+    "COMPILED_MODEL_DIR": "models/compiled",
+}
+# Process-wide singletons, reset so no test sees another test's stores
+_SINGLETONS = {
+    "backend.cache": "_cache",
+    "backend.jobs": "_manager",
+    "backend.overlays": "_overlay_cache",
+    "backend.progress": "_store",
+    "backend.similar": "_index",
+    "backend.uploads": "_store",
+    "backend.startup": "_startup",
+    "backend.telemetry": "_trace_log",
+}
+
+
+@pytest.fixture(autouse=True)
+def isolated_data(tmp_path, monkeypatch):
+    """Point every data directory at a temporary one and reset the process-wide stores"""
+    for name, path in _DATA_PATHS.items():
+        monkeypatch.setattr(config, name, str(tmp_path / path))
+    for module, name in _SINGLETONS.items():
+        if module in sys.modules:
+            monkeypatch.setattr(sys.modules[module], name, None)
+    return tmp_path
+
+
+@pytest.fixture
+def tiny_models(monkeypatch):
+    """Randomly initialized segmentation and classification models on the smallest EdgeNext, at a 64-pixel input"""
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("timm")
+    monkeypatch.setattr(config, "BACKBONE_NAME", "edgenext_xx_small")
+    monkeypatch.setattr(config, "INPUT_SIZE", 64)
+    monkeypatch.setattr(config, "DEVICE", "cpu")
+    from backend.inference import build_classification_model, build_segmentation_model
+
+    torch.manual_seed(0)
+    return build_segmentation_model().eval(), build_classification_model().eval()
+
+
+@pytest.fixture
+def wound_image():
+    """A small skin-toned photo with a reddish patch, as PNG bytes"""
+    np = pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+    rng = np.random.default_rng(0)
+    pixels = np.clip(np.array([224, 172, 150]) + rng.normal(0, 8, (60, 80, 3)), 0, 255)
+    pixels[20:40, 25:55] = (170, 40, 45)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
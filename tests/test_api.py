@@ -0,0 +1,111 @@
+import asyncio
+import io
+import threading
+import time
+import weakref
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("aiohttp")
+pytest.importorskip("torch")
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from app import api
+from backend.jobs import JobManager
+
+
+class Service(api.AnalysisService):
+    """The HTTP service over a job pool whose analyses are scripted instead of run by the models"""
+
+    def __init__(self, workers=None):
+        self.jobs = JobManager(workers=2)
+        self.models = {}
+        self.images = weakref.WeakKeyDictionary()
+        self.submitted = []
+        self.release = threading.Event()
+
+    def submit(self, data, include_gradcam=False, depth=None, check_quality=True):
+        self.submitted.append(data)
+        return self.jobs.submit(self._analyze, ("analysis",), data)
+
+    def _analyze(self, job, data):
+        with job.stage("analysis"):
+            if data == b"slow":
+                self.release.wait(10)
+            job.publish("analysis", {"wound_class": "Burn", "mask": np.ones((2, 3), dtype=np.uint8)})
+
+    def close(self):
+        self.release.set()
+        super().close()
+
+
+def serve(monkeypatch, test):
+    """Run test(client, service) against the API app on a local test server"""
+    monkeypatch.setattr(api, "AnalysisService", Service)
+
+    async def main():
+        async with TestClient(TestServer(api.create_app())) as client:
+            await test(client, client.app["service"])
+
+    asyncio.run(main())
+
+
+def test_analysis_jobs_report_status_and_serve_array_artifacts(monkeypatch):
+    async def test(client, service):
+        response = await client.post("/v1/analyze?wait=5", data=b"photo")
+        assert response.status == 200
+        state = await response.json()
+        assert response.headers["Location"] == f"/v1/jobs/{state['id']}"
+        assert state["status"] == "done" and state["report_url"] == f"/v1/jobs/{state['id']}/report"
+        mask = state["results"]["analysis"]["mask"]
+        assert mask == {"artifact": f"/v1/jobs/{state['id']}/results/analysis/mask", "dtype": "|u1", "shape": [2, 3]}
+
+        response = await client.get(mask["artifact"])
+        assert response.status == 200 and response.content_type == "application/x-npy"
+        np.testing.assert_array_equal(np.load(io.BytesIO(await response.read())), np.ones((2, 3)))
+        assert (await client.get(f"/v1/jobs/{state['id']}/results/analysis/wound_class")).status == 404
+        assert (await client.get("/v1/jobs/no-such-job")).status == 404
+        assert (await client.post("/v1/analyze", data=b"")).status == 400
+
+    serve(monkeypatch, test)
+
+
+@pytest.mark.parametrize("query", ["wait=abc", "wait=nan", "wait=", "depth=exhaustive", "k=3&wait=NaN"])
+def test_bad_query_parameters_are_rejected_before_a_job_starts(monkeypatch, query):
+    async def test(client, service):
+        response = await client.post(f"/v1/analyze?{query}", data=b"photo")
+        assert response.status == 400
+        assert service.submitted == []
+
+    serve(monkeypatch, test)
+
+
+def test_job_status_rejects_bad_waits_and_clamps_the_rest(monkeypatch):
+    monkeypatch.setattr(api, "MAX_WAIT", 0.2)
+
+    async def test(client, service):
+        state = await (await client.post("/v1/analyze", data=b"slow")).json()
+        url = f"/v1/jobs/{state['id']}"
+        for wait in ("abc", "nan", "-nan"):
+            assert (await client.get(f"{url}?wait={wait}")).status == 400
+        for wait in ("1e9", "inf", "-5"):
+            start = time.perf_counter()
+            response = await client.get(f"{url}?wait={wait}")
+            assert response.status == 200 and time.perf_counter() - start < 2
+            assert (await response.json())["status"] in ("pending", "running")
+        service.release.set()
+        assert (await (await client.get(f"{url}?wait=0.2")).json())["status"] in ("running", "done")
+
+    serve(monkeypatch, test)
+
+
+def test_similar_cases_validate_k(monkeypatch):
+    async def test(client, service):
+        state = await (await client.post("/v1/analyze?wait=5", data=b"photo")).json()
+        url = f"/v1/jobs/{state['id']}/similar"
+        assert (await client.get(f"{url}?k=many")).status == 400
+        assert (await client.get(f"{url}?k=0")).status == 400
+
+    serve(monkeypatch, test)
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("cv2")
+Image = pytest.importorskip("PIL.Image")
+
+from backend import batch, config, utils
+from backend.batch import JsonlWriter, analyze_decoded, decode_image, run_batch
+from backend.inference import ModelRegistry
+
+
+def write_photos(directory, count=2):
+    directory.mkdir(exist_ok=True)
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        pixels = rng.integers(120, 230, (48, 64, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(directory / f"photo-{i}.png")
+    return directory
+
+
+@pytest.fixture
+def registry(tiny_models, monkeypatch):
+    segmentation, classification = tiny_models
+    registry = ModelRegistry()
+    registry.register("segmentation", lambda: segmentation)
+    registry.register("classification", lambda: classification)
+    monkeypatch.setattr(batch, "get_registry", lambda: registry)
+    return registry
+
+
+def test_scale_is_detected_after_segmentation_with_the_mask(tmp_path, tiny_models, monkeypatch):
+    path = str(write_photos(tmp_path / "photos", 1) / "photo-0.png")
+    item = decode_image(path)
+    assert "error" not in item and "mm_per_pixel" not in item
+
+    calls = []
+    monkeypatch.setattr(config, "SCALE_DETECTION", True)
+    monkeypatch.setattr(utils, "detect_scale", lambda image, mask: calls.append((image, mask)) or 0.5)
+    [record] = analyze_decoded([item], *tiny_models)
+    [(image, mask)] = calls
+    assert image is item["pixels"] and mask.shape == item["pixels"].shape[:2]
+    assert record["metrics"]["mm_per_pixel"] == 0.5 and "area_cm2" in record["metrics"]
+
+
+def test_unreadable_images_become_error_records(tmp_path):
+    path = tmp_path / "broken.png"
+    path.write_bytes(b"not an image")
+    item = decode_image(str(path))
+    assert set(item) == {"path", "error"} and item["error"].startswith("UnidentifiedImageError")
+
+
+def test_jsonl_resume_skips_done_and_retries_failed(tmp_path):
+    output = tmp_path / "results.jsonl"
+    writer = JsonlWriter(str(output))
+    writer.write([{"path": "a.png", "metrics": {}}, {"path": "b.png", "error": "OSError: truncated"}])
+    writer.close()
+    with open(output, "a") as f:
+        f.write('{"path": "c.png", "metr')
+    assert JsonlWriter(str(output)).done == {"a.png"}
+    assert [json.loads(line)["path"] for line in output.read_text().splitlines()] == ["a.png", "b.png"]
+
+
+def test_rerun_retries_failures_and_skips_done_images(tmp_path, registry):
+    photos = write_photos(tmp_path / "photos")
+    (photos / "photo-2.png").write_bytes(b"not yet copied")
+    output = str(tmp_path / "results.jsonl")
+
+    stats = run_batch(str(photos), output, batch_size=2, workers=1)
+    assert (stats["processed"], stats["failed"], stats["skipped"]) == (2, 1, 0)
+
+    write_photos(tmp_path / "fixed", 3)
+    (photos / "photo-2.png").write_bytes((tmp_path / "fixed" / "photo-2.png").read_bytes())
+    stats = run_batch(str(photos), output, batch_size=2, workers=1)
+    assert (stats["processed"], stats["failed"], stats["skipped"]) == (1, 0, 2)
+    assert run_batch(str(photos), output, workers=1)["skipped"] == 3
+
+
+def test_parquet_parts_share_one_schema(tmp_path, registry, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    photos = write_photos(tmp_path / "photos")
+    (photos / "photo-2.png").write_bytes(b"not an image")
+    output = str(tmp_path / "results.parquet")
+    # The first batch is calibrated and the second is not
+    scales = iter([0.5, None])
+    monkeypatch.setattr(config, "SCALE_DETECTION", True)
+    monkeypatch.setattr(utils, "detect_scale", lambda image, mask: next(scales))
+
+    run_batch(str(photos), output, format="parquet", batch_size=1, workers=1)
+    parts = sorted((tmp_path / "results.parquet").glob("part-*.parquet"))
+    assert len(parts) == 3
+    schemas = {str(pq.read_schema(part)) for part in parts}
+    assert len(schemas) == 1
+    table = pq.read_table(parts).to_pydict()
+    assert table["metric_area_cm2"][0] is not None and table["metric_area_px"][0] is None
+    assert table["metric_area_px"][1] is not None and table["metric_area_cm2"][1] is None
+    assert table["error"][:2] == [None, None] and table["error"][2].startswith("UnidentifiedImageError")
+
+    assert batch.ParquetWriter(output).done == {str(photos / "photo-0.png"), str(photos / "photo-1.png")}
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("numpy")
+
+from backend.batching import MicroBatcher, QueueFullError, bucket_shape, pad_to
+
+
+def sums(batch, shapes):
+    # One result per item, computed over its unpadded area
+    return [batch[i, :, :h, :w].sum().item() for i, (h, w) in enumerate(shapes)]
+
+
+def test_bucket_shapes_and_padding():
+    assert bucket_shape((100, 64), 32) == (128, 64)
+    padded = pad_to(torch.ones(3, 30, 20), (32, 32))
+    assert padded.shape == (3, 32, 32)
+    assert padded.sum() == 3 * 30 * 20
+
+
+def test_concurrent_requests_share_batches_and_get_their_own_results():
+    seen = []
+
+    def forward(batch, shapes):
+        seen.append(batch.shape[0])
+        return sums(batch, shapes)
+
+    batcher = MicroBatcher(forward, max_batch_size=4, max_latency_ms=200)
+    try:
+        tensors = [torch.full((1, 8 + i % 2, 8), float(i)) for i in range(8)]
+        results = [None] * len(tensors)
+        start = threading.Barrier(len(tensors))
+
+        def submit(i):
+            start.wait()
+            results[i] = batcher.submit(tensors[i]).result(timeout=10)
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(tensors))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [t.sum().item() for t in tensors]
+        assert sum(seen) == 8 and max(seen) > 1
+        snapshot = batcher.metrics.snapshot()
+        assert snapshot["requests"] == 8
+        assert snapshot["mean_batch_size"] > 1
+    finally:
+        batcher.close()
+
+
+def test_forward_errors_reach_every_caller_in_the_batch():
+    def forward(batch, shapes):
+        raise RuntimeError("out of memory")
+
+    batcher = MicroBatcher(forward, max_batch_size=2, max_latency_ms=50)
+    try:
+        futures = [batcher.submit(torch.zeros(1, 4, 4)) for _ in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="out of memory"):
+                future.result(timeout=10)
+        assert batcher.metrics.snapshot()["errors"] >= 1
+    finally:
+        batcher.close()
+
+
+def test_full_queue_rejects_without_waiting():
+    release = threading.Event()
+
+    def forward(batch, shapes):
+        release.wait(10)
+        return sums(batch, shapes)
+
+    batcher = MicroBatcher(forward, max_batch_size=1, max_latency_ms=0, max_queue_depth=1)
+    try:
+        first = batcher.submit(torch.zeros(1, 4, 4))
+        # Wait until the worker holds the first request, so the next one fills the queue
+        while batcher.queue_depth:
+            pass
+        second = batcher.submit(torch.zeros(1, 4, 4))
+        with pytest.raises(QueueFullError):
+            batcher.submit(torch.zeros(1, 4, 4), timeout=0)
+        assert batcher.metrics.snapshot()["rejected"] == 1
+        release.set()
+        assert first.result(timeout=10) == 0.0 and second.result(timeout=10) == 0.0
+    finally:
+        release.set()
+        batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(torch.zeros(1, 4, 4))
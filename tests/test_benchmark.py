@@ -0,0 +1,55 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("cv2")
+pytest.importorskip("PIL.Image")
+
+from backend import benchmark
+from backend.budgets import BASIC, BUDGETS, DETAILED
+
+
+def row(stage, p50, p95=None, image_size=512, batch_size=1):
+    return {"stage": stage, "image_size": image_size, "batch_size": batch_size, "p50_ms": p50, "p95_ms": p95 or p50}
+
+
+def test_synthetic_wound_has_a_matching_mask():
+    image, mask = benchmark.synthetic_wound(96)
+    assert image.size == (128, 96)
+    assert mask.shape == (96, 128)
+    assert 0.05 < mask.mean() < 0.5
+    pixels = np.asarray(image, dtype=np.float32)
+    # The wound is redder than the skin around it
+    assert pixels[mask == 1, 1].mean() < pixels[mask == 0, 1].mean() - 50
+
+
+def test_run_benchmark_reports_each_requested_stage(tiny_models):
+    report = benchmark.run_benchmark(
+        sizes=(64,), batch_sizes=(1, 2), repeats=2, stages=("preprocess", "measurement", "segmentation")
+    )
+    stages = [(r["stage"], r["image_size"], r["batch_size"]) for r in report["results"]]
+    assert stages == [("preprocess", 64, 1), ("measurement", 64, 1), ("segmentation", 64, 1), ("segmentation", 64, 2)]
+    for result in report["results"]:
+        assert result["repeats"] == 2
+        assert 0 <= result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+        assert result["throughput_per_s"] > 0
+    assert report["environment"]["input_size"] == 64
+    assert "segmentation" in benchmark.format_table(report)
+
+
+def test_compare_flags_changes_beyond_the_tolerance():
+    baseline = {"results": [row("decode", 10.0), row("overlay", 20.0), row("report", 5.0)]}
+    current = {"results": [row("decode", 10.5), row("overlay", 30.0), row("report", 4.0), row("llm", 1.0)]}
+    changes = benchmark.compare(baseline, current, tolerance=0.1)
+    assert [(c["stage"], round(c["ratio"], 2)) for c in changes] == [("overlay", 1.5), ("report", 0.8)]
+
+
+def test_check_targets_uses_the_target_image_size():
+    basic, detailed = BUDGETS[BASIC].latency_target_ms, BUDGETS[DETAILED].latency_target_ms
+    report = {"results": [
+        row("analysis_basic", 1.0, basic * 2, image_size=512),
+        row("analysis_basic", 1.0, basic / 2, image_size=benchmark.TARGET_IMAGE_SIZE),
+        row("analysis_detailed", 1.0, detailed * 2, image_size=1024),
+    ]}
+    misses = benchmark.check_targets(report)
+    assert [(m["depth"], m["image_size"]) for m in misses] == [(DETAILED, 1024)]
@@ -0,0 +1,40 @@
+import pytest
+
+from backend.budgets import BASIC, BUDGETS, DEPTHS, DETAILED, STANDARD, get_budget
+
+
+def test_default_is_standard():
+    assert get_budget() is BUDGETS[STANDARD]
+    assert get_budget(None).name == STANDARD
+    assert get_budget(BUDGETS[BASIC]) is BUDGETS[BASIC]
+
+
+def test_unknown_level_is_rejected():
+    with pytest.raises(ValueError, match="expected one of Basic, Standard, Detailed"):
+        get_budget("Extreme")
+
+
+def test_levels_are_ordered_by_cost():
+    assert DEPTHS == (BASIC, STANDARD, DETAILED)
+    targets = [BUDGETS[name].latency_target_ms for name in DEPTHS]
+    assert targets == sorted(targets)
+
+
+def test_basic_skips_segmentation_gradcam_and_the_llm():
+    basic = get_budget(BASIC)
+    assert basic.max_side is not None
+    assert not basic.segmentation and not basic.llm
+    assert basic.gradcam is None
+
+
+def test_detailed_is_tiled_with_tta_and_exact_gradcam():
+    detailed = get_budget(DETAILED)
+    assert detailed.max_side is None
+    assert detailed.tiled and detailed.tta
+    assert detailed.gradcam == "exact"
+
+
+def test_only_non_default_levels_get_their_own_cache_entries():
+    assert get_budget(STANDARD).cache_variant is None
+    assert get_budget(BASIC).cache_variant == "basic"
+    assert get_budget(DETAILED).cache_variant == "detailed"
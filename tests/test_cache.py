@@ -0,0 +1,113 @@
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL.Image")
+
+from backend import config
+from backend.cache import ResultCache, content_hash, get_result_cache, model_version
+from backend.images import DecodedImage
+
+
+def analysis(seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        "mask": (rng.random((16, 24)) > 0.5).astype(np.uint8),
+        "probabilities": rng.random(4).astype(np.float32),
+        "wound_class": "Burn",
+        "class_index": 1,
+        "recommendations": ["Cool the burn under running water"],
+        "metrics": {"area_px": 120.0},
+        "gradcam": None,
+    }
+
+
+def assert_same(entry, expected):
+    assert set(entry) == set(expected)
+    for name, value in expected.items():
+        if isinstance(value, np.ndarray):
+            assert entry[name].dtype == value.dtype
+            np.testing.assert_array_equal(entry[name], value)
+        else:
+            assert entry[name] == value
+
+
+def test_disk_round_trip_keeps_arrays_and_fields(tmp_path):
+    expected = analysis()
+    ResultCache(str(tmp_path), memory_bytes=0).put("v1/abc", expected)
+    cache = ResultCache(str(tmp_path))
+    assert_same(cache.get("v1/abc"), expected)
+    # Promoted to memory on the disk hit
+    cache.get("v1/abc")
+    assert cache.stats()["disk_hits"] == 1 and cache.stats()["memory_hits"] == 1
+
+
+def test_misses_are_computed_once(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.hit_rate() is None
+    assert cache.get("v1/missing") is None
+    computed = cache.get_or_compute("v1/abc", analysis)
+    assert_same(cache.get_or_compute("v1/abc", lambda: pytest.fail("recomputed")), computed)
+    assert cache.stats()["misses"] == 2 and cache.stats()["memory_hits"] == 1
+    assert cache.hit_rate() == pytest.approx(1 / 3)
+
+
+def test_entries_are_copies(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("v1/abc", analysis())
+    cache.get("v1/abc")["wound_class"] = "Changed"
+    assert cache.get("v1/abc")["wound_class"] == "Burn"
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    size = analysis()["mask"].nbytes + analysis()["probabilities"].nbytes + 5 * 64
+    cache = ResultCache(str(tmp_path), memory_bytes=2 * size)
+    for name in ("a", "b", "c"):
+        cache.put(f"v1/{name}", analysis())
+    assert cache.stats()["memory_entries"] == 2
+    cache.get("v1/a")
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_invalidate_drops_other_versions(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("old/abc", analysis())
+    cache.put("new/abc", analysis())
+    cache.invalidate("new")
+    assert cache.get("old/abc") is None
+    assert cache.get("new/abc") is not None
+
+
+def test_refresh_only_invalidates_when_the_version_changes(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    current = f"{model_version()}/abc"
+    cache.put(current, analysis())
+    assert not cache.refresh()
+    assert not cache.refresh()
+    assert cache.get(current) is not None
+
+    monkeypatch.setattr(config, "MASK_THRESHOLD", config.MASK_THRESHOLD + 0.1)
+    assert cache.refresh()
+    assert cache.get(current) is None
+    assert not cache.refresh()
+
+    # After a restart, entries from another version on disk are purged
+    cache.put("old/abc", analysis())
+    assert ResultCache(str(tmp_path)).refresh()
+    assert ResultCache(str(tmp_path)).get("old/abc") is None
+
+
+def test_keys_follow_content_version_and_variant(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    data = b"same photo bytes"
+    assert content_hash(data) == content_hash(io.BytesIO(data)) == DecodedImage(data).sha256
+    key = cache.key(data)
+    assert key == f"{model_version()}/{content_hash(data)}"
+    assert cache.key(data, variant="basic") == key + "-basic"
+    monkeypatch.setattr(config, "INPUT_SIZE", config.INPUT_SIZE * 2)
+    assert cache.key(data) != key
+
+
+def test_default_cache_uses_the_configured_directory(isolated_data):
+    assert get_result_cache().directory == str(isolated_data / "results" / "cache")
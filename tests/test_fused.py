@@ -0,0 +1,54 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+np = pytest.importorskip("numpy")
+
+from backend.images import DecodedImage
+from backend.inference import (
+    backbones_match,
+    build_fused_model,
+    compare_fused,
+    run_fused_inference,
+    run_inference,
+    tie_backbone,
+)
+
+
+def test_tied_backbone_takes_the_shared_path(tiny_models):
+    segmentation, classification = tiny_models
+    assert not backbones_match(segmentation, classification)
+    tie_backbone(segmentation, classification)
+    assert backbones_match(segmentation, classification)
+    assert build_fused_model(segmentation, classification, roi_crop=False).share_backbone
+
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_fused_matches_two_model_path(tiny_models, wound_image, shared):
+    segmentation, classification = tiny_models
+    if shared:
+        tie_backbone(segmentation, classification)
+    fused = build_fused_model(segmentation, classification, roi_crop=False)
+    assert fused.share_backbone == shared
+    image = DecodedImage(wound_image).image()
+
+    reference = run_inference(image, segmentation, classification)
+    result = run_fused_inference(image, fused)
+
+    np.testing.assert_array_equal(result["mask"], reference["mask"])
+    np.testing.assert_allclose(result["probabilities"], reference["probabilities"], atol=1e-5)
+    assert result["class_index"] == reference["class_index"]
+
+
+def test_compare_fused_report(tiny_models, wound_image):
+    segmentation, classification = tiny_models
+    tie_backbone(segmentation, classification)
+    image = DecodedImage(wound_image).image()
+
+    report = compare_fused([image, image.rotate(90, expand=True)], segmentation, classification, repeats=1)
+
+    assert report["images"] == 2
+    assert report["share_backbone"]
+    assert report["mean_dice"] == pytest.approx(1.0)
+    assert report["top1_agreement"] == 1.0
+    assert report["max_probability_diff"] < 1e-4
+    assert report["two_model_ms"] > 0 and report["fused_ms"] > 0
@@ -0,0 +1,83 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+
+from backend import config
+from backend.budgets import STANDARD
+from backend.images import DecodedImage
+
+
+def test_recorded_activations_match_a_fresh_pass(tiny_models, wound_image, monkeypatch):
+    from backend.gradcam import combine_layers, compute_gradcam, gradcam_from_activations
+    from backend.inference import classify_image
+
+    monkeypatch.setattr(config, "SIMILAR_CASES", True)
+    _, classification_model = tiny_models
+    image = DecodedImage(wound_image)
+    result = classify_image(image, classification_model)
+    activations = {k: v for k, v in result["activations"].items() if k in config.GRADCAM_LAYERS}
+    reused = combine_layers(gradcam_from_activations(classification_model, activations, [result["class_index"]])[
+        result["class_index"]])
+    fresh = compute_gradcam(image, classification_model, result["class_index"])
+    assert fresh.shape == (config.INPUT_SIZE, config.INPUT_SIZE)
+    np.testing.assert_allclose(reused, fresh, atol=1e-5)
+
+
+def test_exact_gradcam_without_activations_with_similar_cases(tiny_models, wound_image, monkeypatch):
+    # Fused and non-eager backends record no activations, so Grad-CAM runs the backbone again
+    from app import routes
+
+    monkeypatch.setattr(config, "SIMILAR_CASES", True)
+    _, classification_model = tiny_models
+    monkeypatch.setattr(routes, "get_reference_model", lambda name: classification_model)
+    image = DecodedImage(wound_image)
+    analysis = {
+        "mask": np.zeros((image.height, image.width), dtype=np.uint8),
+        "class_index": 1,
+        "depth": STANDARD,
+        "gradcam": None,
+        "gradcam_mode": None,
+    }
+    analysis = routes.with_exact_gradcam(image, analysis)
+    assert analysis["gradcam_mode"] == "gradcam"
+    assert analysis["gradcam"].shape == (config.INPUT_SIZE, config.INPUT_SIZE)
+    assert 0.0 <= analysis["gradcam"].min() and analysis["gradcam"].max() <= 1.0
+    assert len(analysis["gradcam_display"]) > 0
+
+
+class TemplateLLM:
+    def generate_recommendations(self, wound_class, risk_level, metrics=None, **kwargs):
+        return ["Keep the wound clean"], "A template reply."
+
+
+def test_score_cam_needs_a_recorded_activation(tiny_models):
+    from backend.gradcam import score_cam
+
+    _, classification_model = tiny_models
+    tensor = torch.zeros(1, 3, config.INPUT_SIZE, config.INPUT_SIZE)
+    with pytest.raises(ValueError, match="recorded layer activation"):
+        score_cam(classification_model, tensor, None, 0)
+
+
+def test_approximate_heatmap_is_skipped_with_a_note_when_nothing_was_recorded(tiny_models, wound_image, monkeypatch):
+    from app.routes import run_analysis
+    from backend.jobs import SKIPPED, Job
+
+    monkeypatch.setattr(config, "GRADCAM_APPROXIMATE", True)
+    monkeypatch.setattr(config, "SIMILAR_CASES", False)
+    # Separate segmentation and classification passes, on the models given
+    monkeypatch.setattr(config, "BATCHING_ENABLED", False)
+    monkeypatch.setattr(config, "FUSED_INFERENCE", False)
+    segmentation_model, classification_model = tiny_models
+    example = torch.zeros(1, 3, config.INPUT_SIZE, config.INPUT_SIZE)
+    models = {"eager": classification_model, "torchscript": torch.jit.trace(classification_model, example)}
+    analyses = {}
+    for name, model in models.items():
+        job = Job(("segmentation", "classification", "measurement", "gradcam", "llm", "report"))
+        analyses[name] = run_analysis(job, DecodedImage(wound_image), segmentation_model, model, TemplateLLM(),
+                                      use_cache=False, depth=STANDARD)
+    assert analyses["eager"]["gradcam_mode"] == "scorecam" and analyses["eager"]["gradcam_note"] is None
+    assert analyses["torchscript"]["gradcam"] is None and job.snapshot()["stages"]["gradcam"] == SKIPPED
+    assert analyses["torchscript"]["gradcam_note"].startswith("No approximate heatmap")
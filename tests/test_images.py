@@ -0,0 +1,105 @@
+import hashlib
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from backend import config
+from backend.images import DecodedImage, resize_mask
+from backend.uploads import UploadStore
+
+
+def photo_bytes(width=120, height=80, orientation=None, format="JPEG"):
+    """An encoded photo, left half dark and right half light, optionally with an EXIF orientation"""
+    pixels = np.full((height, width, 3), 200, dtype=np.uint8)
+    pixels[:, :width // 2] = 40
+    image = Image.fromarray(pixels)
+    buffer = io.BytesIO()
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(buffer, format, exif=exif)
+    else:
+        image.save(buffer, format)
+    return buffer.getvalue()
+
+
+def test_header_is_read_without_decoding():
+    image = DecodedImage(photo_bytes(orientation=6))
+    # Rotated 90 degrees by its EXIF orientation
+    assert image.size == (80, 120)
+    assert image.format == "JPEG"
+    assert image._image is None
+    assert image.sha256 == hashlib.sha256(image.data).hexdigest()
+
+
+def test_decodes_once_upright_and_read_only():
+    image = DecodedImage(photo_bytes(orientation=6))
+    decoded = image.image()
+    assert decoded.size == image.size and decoded.mode == "RGB"
+    assert image.image() is decoded
+    pixels = image.pixels()
+    assert pixels is image.pixels()
+    assert not pixels.flags.writeable
+    # Orientation 6 turns the dark left half into the top half
+    assert pixels[:40].mean() < 100 < pixels[80:].mean()
+
+
+def test_thumbnails_fit_and_are_reused():
+    image = DecodedImage(photo_bytes(640, 480))
+    thumbnail = image.thumbnail(100)
+    assert max(thumbnail.size) <= 100 and thumbnail.size[0] > thumbnail.size[1]
+    assert image._image is None
+    assert image.thumbnail(100) is thumbnail
+    # Once the full image is decoded, new sizes are resized from it
+    image.image()
+    assert image.thumbnail(50).size == (50, 38)
+    image.release()
+    assert image._image is None and image._thumbnails == {}
+    assert image.pixels().shape == (480, 640, 3)
+
+
+def test_from_upload_accepts_bytes_files_and_paths(tmp_path):
+    data = photo_bytes(format="PNG")
+    path = tmp_path / "photo.png"
+    path.write_bytes(data)
+    upload = io.BytesIO(data)
+    upload.name = "upload.png"
+    images = [DecodedImage.from_upload(source) for source in (data, upload, str(path))]
+    assert {image.sha256 for image in images} == {hashlib.sha256(data).hexdigest()}
+    assert images[1].name == "upload.png" and images[2].name == str(path)
+    assert DecodedImage.from_upload(images[0]) is images[0]
+    assert images[0].getvalue() == bytes(images[0].getbuffer()) == data and len(images[0]) == len(data)
+
+
+@pytest.mark.parametrize("mmap_min_mb", [64, 0], ids=["read", "memory_mapped"])
+def test_decodes_after_its_stored_file_is_evicted(tmp_path, monkeypatch, mmap_min_mb):
+    monkeypatch.setattr(config, "UPLOAD_MMAP_MIN_MB", mmap_min_mb)
+    data = photo_bytes(format="PNG")
+    store = UploadStore(str(tmp_path / "store"), max_bytes=len(data), max_age=0)
+    image = DecodedImage.from_upload(store.put(data, "photo.png"))
+    # A second upload pushes the first one out of the size budget
+    store.put(photo_bytes(64, 64, format="PNG"), "other.png")
+    assert store.find(image.sha256) is None
+    assert image.size == (120, 80)
+    assert image.thumbnail(60).size == (60, 40)
+    assert image.pixels().shape == (80, 120, 3)
+
+
+def test_load_image_reuses_the_decoded_image():
+    pytest.importorskip("torch")
+    from backend.inference import load_image
+
+    image = DecodedImage(photo_bytes())
+    assert load_image(image) is image.image()
+
+
+def test_resize_mask_is_nearest_neighbour():
+    mask = np.zeros((4, 6), dtype=np.uint8)
+    mask[:, 3:] = 1
+    resized = resize_mask(mask, (12, 8))
+    assert resized.shape == (8, 12) and set(np.unique(resized)) == {0, 1}
+    assert resized[:, 6:].all() and not resized[:, :6].any()
+    assert resize_mask(mask, (6, 4)) is mask
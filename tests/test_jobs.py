@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from backend.jobs import CANCELLED, DONE, FAILED, PENDING, SKIPPED, TIMED_OUT, Job, JobCancelled, JobManager
+
+STAGES = ("first", "second")
+
+
+@pytest.fixture
+def manager():
+    manager = JobManager(workers=2)
+    yield manager
+    manager.shutdown()
+
+
+def test_stages_progress_and_results(manager):
+    def work(job):
+        with job.stage("first"):
+            job.publish("partial", 1)
+        job.skip("second")
+
+    job = manager.submit(work, STAGES)
+    assert job.wait(5)
+    state = job.snapshot()
+    assert state["status"] == DONE
+    assert state["progress"] == 1.0
+    assert state["stages"] == {"first": DONE, "second": SKIPPED}
+    assert state["results"] == {"partial": 1}
+    assert manager.get(job.id) is job
+
+
+def test_snapshot_is_a_copy():
+    job = Job(STAGES)
+    state = job.snapshot()
+    job.publish("partial", 1)
+    assert state["results"] == {}
+    assert state["stages"] == {"first": PENDING, "second": PENDING}
+    assert job.progress == 0.0
+
+
+def test_failure_keeps_the_error(manager):
+    def work(job):
+        raise ValueError("bad image")
+
+    job = manager.submit(work, STAGES)
+    assert job.wait(5)
+    assert job.status == FAILED
+    assert job.error == "ValueError: bad image"
+
+
+def test_cancel_stops_at_the_next_stage(manager):
+    started, release = threading.Event(), threading.Event()
+    reached = []
+
+    def work(job):
+        with job.stage("first"):
+            started.set()
+            release.wait(5)
+        with job.stage("second"):
+            reached.append("second")
+
+    job = manager.submit(work, STAGES)
+    assert started.wait(5)
+    assert manager.cancel(job.id)
+    release.set()
+    assert job.wait(5)
+    manager.shutdown()
+    assert job.status == CANCELLED
+    assert reached == []
+    # A finished job can't be cancelled again
+    assert not job.cancel()
+
+
+def test_deadline_times_out_and_stops_the_job():
+    job = Job(STAGES, timeout=0.01)
+    time.sleep(0.02)
+    with pytest.raises(JobCancelled):
+        job.check()
+    assert job.status == TIMED_OUT
+    assert job.snapshot()["error"].startswith("Timed out")
+
+
+def test_zero_timeout_never_expires():
+    job = Job(STAGES, timeout=0)
+    assert job.deadline is None
+    job.check()
+    assert job.status == PENDING
+
+
+def test_finished_jobs_are_pruned_after_retention():
+    manager = JobManager(workers=1, retention=0)
+    try:
+        old = manager.submit(lambda job: None, STAGES)
+        assert old.wait(5)
+        time.sleep(0.01)
+        new = manager.submit(lambda job: None, STAGES)
+        assert manager.get(old.id) is None
+        assert manager.get(new.id) is new
+    finally:
+        manager.shutdown()
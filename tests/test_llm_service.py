@@ -0,0 +1,122 @@
+import threading
+import time
+
+from backend.llm_service import TEMPLATE_RECOMMENDATIONS, WoundLLM, cache_key, parse_reply
+
+REPLY = ["- Cool the burn\n", "- Cover it loosely\n", "Explanation: A small burn.\n"]
+
+
+def scripted_llm(replies):
+    """A WoundLLM whose stream() plays the given callables' chunks in turn, one per request"""
+    llm = WoundLLM(url="http://llm.invalid/v1/chat/completions")
+    calls = iter(replies)
+    llm.stream = lambda prompt: next(calls)()
+    return llm
+
+
+def test_replies_are_cached_by_structured_inputs():
+    requests = []
+
+    def reply():
+        requests.append(1)
+        yield from REPLY
+
+    llm = scripted_llm([reply, reply])
+    first = llm.generate_recommendations("Burn", "High", {"area": 100.0})
+    # Binned to the same power of two, so the cached reply is served
+    second = llm.generate_recommendations("Burn", "High", {"area": 110.0})
+    assert first == second == (["Cool the burn", "Cover it loosely"], "A small burn.")
+    assert len(requests) == 1
+    assert llm.stats["hits"] == 1
+    assert cache_key("Burn", "High", {"area": 100.0}) == cache_key("Burn", "High", {"area": 110.0})
+
+
+def test_fallback_advice_is_not_cached():
+    def unreachable():
+        raise OSError("connection refused")
+        yield
+
+    def reply():
+        yield from REPLY
+
+    llm = scripted_llm([unreachable, reply])
+    recommendations, _ = llm.generate_recommendations("Burn", "High")
+    assert recommendations == TEMPLATE_RECOMMENDATIONS["Burn"]
+    # The LLM is asked again once it answers
+    assert llm.generate_recommendations("Burn", "High")[0] == ["Cool the burn", "Cover it loosely"]
+    assert llm.stats["misses"] == 2
+    assert llm.generate_recommendations("Burn", "High")[0] == ["Cool the burn", "Cover it loosely"]
+    assert llm.stats["hits"] == 1
+
+
+def test_followers_get_the_whole_reply_when_the_leader_stops_reading():
+    release = threading.Event()
+
+    def reply():
+        yield REPLY[0]
+        release.wait(5)
+        yield from REPLY[1:]
+
+    llm = scripted_llm([reply])
+    leader = llm.stream_recommendations("Burn", "High")
+    assert next(leader) == REPLY[0]
+
+    followed = []
+    follower = threading.Thread(target=lambda: followed.extend(llm.stream_recommendations("Burn", "High")))
+    follower.start()
+    deadline = time.monotonic() + 5
+    while llm.stats["coalesced"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    leader.close()
+    release.set()
+    follower.join(5)
+    assert "".join(followed) == "".join(REPLY)
+    # The reply finished in the background and was cached
+    assert parse_reply("".join(llm.stream_recommendations("Burn", "High")))[1] == "A small burn."
+    assert llm.stats["hits"] == 1
+
+
+def test_abandoned_reply_without_followers_is_dropped():
+    def reply():
+        yield from REPLY
+
+    llm = scripted_llm([reply, reply])
+    leader = llm.stream_recommendations("Burn", "High")
+    next(leader)
+    leader.close()
+    assert llm.generate_recommendations("Burn", "High")[1] == "A small burn."
+    assert llm.stats["misses"] == 2
+
+
+def test_follower_sees_the_leaders_error():
+    release = threading.Event()
+
+    def failing():
+        yield REPLY[0]
+        release.wait(5)
+        raise OSError("stream reset")
+
+    llm = scripted_llm([failing])
+    errors = []
+
+    def follow():
+        try:
+            list(llm.stream_recommendations("Burn", "High"))
+        except OSError as exc:
+            errors.append(exc)
+
+    leader = llm.stream_recommendations("Burn", "High")
+    next(leader)
+    follower = threading.Thread(target=follow)
+    follower.start()
+    deadline = time.monotonic() + 5
+    while llm.stats["coalesced"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    try:
+        list(leader)
+    except OSError:
+        pass
+    follower.join(5)
+    assert len(errors) == 1
@@ -0,0 +1,125 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from backend import config
+from backend.utils import detect_scale, measure_masks, wound_metrics
+
+HEIGHT, WIDTH = 300, 400
+
+
+def skin(seed=0):
+    """Skin-toned photo with mild texture"""
+    rng = np.random.default_rng(seed)
+    pixels = np.array([214, 168, 148], dtype=np.float32) + rng.normal(0, 4, (HEIGHT, WIDTH, 3))
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def with_marker(pixels, side=50, top=30, left=300, color=(30, 30, 30)):
+    pixels = pixels.copy()
+    pixels[top:top + side, left:left + side] = color
+    return pixels
+
+
+def square_mask(side=60, top=150, left=120):
+    mask = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    mask[top:top + side, left:left + side] = 1
+    return mask
+
+
+def disk_mask(radius=30):
+    rows, cols = np.mgrid[:HEIGHT, :WIDTH]
+    return (np.hypot(rows - 150, cols - 150) <= radius).astype(np.uint8)
+
+
+def test_calibrated_measurements_are_in_mm_and_cm2():
+    [measurement] = measure_masks([disk_mask()], mm_per_pixel=[0.5])
+    assert measurement["units"] == "mm"
+    assert measurement["area"] == pytest.approx(np.pi * 30 ** 2 * 0.25, rel=0.02)
+    metrics = wound_metrics(disk_mask(), mm_per_pixel=0.5)
+    assert metrics["area_cm2"] == pytest.approx(np.pi * 15 ** 2 / 100, rel=0.02)
+    assert metrics["length_mm"] == pytest.approx(30, rel=0.05) and metrics["width_mm"] == pytest.approx(30, rel=0.05)
+    assert metrics["irregularity"] == pytest.approx(1.0, abs=0.05)
+    assert metrics["coverage"] == pytest.approx(disk_mask().mean())
+
+
+def test_uncalibrated_measurements_stay_in_pixels():
+    metrics = wound_metrics(disk_mask(), skin())
+    assert "area_cm2" not in metrics and "mm_per_pixel" not in metrics
+    assert metrics["area_px"] == pytest.approx(np.pi * 30 ** 2, rel=0.02)
+    assert metrics["perimeter_px"] == pytest.approx(2 * np.pi * 30, rel=0.05)
+
+
+def test_scale_detection_is_off_by_default():
+    assert not config.SCALE_DETECTION
+    metrics = wound_metrics(square_mask(), with_marker(skin()))
+    assert "area_px" in metrics
+
+
+def test_square_marker_gives_the_scale(monkeypatch):
+    photo = with_marker(skin())
+    assert detect_scale(photo, square_mask()) == pytest.approx(20 / 50, rel=0.05)
+    # Slightly out of focus, noisier and in dimmer light
+    blurred = cv2.GaussianBlur(photo.astype(np.float32) * 0.6, (0, 0), 1.0)
+    blurred += np.random.default_rng(1).normal(0, 4, blurred.shape)
+    assert detect_scale(np.clip(blurred, 0, 255).astype(np.uint8), square_mask()) == pytest.approx(0.4, rel=0.05)
+    monkeypatch.setattr(config, "SCALE_DETECTION", True)
+    metrics = wound_metrics(square_mask(), photo)
+    assert metrics["mm_per_pixel"] == pytest.approx(0.4, rel=0.05)
+    assert metrics["area_cm2"] == pytest.approx(3600 * 0.16 / 100, rel=0.1)
+
+
+def test_a_marker_under_the_wound_is_ignored():
+    photo = with_marker(skin(), top=150, left=120)
+    assert detect_scale(photo, square_mask(side=70, top=140, left=110)) is None
+
+
+def mole(pixels, seed=0):
+    """A brown, squarish spot with rounded corners, uneven pigment and a slightly soft edge"""
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[:HEIGHT, :WIDTH]
+    spot = (np.abs((rows - 60) / 22) ** 4 + np.abs((cols - 320) / 25) ** 4 <= 1).astype(np.float32)
+    spot = cv2.GaussianBlur(spot, (0, 0), 1.0)[..., None]
+    pigment = cv2.resize(rng.normal(0, 12, (6, 6)).astype(np.float32), (WIDTH, HEIGHT), interpolation=cv2.INTER_CUBIC)
+    color = np.array([95, 62, 48], dtype=np.float32) + pigment[..., None]
+    return np.clip(pixels * (1 - spot) + color * spot, 0, 255).astype(np.uint8)
+
+
+def eschar(pixels, seed=1):
+    """A dark, crusted, roughly square patch: dark on average but strongly textured"""
+    pixels = pixels.copy()
+    rng = np.random.default_rng(seed)
+    crust = cv2.resize(rng.normal(50, 30, (10, 10)).astype(np.float32), (50, 50), interpolation=cv2.INTER_CUBIC)
+    pixels[30:80, 300:350] = np.clip(crust, 0, 255)[..., None] * np.array([1.0, 0.8, 0.7])
+    return pixels
+
+
+def shadow(pixels):
+    """A soft-edged square shadow, e.g. from a dressing held over the skin"""
+    region = np.zeros((HEIGHT, WIDTH), dtype=np.float32)
+    region[30:80, 300:350] = 1.0
+    region = cv2.GaussianBlur(region, (0, 0), 6)
+    return np.clip(pixels * (1.0 - 0.6 * region[..., None]), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("lookalike", [
+    mole,
+    eschar,
+    shadow,
+    # A dark square covering much of the frame is not the 20 mm sticker
+    lambda pixels: with_marker(pixels, side=160, top=20, left=220),
+    # Nor is a speck a few pixels wide
+    lambda pixels: with_marker(pixels, side=6),
+    # Nor is a square that barely stands out from the skin
+    lambda pixels: with_marker(pixels, color=(180, 140, 125)),
+], ids=["mole", "eschar", "shadow", "too_large", "too_small", "low_contrast"])
+def test_marker_lookalikes_give_no_scale(lookalike):
+    assert detect_scale(lookalike(skin()), square_mask()) is None
+
+
+def test_disagreeing_markers_give_no_scale():
+    photo = with_marker(with_marker(skin()), side=25, top=220, left=30)
+    assert detect_scale(photo, square_mask()) is None
+    agreeing = with_marker(with_marker(skin()), side=51, top=220, left=30)
+    assert detect_scale(agreeing, square_mask()) == pytest.approx(0.4, rel=0.05)
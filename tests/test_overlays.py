@@ -0,0 +1,126 @@
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from backend import overlays
+from backend.images import DecodedImage
+from backend.overlays import (
+    CONTOUR_COLOR,
+    FILL_ALPHA,
+    FILL_COLOR,
+    HEAT_ALPHA,
+    OverlayCache,
+    composite,
+    contour,
+    display_image,
+    render_overlays,
+)
+
+
+def photo(height=90, width=130, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def photo_png():
+    buffer = io.BytesIO()
+    Image.fromarray(photo()).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def wound_mask(height=90, width=130):
+    rows, cols = np.mgrid[:height, :width]
+    return (((rows - height / 2) / (height / 3)) ** 2 + ((cols - width / 2) / (width / 4)) ** 2 <= 1).astype(np.uint8)
+
+
+def layered_blend(pixels, mask=None, heat=None, fill=True, edge=True):
+    """Reference: blend each layer over the whole image in turn, as separate passes would"""
+    out = pixels.astype(np.float64)
+    if heat is not None:
+        alpha = HEAT_ALPHA * heat[..., None]
+        color = np.stack([np.full_like(heat, 255.0), 255.0 * (1.0 - heat), np.zeros_like(heat)], axis=-1)
+        out = out * (1.0 - alpha) + alpha * color
+    if mask is not None and fill:
+        alpha = FILL_ALPHA * mask.astype(bool)[..., None]
+        out = out * (1.0 - alpha) + alpha * np.array(FILL_COLOR)
+    if mask is not None and edge:
+        out[contour(mask)] = CONTOUR_COLOR
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("layers", [
+    {"mask": True},
+    {"mask": True, "fill": False},
+    {"heat": True},
+    {"mask": True, "heat": True, "fill": False},
+    {"mask": True, "heat": True},
+])
+def test_one_pass_composite_matches_layered_blend(monkeypatch, layers):
+    # Bands that don't divide the height, so partial bands are covered
+    monkeypatch.setattr(overlays, "BAND_ROWS", 16)
+    pixels = photo()
+    mask = wound_mask() if layers.get("mask") else None
+    heat = None
+    if layers.get("heat"):
+        rows, cols = np.mgrid[:90, :130]
+        # Exactly representable in 8 bits so resizing to the same size is lossless
+        heat = np.round((rows + cols) / 218 * 255) / 255
+    fill = layers.get("fill", True)
+    result = composite(pixels, mask, heat, fill=fill)
+    assert result.dtype == np.uint8 and result.shape == pixels.shape
+    expected = layered_blend(pixels, mask, heat, fill=fill)
+    assert np.abs(result.astype(int) - expected).max() <= 1
+
+
+def test_mask_is_resized_to_the_photo():
+    pixels = photo()
+    small = wound_mask(45, 65)
+    full = np.asarray(Image.fromarray(small).resize((130, 90), Image.NEAREST))
+    np.testing.assert_array_equal(composite(pixels, small), composite(pixels, full))
+
+
+def test_contour_is_the_mask_boundary():
+    mask = np.zeros((10, 10), dtype=np.uint8)
+    mask[2:8, 2:8] = 1
+    edges = contour(mask, width=1)
+    assert edges.sum() == 20
+    assert not edges[3:7, 3:7].any() and not edges[mask == 0].any()
+
+
+def test_render_overlays_memoizes_layers_by_result(monkeypatch):
+    image = DecodedImage.from_upload(photo_png())
+    calls = []
+    encode = overlays.encode_layer
+    monkeypatch.setattr(overlays, "encode_layer", lambda *args: calls.append(args[1]) or encode(*args))
+    heat = np.full((8, 8), 0.5)
+
+    first = render_overlays(image, wound_mask(), heat, result_id="r1", gradcam_mode="score_cam")
+    assert set(first) == {"overlay_image", "overlay_display", "gradcam_image", "gradcam_display"}
+    assert Image.open(io.BytesIO(first["overlay_image"])).size == (130, 90)
+    assert render_overlays(image, wound_mask(), heat, result_id="r1", gradcam_mode="score_cam") == first
+    assert calls == ["overlay", "gradcam"]
+    # A new Grad-CAM mode only re-renders the Grad-CAM layer
+    render_overlays(image, wound_mask(), heat, result_id="r1", gradcam_mode="exact")
+    assert calls == ["overlay", "gradcam", "gradcam"]
+    assert set(render_overlays(image, wound_mask())) == {"overlay_image", "overlay_display"}
+
+
+def test_overlay_cache_evicts_least_recently_used():
+    cache = OverlayCache(max_bytes=10)
+    cache.put("a", {"image": b"1234"})
+    cache.put("b", {"image": b"1234"})
+    cache.get("a")
+    cache.put("c", {"image": b"1234"})
+    assert cache.get("b") is None and cache.get("a") is not None and len(cache) == 2
+    # Entries larger than the whole cache are returned but not kept
+    cache.put("big", {"image": b"x" * 11})
+    assert cache.get("big") is None
+
+
+def test_display_image_falls_back_to_the_full_image():
+    assert display_image({"overlay_display": b"small", "overlay_image": b"full"}, "overlay") == b"small"
+    assert display_image({"overlay_image": np.frombuffer(b"full", dtype=np.uint8)}, "overlay") == b"full"
+    assert display_image({}, "gradcam") is None
@@ -0,0 +1,104 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from backend.progress import SECONDS_PER_DAY, ProgressStore, get_progress_store, pack_mask, unpack_mask
+
+DAY = SECONDS_PER_DAY
+
+
+def visit(area_px, result_id, mask=None):
+    return {"result_id": result_id, "wound_class": "Ulcer", "confidence": 0.8, "mask": mask,
+            "metrics": {"area_px": area_px, "coverage": 0.1, "irregularity": 1.2}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ProgressStore(str(tmp_path / "progress.db"))
+
+
+def test_incremental_trend_matches_a_least_squares_fit(store):
+    # Recorded out of order, as when older photos are added later
+    days, areas = [0, 3, 1, 7, 10], [1000.0, 820.0, 950.0, 600.0, 480.0]
+    for day, area in zip(days, areas):
+        assert store.add_visit("p1", visit(area, f"r{day}"), timestamp=1e9 + day * DAY)
+    trend = store.trend("p1")
+    slope = np.polyfit(days, areas, 1)[0]
+    assert trend["visits"] == 5
+    assert trend["unit"] == "px"
+    assert trend["area_slope_per_day"] == pytest.approx(slope)
+    assert trend["healing_rate_per_week"] == pytest.approx(-slope * 7 / 1000.0)
+    assert trend["area_change"] == pytest.approx(-0.52)
+    assert trend["recent_rate_per_day"] == pytest.approx((480.0 - 600.0) / 3)
+    assert (trend["first_area"], trend["last_area"]) == (1000.0, 480.0)
+
+
+def test_rebuild_matches_the_running_sums(store):
+    for day, area in ((0, 500.0), (2, 450.0), (5, 300.0)):
+        store.add_visit("p1", visit(area, f"r{day}"), timestamp=1e9 + day * DAY)
+    before = store.trend("p1")
+    store.rebuild_trends()
+    assert store.trend("p1") == pytest.approx(before)
+
+
+def calibrated(area_cm2, result_id):
+    return {"result_id": result_id, "metrics": {"area_cm2": area_cm2, "length_mm": 30.0}}
+
+
+def test_duplicate_results_stay_out_of_the_trend(store):
+    assert store.add_visit("p1", visit(500.0, "r0"), timestamp=1e9)
+    assert not store.add_visit("p1", visit(500.0, "r0"), timestamp=1e9 + DAY)
+    assert store.trend("p1")["visits"] == 1
+    assert len(store.visits("p1")) == 1
+
+
+def test_a_calibrated_visit_restarts_the_trend_in_millimetres(store):
+    store.add_visit("p1", visit(500.0, "r0"), timestamp=1e9)
+    store.add_visit("p1", visit(450.0, "r1"), timestamp=1e9 + DAY)
+    assert store.trend("p1")["unit"] == "px"
+    store.add_visit("p1", calibrated(4.0, "r2"), timestamp=1e9 + 2 * DAY)
+    trend = store.trend("p1")
+    assert (trend["unit"], trend["visits"], trend["first_area"]) == ("mm", 1, pytest.approx(400.0))
+    # Pixel-only visits after that are kept in the history but not in the millimetre trend
+    store.add_visit("p1", visit(300.0, "r3"), timestamp=1e9 + 3 * DAY)
+    store.add_visit("p1", calibrated(3.0, "r4"), timestamp=1e9 + 4 * DAY)
+    trend = store.trend("p1")
+    assert (trend["unit"], trend["visits"]) == ("mm", 2)
+    assert trend["area_change"] == pytest.approx(-0.25)
+    assert trend["area_slope_per_day"] == pytest.approx(-50.0)
+    assert len(store.visits("p1")) == 5 and store.visits("p1")[0]["area"] == pytest.approx(300.0)
+    np.testing.assert_allclose(store.series("p1", unit="mm")["area"], [400.0, 300.0])
+    assert store.series("p1", unit="px")["area"].tolist() == [500.0, 450.0, 300.0]
+
+    store.rebuild_trends()
+    assert store.trend("p1") == pytest.approx(trend)
+
+
+def test_series_and_visit_ranges(store):
+    for day in range(4):
+        store.add_visit("p1", visit(100.0 - day, f"r{day}"), timestamp=1e9 + day * DAY)
+    series = store.series("p1", ("area", "confidence"), start=1e9 + DAY, end=1e9 + 3 * DAY)
+    np.testing.assert_array_equal(series["area"], [99.0, 98.0])
+    np.testing.assert_array_equal(series["confidence"], [0.8, 0.8])
+    assert [v["result_id"] for v in store.visits("p1", limit=2)] == ["r3", "r2"]
+    assert store.series("p2")["area"].shape == (0,)
+    with pytest.raises(ValueError):
+        store.series("p1", ("area; DROP TABLE visits",))
+
+
+def test_masks_are_stored_downscaled_and_bit_packed(store):
+    mask = np.zeros((400, 300), dtype=np.uint8)
+    mask[100:200, 50:250] = 1
+    blob, shape = pack_mask(mask, max_side=100)
+    assert shape == (100, 75)
+    assert len(blob) < mask.size // 8
+    np.testing.assert_array_equal(unpack_mask(blob, shape), mask[::4, ::4].astype(bool))
+
+    store.add_visit("p1", visit(100.0, "r0", mask=mask), timestamp=1e9)
+    stored = store.mask(store.visits("p1")[0]["id"])
+    assert stored.dtype == bool and stored.any()
+    assert store.patients().keys() == {"p1"}
+
+
+def test_default_store_uses_the_configured_database(isolated_data):
+    assert get_progress_store().path == str(isolated_data / "progress.db")
@@ -0,0 +1,85 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from backend import config, quality
+from backend.startup import READY, get_startup
+from backend.telemetry import get_metrics
+
+
+def skin_photo(brightness=1.0, noise=8.0, seed=0):
+    """A textured, skin-toned RGB array (sharp, well exposed) scaled by brightness"""
+    rng = np.random.default_rng(seed)
+    pixels = np.array([224, 172, 150]) + rng.normal(0, noise, (120, 160, 3))
+    return np.clip(pixels * brightness, 0, 255).astype(np.uint8)
+
+
+def issues(report):
+    return {issue: verdict for issue, verdict, _ in report.issues}
+
+
+def test_good_photo_passes():
+    report = quality.assess_quality(skin_photo(), mode="reject")
+    assert report.verdict == quality.OK
+    assert report.scores["skin"] > 0.9
+    assert "wound_probability" not in report.scores
+
+
+@pytest.mark.parametrize("photo, issue", [
+    (skin_photo(brightness=0.1), "dark"),
+    (skin_photo(noise=0.0), "blurry"),
+    (np.full((120, 160, 3), (60, 120, 200), dtype=np.uint8), "no_skin"),
+])
+def test_unusable_photos_are_rejected(photo, issue):
+    report = quality.assess_quality(photo, mode="reject")
+    assert report.rejected
+    assert issues(report)[issue] == quality.REJECT
+
+
+def test_warn_mode_never_rejects():
+    report = quality.assess_quality(skin_photo(brightness=0.1), mode="warn")
+    assert not report.rejected
+    assert issues(report)["dark"] == quality.WARN
+
+
+def test_thresholds_between_warn_and_reject_warn():
+    assert quality._check(0.2, "below", 0.25, 0.10) == quality.WARN
+    assert quality._check(0.05, "below", 0.25, 0.10) == quality.REJECT
+    assert quality._check(0.9, "above", 0.85, 0.95) == quality.WARN
+    assert quality._check(0.5, "above", 0.85, 0.95) == quality.OK
+
+
+def test_low_wound_probability_warns(monkeypatch):
+    monkeypatch.setattr(quality, "wound_probability", lambda pixels, model=None: 0.1)
+    report = quality.assess_quality(skin_photo(), classifier=object(), mode="reject")
+    assert report.scores["wound_probability"] == 0.1
+    assert issues(report) == {"no_wound": quality.WARN}
+
+
+def test_broken_classifier_is_skipped_and_not_retried(tmp_path, monkeypatch):
+    weights = tmp_path / "wound_presence.pt"
+    weights.write_bytes(b"not a checkpoint")
+    monkeypatch.setattr(config, "QUALITY_CLASSIFIER_WEIGHTS", str(weights))
+    monkeypatch.setattr(quality, "_broken_weights", set())
+    get_startup().status = READY
+    calls = []
+
+    def broken(pixels, model=None):
+        calls.append(model)
+        raise RuntimeError("bad checkpoint")
+
+    monkeypatch.setattr(quality, "wound_probability", broken)
+    errors = get_metrics().get("safeheal_quality_classifier_errors_total")
+    before = errors.value(error="RuntimeError")
+
+    assert quality.classifier_available()
+    report = quality.assess_quality(skin_photo(), mode="reject")
+    assert report.verdict == quality.OK
+    assert "wound_probability" not in report.scores
+    assert errors.value(error="RuntimeError") == before + 1
+
+    # The same checkpoint is not loaded again on the next upload
+    assert not quality.classifier_available()
+    quality.assess_quality(skin_photo(), mode="reject")
+    assert len(calls) == 1
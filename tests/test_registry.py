@@ -0,0 +1,95 @@
+import gc
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("timm")
+
+from backend.inference import ModelRegistry, resolve_model
+
+
+class Loader:
+    """Zero-argument loader returning a new model per call and counting the calls"""
+
+    def __init__(self, factory=object):
+        self.factory = factory
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+        return self.factory()
+
+
+def test_models_load_once_and_lazily():
+    registry = ModelRegistry()
+    loader = Loader()
+    registry.register("segmentation", loader)
+    handle = registry.acquire("segmentation")
+    assert loader.calls == 0
+    threads = [threading.Thread(target=registry.get, args=("segmentation",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == 1
+    assert resolve_model(handle) is registry.get("segmentation")
+    with pytest.raises(ValueError):
+        registry.register("segmentation", loader)
+    with pytest.raises(KeyError):
+        registry.get("unknown")
+
+
+def test_handles_hold_references_until_released_or_collected():
+    registry = ModelRegistry()
+    registry.register("classification", Loader())
+    first = registry.acquire("classification")
+    second = registry.acquire("classification")
+    assert registry.memory_report()["classification"]["refcount"] == 2
+
+    first.release()
+    first.release()
+    assert first.released
+    with pytest.raises(RuntimeError):
+        first.model
+    with pytest.raises(RuntimeError, match="1 handle"):
+        registry.unload("classification")
+
+    del second
+    gc.collect()
+    assert registry.memory_report()["classification"]["refcount"] == 0
+    registry.unload("classification")
+    assert not registry.is_loaded("classification")
+
+
+def test_reload_swaps_the_model_for_every_handle_and_rebuilds_dependents():
+    registry = ModelRegistry()
+    registry.register("segmentation", Loader())
+    fused = Loader(lambda: torch.nn.Linear(4, 4))
+    registry.register("fused", fused, depends_on=("segmentation",))
+    changed = []
+    registry.add_listener(changed.append)
+    handle = registry.acquire("segmentation")
+    old = handle.model
+    registry.get("fused")
+
+    registry.reload("segmentation")
+    assert handle.model is not old
+    assert changed == ["segmentation"]
+    assert not registry.is_loaded("fused")
+    registry.get("fused")
+    assert fused.calls == 2
+    # Built from the models it depends on, so not counted again
+    assert registry.memory_report()["fused"]["bytes"] == 0
+
+
+def test_warm_up_skips_models_loaded_on_first_use():
+    registry = ModelRegistry()
+    warmed = []
+    registry.register("classification", Loader(), warmup=warmed.append)
+    registry.register("wound_presence", Loader(), preload=False)
+    registry.warm_up()
+    assert registry.is_loaded("classification") and len(warmed) == 1
+    assert not registry.is_loaded("wound_presence")
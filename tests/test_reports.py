@@ -0,0 +1,78 @@
+import base64
+import re
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL.Image")
+
+from backend import report_generator
+from backend.report_generator import (
+    REPORT_IMAGES,
+    export_reports,
+    generate_report,
+    iter_report,
+    report_fields,
+    synthetic_analysis,
+    write_report,
+)
+
+
+def undated(report):
+    """A report without its generation time, which may tick over between two renders"""
+    return re.sub(r"Generated [^<]*", "Generated", report)
+
+
+def test_streamed_images_match_a_one_shot_encoding(monkeypatch):
+    analysis = synthetic_analysis(image_size=64)
+    whole = undated(generate_report(analysis))
+    # Small chunks so every image is split across many writes
+    monkeypatch.setattr(report_generator, "_BASE64_CHUNK", 3 * 16)
+    chunks = list(iter_report(analysis))
+    assert len(chunks) > 2 * len(REPORT_IMAGES) + 2
+    streamed = undated(b"".join(chunks).decode())
+    assert streamed == whole
+    for key, caption in REPORT_IMAGES:
+        encoded = base64.b64encode(analysis[f"{key}_image"]).decode()
+        assert f'alt="{caption}" src="data:image/jpeg;base64,{encoded}"/>' in streamed
+
+
+def test_cached_array_images_render_like_bytes():
+    analysis = synthetic_analysis(seed=1, image_size=32)
+    as_arrays = dict(analysis, **{
+        f"{key}_image": np.frombuffer(analysis[f"{key}_image"], dtype=np.uint8) for key, _ in REPORT_IMAGES
+    })
+    assert undated(generate_report(as_arrays)) == undated(generate_report(analysis))
+
+
+def test_fields_are_escaped_and_missing_images_skipped():
+    report = generate_report({
+        "wound_class": "<b>Burn</b>",
+        "confidence": 0.5,
+        "recommendations": ["Keep it clean & dry"],
+        "metrics": {"coverage": 0.125},
+    })
+    assert "&lt;b&gt;Burn&lt;/b&gt;" in report
+    assert "<li>Keep it clean &amp; dry</li>" in report
+    assert "<strong>Coverage:</strong> 12.5%" in report
+    assert "<img" not in report and report.endswith("</html>\n")
+
+
+def test_written_and_exported_reports_match_the_rendered_report(tmp_path):
+    analyses = [(f"patient-{seed}", synthetic_analysis(seed, image_size=32)) for seed in range(3)]
+    path = write_report(analyses[0][1], str(tmp_path / "single" / "report.html"))
+    with open(path, encoding="utf-8") as f:
+        assert undated(f.read()) == undated(generate_report(analyses[0][1]))
+
+    paths = export_reports(analyses, str(tmp_path / "batch"), workers=2, chunksize=1)
+    assert paths == [str(tmp_path / "batch" / f"{name}.html") for name, _ in analyses]
+    for path, (_, analysis) in zip(paths, analyses):
+        with open(path, encoding="utf-8") as f:
+            assert undated(f.read()) == undated(generate_report(report_fields(analysis)))
+    assert list((tmp_path / "batch").glob("*.tmp")) == []
+
+
+def test_export_defaults_to_the_reports_directory(isolated_data):
+    analysis = synthetic_analysis(image_size=16)
+    [path] = export_reports([("patient", analysis)], workers=1)
+    assert path == str(isolated_data / "results" / "reports" / "patient.html")
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from backend import config
+from backend.runtimes import BACKENDS, artifact_path, prepare_model
+
+# Backends that must reproduce the eager outputs; INT8 only has to stay close to them
+EXACT_BACKENDS = ("torchscript", "onnx")
+INT8_RELATIVE_ERROR = 0.2
+
+
+def inputs(count=3):
+    generator = torch.Generator().manual_seed(1)
+    return [torch.rand(1, 3, config.INPUT_SIZE, config.INPUT_SIZE, generator=generator) for _ in range(count)]
+
+
+@pytest.mark.parametrize("backend", ("torchscript", "int8_dynamic", "onnx"))
+def test_backend_matches_eager(tiny_models, backend):
+    if backend == "onnx":
+        pytest.importorskip("onnx")
+        pytest.importorskip("onnxruntime")
+    models = dict(zip(("segmentation", "classification"), tiny_models))
+    candidates = {name: prepare_model(model, f"test_{name}", backend) for name, model in models.items()}
+    with torch.no_grad():
+        for tensor in inputs():
+            for name, model in models.items():
+                reference = model(tensor)
+                output = candidates[name](tensor)
+                assert output.shape == reference.shape
+                if backend in EXACT_BACKENDS:
+                    torch.testing.assert_close(output, reference, atol=1e-4, rtol=1e-4)
+                else:
+                    error = torch.linalg.norm(output - reference) / torch.linalg.norm(reference)
+                    assert error < INT8_RELATIVE_ERROR
+
+
+def test_exported_artifacts_are_reused(tiny_models):
+    segmentation, _ = tiny_models
+    prepare_model(segmentation, "test_segmentation", "torchscript")
+    path = artifact_path("test_segmentation", "torchscript")
+    built = os.path.getmtime(path)
+    loaded = prepare_model(segmentation, "test_segmentation", "torchscript")
+    assert isinstance(loaded, torch.jit.ScriptModule)
+    assert os.path.getmtime(path) == built
+
+
+def test_eager_is_unchanged_and_unknown_backends_are_rejected(tiny_models):
+    segmentation, _ = tiny_models
+    assert "eager" in BACKENDS
+    assert prepare_model(segmentation, "test_segmentation", "eager") is segmentation
+    with pytest.raises(ValueError, match="Unknown execution backend"):
+        prepare_model(segmentation, "test_segmentation", "tensorrt")
@@ -0,0 +1,125 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from backend import config, similar
+from backend.similar import EXACT, IVF, CaseIndex, exact_search, normalize
+
+
+def clustered(count, dim=16, clusters=8, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    return centres[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dim))
+
+
+@pytest.fixture
+def index(tmp_path):
+    return CaseIndex(str(tmp_path), "test", exact_max=1000)
+
+
+def test_blockwise_exact_search_matches_a_full_sort():
+    vectors = normalize(clustered(300))
+    queries = normalize(clustered(5, seed=1))
+    rows, scores = exact_search(vectors, queries, 7, batch_rows=32)
+    full = queries @ vectors.T
+    np.testing.assert_array_equal(rows, np.argsort(-full, axis=1, kind="stable")[:, :7])
+    np.testing.assert_allclose(scores, np.sort(full, axis=1)[:, ::-1][:, :7], rtol=1e-6)
+
+
+def test_cases_are_stored_once_and_searched_by_cosine(index):
+    embeddings = clustered(20)
+    ids = index.add_many(embeddings, [{"result_id": f"r{i}", "sha256": f"s{i}"} for i in range(20)])
+    assert ids == list(range(1, 21))
+    assert index.add(embeddings[0] * 3, result_id="r0") is None
+    assert len(index) == 20 and index.dim == 16
+    with pytest.raises(ValueError):
+        index.add(np.ones(8))
+
+    found = index.search(embeddings[4] * 2, k=3)
+    assert found[0]["result_id"] == "r4"
+    assert found[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert [case["score"] for case in found] == sorted((case["score"] for case in found), reverse=True)
+    assert "r4" not in [case["result_id"] for case in index.search(embeddings[4], k=3, exclude=["s4"])]
+
+
+def test_ivf_probing_every_list_is_exact(index):
+    embeddings = clustered(400)
+    index.add_many(embeddings)
+    ivf = index.build(nlist=8)
+    queries = clustered(10, seed=2)
+    exact_rows, _ = index.search_rows(queries, 5, EXACT)
+    ivf_rows, _ = index.search_rows(queries, 5, IVF, nprobe=len(ivf.centroids))
+    np.testing.assert_array_equal(np.sort(ivf_rows, axis=1), np.sort(exact_rows, axis=1))
+
+
+def test_ivf_recall_on_clustered_cases(index):
+    index.add_many(clustered(2000))
+    index.build()
+    queries = clustered(50, seed=3)
+    exact_rows, _ = index.search_rows(queries, 10, EXACT)
+    ivf_rows, _ = index.search_rows(queries, 10, IVF, nprobe=12)
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(exact_rows, ivf_rows)])
+    assert recall >= 0.9
+
+
+def test_later_cases_join_the_lists_and_the_index_reloads(tmp_path, index):
+    index.add_many(clustered(200))
+    index.build(nlist=4)
+    late = clustered(1, seed=4)[0]
+    case_id = index.add(late, result_id="late")
+    rows, _ = index.search_rows(late, 1, IVF, nprobe=4)
+    assert rows[0, 0] == case_id - 1
+
+    reopened = CaseIndex(str(tmp_path), "test")
+    assert reopened.stats()["ivf_lists"] == 4
+    assert reopened.stats()["cases"] == 201
+    assert reopened.search(late, k=1, method=IVF)[0]["result_id"] == "late"
+
+
+def test_unbuilt_ivf_is_an_error(index):
+    index.add_many(clustered(10))
+    with pytest.raises(ValueError, match="has not been built"):
+        index.search_rows(clustered(1), 3, IVF)
+
+
+def test_analyses_are_indexed_and_exclude_their_own_image(index, monkeypatch):
+    monkeypatch.setattr(similar, "get_case_index", lambda: index)
+    embeddings = clustered(6)
+    for i, embedding in enumerate(embeddings):
+        analysis = {"embedding": embedding, "result_id": f"v-s{i}", "wound_class": "Burn", "depth": "Standard"}
+        assert similar.index_analysis(analysis, sha256=f"s{i}") == i + 1
+    assert similar.index_analysis({"embedding": None}) is None
+    query = {"embedding": embeddings[2], "result_id": "v-s2"}
+    assert "s2" not in [case["sha256"] for case in similar.similar_cases(query, k=3)]
+    assert similar.similar_cases({"embedding": None}) == []
+
+
+def test_index_follows_the_classifier_not_the_mask_settings(tmp_path, monkeypatch):
+    weights = tmp_path / "classifier.pth"
+    weights.write_bytes(b"v1")
+    monkeypatch.setattr(config, "CLASSIFICATION_WEIGHTS", str(weights))
+    version = similar.embedding_version()
+    monkeypatch.setattr(config, "MASK_THRESHOLD", 0.3)
+    monkeypatch.setattr(config, "TILE_SIZE", 256)
+    assert similar.embedding_version() == version
+    monkeypatch.setattr(config, "EMBEDDING_LAYER", "stages.3")
+    assert similar.embedding_version() != version
+    monkeypatch.undo()
+    monkeypatch.setattr(config, "CLASSIFICATION_WEIGHTS", str(weights))
+    weights.write_bytes(b"v2 checkpoint")
+    assert similar.embedding_version() != version
+
+
+def test_classifier_reload_reopens_the_index(monkeypatch):
+    pytest.importorskip("torch")
+    from backend.inference import ModelRegistry
+
+    registry = ModelRegistry()
+    registry.register("segmentation", object)
+    registry.register("classification", object)
+    registry.add_listener(similar.reset_case_index)
+    index = similar.get_case_index()
+    registry.reload("segmentation")
+    assert similar.get_case_index() is index
+    registry.reload("classification")
+    assert similar.get_case_index() is not index
@@ -0,0 +1,71 @@
+import pytest
+
+from backend import startup as startup_module
+from backend.startup import FAILED, LOADING, PENDING, READY, Startup, get_startup
+
+
+def test_phases_are_recorded_once():
+    startup = Startup(started=0.0)
+    startup.record("shell", 0.5)
+    startup.record("shell", 9.0)
+    startup.analysis_finished()
+    first = startup.timings["first_analysis"]
+    startup.analysis_finished()
+    snapshot = startup.snapshot()
+    assert snapshot["status"] == PENDING
+    assert snapshot["timings"] == {"shell": 0.5, "first_analysis": first}
+
+
+def test_a_failed_import_fails_the_warm_up(monkeypatch):
+    monkeypatch.setattr(startup_module, "HEAVY_MODULES", ("json", "backend.no_such_module"))
+    startup = Startup()
+    assert startup.start() is startup
+    assert startup.status in (LOADING, FAILED)
+    assert not startup.wait(5)
+    assert startup.status == FAILED
+    assert startup.error.startswith("ModuleNotFoundError")
+    assert "import:json" in startup.timings
+    assert "ready" not in startup.timings
+
+
+def test_warm_up_loads_the_registry_models(monkeypatch):
+    pytest.importorskip("numpy")
+    pytest.importorskip("torch")
+    import backend.cache
+    import backend.inference
+
+    class Registry:
+        def __init__(self):
+            self.warmed = None
+            self.listeners = []
+
+        def warm_up(self, names=None):
+            self.warmed = names
+
+        def add_listener(self, callback):
+            self.listeners.append(callback)
+
+    registry = Registry()
+    refreshed = []
+    monkeypatch.setattr(backend.cache.ResultCache, "refresh", lambda self: refreshed.append(True))
+    monkeypatch.setattr(startup_module, "HEAVY_MODULES", ())
+    monkeypatch.setattr(backend.inference, "get_registry", lambda: registry)
+    startup = Startup(models=["classification"])
+    assert startup.start().wait(30)
+    assert startup.status == READY
+    assert registry.warmed == ["classification"]
+    # Result cache invalidation and the similar-case index reset
+    assert len(registry.listeners) == 2
+    assert len(refreshed) == 1
+    for name in ("llm", "wound_presence", "classification", "fused"):
+        for listener in registry.listeners:
+            listener(name)
+    # Only reloads of models in the cache key check the cached results
+    assert len(refreshed) == 3
+    assert {"models", "ready"} <= set(startup.timings)
+
+
+def test_process_wide_startup_is_not_started_until_asked():
+    startup = get_startup()
+    assert startup is get_startup()
+    assert startup.status == PENDING
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from backend import config
+from backend.telemetry import MetricsRegistry, Trace, TraceLog, get_metrics, get_trace_log, span, trace
+
+
+def test_counter_gauge_and_histogram_render_as_prometheus_text():
+    metrics = MetricsRegistry()
+    requests = metrics.counter("test_requests_total", "Requests", ("route",))
+    requests.inc(route="/v1/analyze")
+    requests.inc(2, route="/v1/analyze")
+    metrics.gauge("test_queue", "Queued").set_function(lambda: 3)
+    metrics.histogram("test_seconds", "Latency", buckets=(0.1, 1.0)).observe(0.5)
+    text = metrics.render()
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{route="/v1/analyze"} 3' in text
+    assert "test_queue 3" in text
+    assert 'test_seconds_bucket{le="0.1"} 0' in text
+    assert 'test_seconds_bucket{le="1.0"} 1' in text
+    assert 'test_seconds_bucket{le="+Inf"} 1' in text
+    assert "test_seconds_count 1" in text
+
+
+def test_metrics_are_registered_once_per_name():
+    metrics = MetricsRegistry()
+    counter = metrics.counter("test_total", "Things", ("kind",))
+    assert metrics.counter("test_total", "Things", ("kind",)) is counter
+    with pytest.raises(ValueError):
+        metrics.gauge("test_total", "Things", ("kind",))
+    with pytest.raises(ValueError):
+        counter.inc(other="label")
+
+
+def test_gauge_function_is_dropped_when_it_returns_none():
+    gauge = MetricsRegistry().gauge("test_jobs", "Jobs", ("status",))
+    values = [2, None]
+    gauge.set_function(lambda: values.pop(0), status="pending")
+    assert 'test_jobs{status="pending"} 2' in gauge.render()
+    assert gauge.render()[2:] == []
+
+
+def test_spans_are_recorded_in_the_trace_with_errors():
+    errors = get_metrics().get("safeheal_stage_errors_total")
+    before = errors.value(stage="test_failing", error="KeyError")
+    with trace("test_request", "abc123") as current:
+        with span("test_stage", size=4):
+            pass
+        with pytest.raises(KeyError):
+            with span("test_failing"):
+                raise KeyError("missing")
+    assert [s["name"] for s in current.spans] == ["test_stage", "test_failing"]
+    assert current.spans[0]["size"] == 4
+    assert current.spans[1]["error"] == "KeyError"
+    assert current.seconds >= 0
+    assert errors.value(stage="test_failing", error="KeyError") == before + 1
+    assert get_trace_log().find("abc123") is current
+
+
+def _finished(name, seconds):
+    current = Trace(name)
+    current.seconds = seconds
+    return current
+
+
+def test_trace_log_keeps_the_slowest_and_their_profiles(tmp_path):
+    log = TraceLog(retention=2, slowest=2, directory=str(tmp_path))
+    for seconds in (0.3, 0.1, 0.5):
+        log.record(_finished(f"t{seconds}", seconds), {"app:main;app:analyze": 1})
+    assert [t.seconds for t in log.slowest_traces()] == [0.5, 0.3]
+    assert [t.name for t in log.recent()] == ["t0.5", "t0.1"]
+    # The trace pushed out of the slowest keeps no flame file
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(t.profile) for t in log.slowest_traces())
+    with open(log.slowest_traces()[0].profile) as f:
+        assert f.read() == "app:main;app:analyze 1\n"
+
+
+def test_trace_log_uses_the_profile_directory():
+    assert get_trace_log().directory == config.PROFILE_DIR
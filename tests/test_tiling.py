@@ -0,0 +1,74 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("timm")
+np = pytest.importorskip("numpy")
+
+from backend.inference import IMAGENET_MEAN, IMAGENET_STD, blend_window, segment_tiled, tile_origins
+
+
+def pixel_model():
+    """A per-pixel segmentation model (redder than skin is wound), so tiling can't change its output"""
+    model = torch.nn.Conv2d(3, 1, kernel_size=1)
+    with torch.no_grad():
+        model.weight.copy_(torch.tensor([1.0, -1.0, 0.0]).view(1, 3, 1, 1))
+        model.bias.fill_(-1.4)
+    return model.eval()
+
+
+def wound_photo(height, width):
+    """Skin-toned photo with a shaded background and an elliptical red wound"""
+    rows, cols = np.mgrid[:height, :width]
+    pixels = np.empty((height, width, 3), dtype=np.float32)
+    pixels[:] = (224, 172, 150)
+    pixels += (rows / height * 20)[..., None]
+    wound = ((rows - height / 2) / (height / 4)) ** 2 + ((cols - width / 2) / (width / 3)) ** 2 <= 1
+    pixels[wound] = (170, 40, 45)
+    return np.clip(pixels, 0, 255).astype(np.uint8), wound
+
+
+@torch.no_grad()
+def untiled_mask(pixels, model):
+    """The mask from one forward pass over the whole photo at full resolution"""
+    batch = (pixels.astype(np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+    logits = model(torch.from_numpy(batch.transpose(2, 0, 1))[None])[0, 0]
+    return (logits > 0).numpy().astype(np.uint8)
+
+
+def test_tile_origins_cover_the_image_and_end_flush():
+    assert tile_origins(100, 128, 32) == [0]
+    origins = tile_origins(300, 128, 32)
+    assert origins[0] == 0 and origins[-1] == 300 - 128
+    assert all(b - a <= 128 - 32 for a, b in zip(origins, origins[1:]))
+    window = blend_window(128, 32)
+    assert window.shape == (128, 128)
+    assert window[64, 64] == 1.0 and 0 < window[0, 0] < window[16, 16] < 1.0
+
+
+@pytest.mark.parametrize("shape", [(90, 70), (300, 410)], ids=["smaller_than_a_tile", "larger_than_a_tile"])
+def test_tiled_mask_matches_the_untiled_pass(shape):
+    pixels, wound = wound_photo(*shape)
+    model = pixel_model()
+    stats = {}
+    mask = segment_tiled(pixels, model, tile_size=128, overlap=32, batch_size=3, threshold=0.5,
+                         coarse_to_fine=False, stats=stats)
+    assert mask.shape == shape and mask.dtype == np.uint8
+    np.testing.assert_array_equal(mask, untiled_mask(pixels, model))
+    assert np.array_equal(mask.astype(bool), wound)
+    expected_tiles = 1 if shape[0] < 128 else len(tile_origins(shape[0], 128, 32)) * len(tile_origins(shape[1], 128, 32))
+    assert stats["tiles"] == stats["refined_tiles"] == expected_tiles
+
+
+def test_coarse_to_fine_only_refines_boundary_tiles():
+    pixels, wound = wound_photo(600, 800)
+    stats = {}
+    mask = segment_tiled(pixels, pixel_model(), tile_size=128, overlap=32, threshold=0.5,
+                         coarse_to_fine=True, stats=stats)
+    assert stats["coarse_to_fine"]
+    assert 0 < stats["refined_tiles"] < stats["tiles"]
+    assert (mask.astype(bool) == wound).mean() > 0.99
+
+
+def test_overlap_must_be_smaller_than_the_tile():
+    with pytest.raises(ValueError):
+        segment_tiled(np.zeros((64, 64, 3), dtype=np.uint8), pixel_model(), tile_size=64, overlap=64)
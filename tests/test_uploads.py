@@ -0,0 +1,72 @@
+import hashlib
+import io
+import mmap
+import os
+import time
+
+from backend.uploads import UploadStore, get_upload_store
+
+
+def store_at(tmp_path, **kwargs):
+    return UploadStore(str(tmp_path / "store"), **{"max_bytes": 1 << 20, "max_age": 0, **kwargs})
+
+
+def test_bytes_and_streams_share_one_content_addressed_file(tmp_path):
+    store = store_at(tmp_path)
+    data = b"wound photo" * 100
+    first = store.put(data, "photo.JPG")
+    assert first.sha256 == hashlib.sha256(data).hexdigest()
+    assert first.path.endswith(os.path.join(first.sha256[:2], first.sha256 + ".jpg"))
+    assert not first.duplicate
+
+    again = store.put(io.BytesIO(data), "copy.jpg")
+    assert again.duplicate
+    assert again.path == first.path
+    assert store.stats()["files"] == 1
+    assert [n for n in os.listdir(store.directory) if n.endswith(".tmp")] == []
+
+
+def test_find_and_open(tmp_path):
+    store = store_at(tmp_path)
+    stored = store.put(b"x" * 2048, "clip.mp4")
+    found = store.find(stored.sha256)
+    assert found.path == stored.path and found.size == 2048
+    assert store.find("0" * 64) is None
+    assert found.open(mmap_min_bytes=1 << 20) == b"x" * 2048
+    mapped = found.open(mmap_min_bytes=1024)
+    assert isinstance(mapped, mmap.mmap)
+    assert mapped[:] == b"x" * 2048
+    mapped.close()
+
+
+def test_size_budget_drops_least_recently_used(tmp_path):
+    store = store_at(tmp_path, max_bytes=2500)
+    old = store.put(b"a" * 1000)
+    newer = store.put(b"b" * 1000)
+    past = time.time() - 100
+    os.utime(old.path, (past, past))
+    os.utime(newer.path, (past + 1, past + 1))
+    # Touching the oldest file makes it the most recently used
+    assert store.find(old.sha256) is not None
+    store.put(b"c" * 1000)
+    assert store.find(old.sha256) is not None
+    assert store.find(newer.sha256) is None
+
+
+def test_age_retention_leaves_foreign_files_alone(tmp_path):
+    store = store_at(tmp_path, max_age=60)
+    stored = store.put(b"old upload")
+    past = time.time() - 120
+    os.utime(stored.path, (past, past))
+    notes = os.path.join(store.directory, "README")
+    with open(notes, "w") as f:
+        f.write("not an upload")
+    assert store.enforce() == 1
+    assert store.find(stored.sha256) is None
+    assert os.path.exists(notes)
+
+
+def test_default_store_uses_the_configured_directory(isolated_data):
+    store = get_upload_store()
+    assert store is get_upload_store()
+    assert store.directory == str(isolated_data / "uploads")
@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from backend import weights
+from backend.weights import flat_path, is_current, read_flat, read_index, shared_state_dict, write_flat
+
+
+def state_dict():
+    torch.manual_seed(0)
+    return {
+        "conv.weight": torch.randn(8, 3, 3, 3),
+        "conv.bias": torch.randn(8),
+        "half": torch.randn(5, 7).half(),
+        "bfloat": torch.randn(3).bfloat16(),
+        "steps": torch.tensor(42),
+        "ids": torch.arange(10, dtype=torch.int64).reshape(2, 5),
+        "flags": torch.tensor([True, False, True]),
+        "strided": torch.randn(6, 4).t(),
+        "empty": torch.empty(0, 4),
+    }
+
+
+def test_round_trip_keeps_names_dtypes_shapes_and_values(tmp_path):
+    expected = state_dict()
+    path = write_flat(expected, str(tmp_path / "model.flat"))
+    loaded = read_flat(path)
+    assert list(loaded) == list(expected)
+    for name, tensor in expected.items():
+        assert loaded[name].dtype == tensor.dtype and loaded[name].shape == tensor.shape
+        assert torch.equal(loaded[name], tensor)
+
+    index, start = read_index(path)
+    assert start % weights.ALIGNMENT == 0
+    assert all(entry["offset"] % weights.ALIGNMENT == 0 for entry in index["tensors"].values())
+    assert list(tmp_path.iterdir()) == [tmp_path / "model.flat"]
+
+
+def test_writes_to_mapped_tensors_never_reach_the_file(tmp_path, monkeypatch):
+    path = write_flat({"weight": torch.zeros(4)}, str(tmp_path / "model.flat"))
+    contents = (tmp_path / "model.flat").read_bytes()
+    read_flat(path)["weight"].fill_(1.0)
+    assert (tmp_path / "model.flat").read_bytes() == contents
+    # Another process maps the file afresh
+    monkeypatch.setattr(weights, "_maps", {})
+    assert torch.equal(read_flat(path)["weight"], torch.zeros(4))
+
+
+def test_other_files_are_not_flat_weights(tmp_path):
+    path = tmp_path / "model.pth"
+    torch.save(state_dict(), path)
+    with pytest.raises(ValueError):
+        read_index(str(path))
+    assert not is_current(str(path), str(path))
+    assert not is_current(str(tmp_path / "missing.flat"), str(path))
+
+
+def test_flat_file_is_rebuilt_when_the_checkpoint_changes(tmp_path):
+    source = str(tmp_path / "model.pth")
+    torch.save({"weight": torch.zeros(4)}, source)
+    reads = []
+
+    def read_checkpoint(path):
+        reads.append(path)
+        return torch.load(path)
+
+    assert flat_path(source) == str(tmp_path / "model.flat")
+    assert not is_current(flat_path(source), source)
+    assert torch.equal(shared_state_dict(source, read_checkpoint)["weight"], torch.zeros(4))
+    assert is_current(flat_path(source), source)
+    shared_state_dict(source, read_checkpoint)
+    assert reads == [source]
+
+    torch.save({"weight": torch.ones(6)}, source)
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not is_current(flat_path(source), source)
+    assert torch.equal(shared_state_dict(source, read_checkpoint)["weight"], torch.ones(6))
+    assert reads == [source, source]
+
+
+def test_flat_weights_load_the_same_model(tmp_path, tiny_models):
+    from backend.inference import load_classification_model
+
+    _, model = tiny_models
+    checkpoint = str(tmp_path / "classification.pth")
+    torch.save(model.state_dict(), checkpoint)
+    flat = load_classification_model("cpu", checkpoint, "flat")
+    assert is_current(flat_path(checkpoint), checkpoint)
+    batch = torch.randn(2, 3, 64, 64)
+    with torch.no_grad():
+        assert torch.equal(flat(batch), model(batch))